@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Trae Sync Agent Client
+通過共享SSH會話調用EC2端常駐同步代理 (sync_agent.py) 的JSON-RPC客戶端
+
+保持一個 `sync_agent.py --forward` 進程常駐，之後的每次調用只是在已打開的
+標準輸入輸出上寫一行請求、讀一行響應；響應之前到達的通知（例如同步進度）
+交給調用方的回調。轉發進程退出後在下一次調用時重新建立。
+"""
+
+import os
+import json
+import time
+import select
+import logging
+import threading
+import subprocess
+from typing import Callable, Dict, Optional
+
+from ssh_session import SSHSession
+
+logger = logging.getLogger(__name__)
+
+
+class AgentError(Exception):
+    """代理返回的JSON-RPC錯誤"""
+
+    def __init__(self, message: str, code: Optional[int] = None):
+        super().__init__(message)
+        self.code = code
+
+
+class AgentConnectionError(AgentError):
+    """與代理的連接中斷"""
+
+
+class AgentClient:
+    def __init__(self, ssh: SSHSession, command: str):
+        self.ssh = ssh
+        self.command = command
+        self._process: Optional[subprocess.Popen] = None
+        self._buffer = b""
+        self._next_id = 0
+        self._received = False
+        self._lock = threading.Lock()
+
+    def _ensure_process(self) -> subprocess.Popen:
+        """轉發進程不存在或已退出時重新啟動"""
+        if self._process is not None and self._process.poll() is None:
+            return self._process
+        if not self.ssh.ensure():
+            raise AgentConnectionError("無法建立SSH連接")
+        self._buffer = b""
+        # stderr繼承自當前進程，代理啟動失敗的提示會出現在日誌中
+        self._process = self.ssh.popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, bufsize=0)
+        return self._process
+
+    def _read_response(self, process: subprocess.Popen, request_id: int, deadline: Optional[float],
+                       on_notification: Optional[Callable[[Dict], None]] = None) -> Dict:
+        fd = process.stdout.fileno()
+        while True:
+            while b"\n" in self._buffer:
+                line, self._buffer = self._buffer.split(b"\n", 1)
+                if not line.strip():
+                    continue
+                message = json.loads(line)
+                if not isinstance(message, dict):
+                    continue
+                self._received = True
+                if message.get("id") == request_id:
+                    return message
+                if "id" not in message and on_notification is not None:
+                    on_notification(message)
+
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                raise TimeoutError("等待同步代理響應超時")
+            readable, _, _ = select.select([fd], [], [], remaining)
+            if not readable:
+                continue
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                raise AgentConnectionError("同步代理連接已關閉")
+            self._buffer += chunk
+
+    def call(self, method: str, params: Optional[Dict] = None, timeout: Optional[float] = None,
+             on_notification: Optional[Callable[[Dict], None]] = None):
+        """調用代理方法並返回result，連接中斷時重新連接一次"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            for attempt in range(2):
+                process = self._ensure_process()
+                self._next_id += 1
+                self._received = False
+                request = {"jsonrpc": "2.0", "id": self._next_id, "method": method, "params": params or {}}
+                try:
+                    process.stdin.write((json.dumps(request, ensure_ascii=False) + "\n").encode("utf-8"))
+                    response = self._read_response(process, self._next_id, deadline, on_notification)
+                    break
+                except (BrokenPipeError, AgentConnectionError) as e:
+                    self.close()
+                    # 已經收到進度通知說明請求已在執行，不能重發
+                    if attempt or self._received:
+                        raise AgentConnectionError(str(e))
+                    logger.warning(f"同步代理連接中斷，重新連接: {e}")
+                except TimeoutError:
+                    # 響應可能在之後到達，丟棄這個連接避免錯位
+                    self.close(force=True)
+                    raise
+
+        error = response.get("error")
+        if error:
+            raise AgentError(error.get("message", "未知錯誤"), error.get("code"))
+        return response.get("result")
+
+    def close(self, force: bool = False):
+        """關閉轉發進程，force為True時直接終止"""
+        process, self._process = self._process, None
+        self._buffer = b""
+        if process is None:
+            return
+        if force:
+            process.kill()
+        try:
+            process.stdin.close()
+        except OSError:
+            pass
+        try:
+            process.wait(timeout=2)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
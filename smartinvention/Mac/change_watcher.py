@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Trae Change Watcher
+事件驅動的變化檢測，取代固定間隔輪詢
+
+監視 state.vscdb、其WAL文件以及 .ckg/storage 目錄，使用操作系統的文件
+通知接口：macOS上使用kqueue，Linux上使用inotify，其他情況回退到輪詢。
+檢測到變化後等待事件平靜下來（防抖）再喚醒調用方。
+"""
+
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import logging
+from typing import Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# 防抖：最後一個事件後保持平靜的時間，以及從第一個事件起的最長等待
+DEFAULT_DEBOUNCE = 2.0
+DEFAULT_MAX_DELAY = 30.0
+DEFAULT_POLL_INTERVAL = 2.0
+
+
+def trae_watch_targets(trae_app_support: str, state_db: str) -> Dict[str, List[str]]:
+    """Trae需要監視的文件和目錄"""
+    return {
+        "files": [state_db, state_db + "-wal"],
+        "trees": [os.path.join(trae_app_support, "User/globalStorage/.ckg/storage")]
+    }
+
+
+def _tree_paths(tree: str) -> List[str]:
+    """目錄本身、其子目錄以及子目錄中的文件"""
+    paths = [tree]
+    try:
+        with os.scandir(tree) as it:
+            subdirs = [entry.path for entry in it if entry.is_dir()]
+    except OSError:
+        return paths
+    for subdir in subdirs:
+        paths.append(subdir)
+        try:
+            with os.scandir(subdir) as it:
+                paths.extend(entry.path for entry in it if entry.is_file())
+        except OSError:
+            continue
+    return paths
+
+
+class PollingBackend:
+    """輪詢後端：定期比較文件狀態"""
+
+    name = "polling"
+
+    def __init__(self, files: Sequence[str], trees: Sequence[str], poll_interval: float = DEFAULT_POLL_INTERVAL):
+        self.files = list(files)
+        self.trees = list(trees)
+        self.poll_interval = poll_interval
+        self._signature = self._current_signature()
+
+    def _current_signature(self):
+        signature = []
+        paths = list(self.files)
+        for tree in self.trees:
+            paths.extend(_tree_paths(tree))
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                signature.append((path, stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                signature.append((path, None, None))
+        return signature
+
+    def wait(self, timeout: Optional[float]) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            signature = self._current_signature()
+            if signature != self._signature:
+                self._signature = signature
+                return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            delay = self.poll_interval if deadline is None else min(self.poll_interval, deadline - time.monotonic())
+            time.sleep(max(0.0, delay))
+
+    def close(self):
+        pass
+
+
+class InotifyBackend:
+    """Linux inotify後端：監視目錄，按文件名過濾事件"""
+
+    name = "inotify"
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_ISDIR = 0x40000000
+    WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+                  IN_CREATE | IN_DELETE | IN_DELETE_SELF)
+    EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self, files: Sequence[str], trees: Sequence[str]):
+        import ctypes
+        import ctypes.util
+
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        # wd -> (目錄, 關注的文件名；None表示目錄中的任何變化, 是否為監視樹的根)
+        self.watches: Dict[int, tuple] = {}
+        file_dirs: Dict[str, set] = {}
+        for path in files:
+            file_dirs.setdefault(os.path.dirname(path), set()).add(os.path.basename(path))
+        for directory, names in file_dirs.items():
+            self._add_watch(directory, names, False)
+        for tree in trees:
+            self._add_watch(tree, None, True)
+            for path in _tree_paths(tree)[1:]:
+                if os.path.isdir(path):
+                    self._add_watch(path, None, False)
+
+    def _add_watch(self, directory: str, names, is_root: bool):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), self.WATCH_MASK)
+        if wd < 0:
+            logger.debug(f"無法監視目錄: {directory}")
+            return
+        self.watches[wd] = (directory, names, is_root)
+
+    def _read_events(self) -> bool:
+        changed = False
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except OSError as e:
+                if e.errno == errno.EAGAIN:
+                    return changed
+                raise
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = self.EVENT_HEADER.unpack_from(data, offset)
+                offset += self.EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+                offset += length
+
+                watch = self.watches.get(wd)
+                if watch is None:
+                    continue
+                directory, names, is_root = watch
+                if names is not None and name not in names:
+                    continue
+                # 監視樹中新建的用戶目錄需要加入監視
+                if is_root and mask & self.IN_ISDIR and mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    self._add_watch(os.path.join(directory, name), None, False)
+                changed = True
+
+    def wait(self, timeout: Optional[float]) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            readable, _, _ = select.select([self.fd], [], [], remaining)
+            if not readable:
+                return False
+            if self._read_events():
+                return True
+
+    def close(self):
+        os.close(self.fd)
+
+
+class KqueueBackend:
+    """macOS / BSD kqueue後端：對每個文件和目錄註冊VNODE事件"""
+
+    name = "kqueue"
+
+    # O_EVTONLY只用於接收事件，不會阻止卷被卸載
+    O_EVTONLY = 0x8000 if sys.platform == "darwin" else os.O_RDONLY
+
+    def __init__(self, files: Sequence[str], trees: Sequence[str]):
+        self.files = list(files)
+        self.trees = list(trees)
+        self.kq = select.kqueue()
+        self.fds: Dict[str, int] = {}
+        self._sync_watches()
+
+    def _targets(self) -> List[str]:
+        # 文件不存在時（例如WAL被刪除）監視其所在目錄，等待重新創建
+        targets = set()
+        for path in self.files:
+            targets.add(path if os.path.exists(path) else os.path.dirname(path))
+        for tree in self.trees:
+            targets.update(_tree_paths(tree))
+        return sorted(targets)
+
+    def _sync_watches(self):
+        """重新打開已被刪除或替換的文件，註冊新出現的文件"""
+        targets = set(self._targets())
+        for path in list(self.fds):
+            if path not in targets or not os.path.exists(path):
+                os.close(self.fds.pop(path))
+
+        fflags = (select.KQ_NOTE_WRITE | select.KQ_NOTE_EXTEND | select.KQ_NOTE_DELETE |
+                  select.KQ_NOTE_RENAME | select.KQ_NOTE_ATTRIB)
+        for path in targets - set(self.fds):
+            try:
+                fd = os.open(path, self.O_EVTONLY)
+            except OSError:
+                continue
+            event = select.kevent(fd, filter=select.KQ_FILTER_VNODE,
+                                  flags=select.KQ_EV_ADD | select.KQ_EV_CLEAR, fflags=fflags)
+            self.kq.control([event], 0)
+            self.fds[path] = fd
+
+    def wait(self, timeout: Optional[float]) -> bool:
+        events = self.kq.control(None, 64, timeout)
+        if not events:
+            return False
+        self._sync_watches()
+        return True
+
+    def close(self):
+        for fd in self.fds.values():
+            os.close(fd)
+        self.fds.clear()
+        self.kq.close()
+
+
+class ChangeWatcher:
+    def __init__(self, files: Sequence[str], trees: Sequence[str] = (), debounce: float = DEFAULT_DEBOUNCE,
+                 max_delay: float = DEFAULT_MAX_DELAY, backend: str = "auto",
+                 poll_interval: float = DEFAULT_POLL_INTERVAL):
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.backend = self._create_backend(backend, files, trees, poll_interval)
+        logger.info(f"👀 變化監視已啟動 ({self.backend.name})")
+
+    @staticmethod
+    def _create_backend(backend: str, files, trees, poll_interval):
+        if backend in ("auto", "kqueue") and hasattr(select, "kqueue"):
+            return KqueueBackend(files, trees)
+        if backend in ("auto", "inotify") and sys.platform.startswith("linux"):
+            try:
+                return InotifyBackend(files, trees)
+            except Exception as e:
+                logger.warning(f"inotify不可用，回退到輪詢: {e}")
+        return PollingBackend(files, trees, poll_interval)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """等待變化，返回True表示有變化（已防抖），False表示超時"""
+        if not self.backend.wait(timeout):
+            return False
+
+        # 一次寫入通常觸發一連串事件，等待平靜後再返回
+        deadline = time.monotonic() + self.max_delay
+        while True:
+            remaining = min(self.debounce, deadline - time.monotonic())
+            if remaining <= 0 or not self.backend.wait(remaining):
+                return True
+
+    def close(self):
+        self.backend.close()
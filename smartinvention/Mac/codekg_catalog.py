@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Trae CodeKG Repository Catalog
+共享的CodeKG倉庫目錄，供監控工具、同步守護進程和倉庫發現工具使用
+
+緩存 User/globalStorage/.ckg/storage 下的 *_codekg.db 列表，只有存儲目錄
+或其用戶子目錄的mtime變化時才重新遍歷，不再打開每個數據庫測試訪問。
+"""
+
+import os
+import logging
+import threading
+from typing import Dict, List, Set
+
+logger = logging.getLogger(__name__)
+
+CODEKG_SUFFIX = "_codekg.db"
+EXCLUDED_NAMES = ("Shared", "temp")
+
+
+def parse_repository_name(file_name: str) -> str:
+    """從CodeKG數據庫文件名提取倉庫名稱"""
+    if not file_name.endswith(CODEKG_SUFFIX):
+        return ""
+    return file_name[:-len(CODEKG_SUFFIX)]
+
+
+class CodeKGCatalog:
+    def __init__(self, trae_app_support: str):
+        self.storage_path = os.path.join(trae_app_support, "User/globalStorage/.ckg/storage")
+        self._entries: List[Dict] = []
+        self._signature = None
+        self._lock = threading.Lock()
+
+    @property
+    def exists(self) -> bool:
+        return os.path.isdir(self.storage_path)
+
+    def _current_signature(self):
+        """存儲目錄及各用戶子目錄的mtime，文件增刪會改變所在目錄的mtime"""
+        try:
+            root_mtime = os.stat(self.storage_path).st_mtime_ns
+            with os.scandir(self.storage_path) as it:
+                user_dirs = sorted((entry.name, entry.stat().st_mtime_ns) for entry in it if entry.is_dir())
+            return root_mtime, tuple(user_dirs)
+        except OSError:
+            return None
+
+    def refresh(self, force: bool = False) -> bool:
+        """目錄有變化時重新遍歷，返回是否重新掃描"""
+        with self._lock:
+            signature = self._current_signature()
+            if not force and signature is not None and signature == self._signature:
+                return False
+
+            entries = []
+            if signature is not None:
+                for user_dir in sorted(os.listdir(self.storage_path)):
+                    user_path = os.path.join(self.storage_path, user_dir)
+                    if not os.path.isdir(user_path):
+                        continue
+
+                    for file in sorted(os.listdir(user_path)):
+                        repo_name = parse_repository_name(file)
+                        if not repo_name or repo_name in EXCLUDED_NAMES:
+                            continue
+
+                        db_path = os.path.join(user_path, file)
+                        entries.append({
+                            "name": repo_name,
+                            "db_path": db_path,
+                            "user_dir": user_dir,
+                            "accessible": os.access(db_path, os.R_OK)
+                        })
+
+            self._entries = entries
+            self._signature = signature
+            logger.debug(f"CodeKG目錄已刷新: {len(entries)} 個數據庫")
+            return True
+
+    def entries(self) -> List[Dict]:
+        """返回所有CodeKG數據庫記錄"""
+        self.refresh()
+        return [dict(entry) for entry in self._entries]
+
+    def repository_names(self) -> Set[str]:
+        """返回去重後的倉庫名稱"""
+        return {entry["name"] for entry in self.entries()}
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Trae Discovery Index
+為倉庫發現工具提供持久化的文件指紋索引
+
+每個來源文件以 路徑 + 大小 + mtime 作為指紋，SQLite數據庫額外記錄
+WAL文件的狀態和文件頭的變更計數器。指紋未變的文件直接返回上次提取的
+倉庫名稱，不再重新打開和掃描。
+"""
+
+import os
+import json
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INDEX_FILE = os.path.expanduser("~/.trae_discovery_index.json")
+# 掃描邏輯變化時遞增，使舊索引失效
+INDEX_VERSION = 2
+
+
+class DiscoveryIndex:
+    def __init__(self, index_file: str = None, rebuild: bool = False):
+        self.index_file = Path(index_file or DEFAULT_INDEX_FILE)
+        self.rebuild = rebuild
+        self.entries: Dict[str, Dict] = {}
+        self.seen: Set[str] = set()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if not rebuild:
+            self.load()
+
+    def load(self):
+        """從磁盤加載索引"""
+        try:
+            if not self.index_file.exists():
+                return
+            with open(self.index_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") != INDEX_VERSION:
+                logger.info("索引版本不符，將重新建立")
+                return
+            self.entries = data.get("entries", {})
+            logger.debug(f"已加載索引: {len(self.entries)} 條記錄")
+        except Exception as e:
+            logger.warning(f"加載索引失敗，將重新建立: {e}")
+            self.entries = {}
+
+    def save(self):
+        """保存索引到磁盤，並移除本次未出現的文件"""
+        try:
+            entries = {key: value for key, value in self.entries.items() if key in self.seen}
+            self.index_file.parent.mkdir(parents=True, exist_ok=True)
+            temp_file = self.index_file.with_name(self.index_file.name + ".tmp")
+            with open(temp_file, "w", encoding="utf-8") as f:
+                json.dump({"version": INDEX_VERSION, "entries": entries}, f, ensure_ascii=False)
+            os.replace(temp_file, self.index_file)
+            self.entries = entries
+            logger.debug(f"索引已保存: {self.index_file} ({len(entries)} 條記錄)")
+        except Exception as e:
+            logger.error(f"保存索引時出錯: {e}")
+
+    @staticmethod
+    def fingerprint(path: Path, sqlite: bool = False) -> Optional[list]:
+        """計算文件指紋，文件不存在時返回None"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+
+        fingerprint = [stat.st_size, stat.st_mtime_ns]
+        if sqlite:
+            # WAL模式下寫入只修改-wal文件，主文件的mtime不一定變化
+            try:
+                wal_stat = os.stat(f"{path}-wal")
+                fingerprint += [wal_stat.st_size, wal_stat.st_mtime_ns]
+            except OSError:
+                fingerprint += [0, 0]
+            # 文件頭偏移24處的4字節為SQLite的文件變更計數器
+            try:
+                with open(path, "rb") as f:
+                    header = f.read(28)
+                fingerprint.append(int.from_bytes(header[24:28], "big") if len(header) == 28 else 0)
+            except OSError:
+                fingerprint.append(0)
+        return fingerprint
+
+    def lookup(self, source: str, path: Path, fingerprint: Optional[list]) -> Optional[Set[str]]:
+        """查詢索引，指紋一致時返回已提取的倉庫名稱"""
+        key = f"{source}:{path}"
+        with self._lock:
+            self.seen.add(key)
+            entry = self.entries.get(key)
+            if fingerprint is not None and entry is not None and entry.get("fingerprint") == fingerprint:
+                self.hits += 1
+                return set(entry.get("repos", []))
+            self.misses += 1
+            return None
+
+    def store(self, source: str, path: Path, fingerprint: Optional[list], repos: Set[str]):
+        """記錄文件的指紋和提取結果"""
+        if fingerprint is None:
+            return
+        key = f"{source}:{path}"
+        with self._lock:
+            self.seen.add(key)
+            self.entries[key] = {"fingerprint": fingerprint, "repos": sorted(repos)}
+
+    def stats(self) -> Dict:
+        """返回命中統計"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self.seen),
+            "rebuild": self.rebuild,
+            "index_file": str(self.index_file)
+        }
@@ -117,6 +117,9 @@ echo ""
 echo "📝 手動執行一次同步:"
 echo "   python3 $SCRIPT_PATH --sync-once"
 echo ""
+echo "🗓️ 查看同步調度隊列:"
+echo "   python3 $SCRIPT_PATH --queue"
+echo ""
 echo "🔍 監控連接狀態:"
 echo "   python3 /home/alexchuang/aiengine/trae/mac/mcp_monitor.py"
 echo ""
@@ -8,45 +8,119 @@ import os
 import sys
 import time
 import json
-import psutil
 import sqlite3
-import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from datetime import datetime
 from pathlib import Path
 
+from change_watcher import ChangeWatcher, trae_watch_targets
+from codekg_catalog import CodeKGCatalog
+from process_scanner import ProcessScanner
+from ssh_session import SSHSession
+
+# 各項檢查的截止時間（秒），超時則使用上一次的結果
+CHECK_DEADLINES = {
+    "trae_running": 3,
+    "mcp_running": 3,
+    "database_accessible": 5,
+    "ssh_connection": 6,
+    "repositories": 3
+}
+
+class CheckRunner:
+    """並行執行所有檢查，每項檢查有獨立的截止時間和過期結果回退"""
+    
+    def __init__(self, max_workers: int = 8):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="check")
+        self.last_results = {}
+        self.pending = {}
+        self._lock = threading.Lock()
+    
+    def _record(self, name: str, started: float, future):
+        """檢查完成時記錄結果，包括已超時但在後台完成的檢查"""
+        with self._lock:
+            if self.pending.get(name) is future:
+                del self.pending[name]
+            if future.exception() is None:
+                self.last_results[name] = {
+                    "value": future.result(),
+                    "duration": round(time.monotonic() - started, 3),
+                    "completed_at": time.monotonic()
+                }
+    
+    def run(self, checks: dict) -> tuple:
+        """
+        同時啟動所有檢查 {名稱: (函數, 截止時間, 默認值)}
+        返回 (結果, 元數據)，總耗時不超過最慢一項檢查的截止時間
+        """
+        start = time.monotonic()
+        futures = {}
+        
+        for name, (check, deadline, default) in checks.items():
+            with self._lock:
+                future = self.pending.get(name)
+                submitted = future is None
+                if submitted:
+                    # 上一輪超時的檢查仍在運行時不重複啟動
+                    future = self.executor.submit(check)
+                    self.pending[name] = future
+            if submitted:
+                future.add_done_callback(lambda f, n=name, t=time.monotonic(): self._record(n, t, f))
+            futures[name] = future
+        
+        results = {}
+        meta = {}
+        for name, (check, deadline, default) in checks.items():
+            remaining = max(0.0, start + deadline - time.monotonic())
+            try:
+                results[name] = futures[name].result(timeout=remaining)
+                meta[name] = {"stale": False}
+            except FutureTimeoutError:
+                with self._lock:
+                    last = self.last_results.get(name)
+                results[name] = last["value"] if last else default
+                meta[name] = {
+                    "stale": True,
+                    "age": round(time.monotonic() - last["completed_at"], 1) if last else None
+                }
+            except Exception:
+                results[name] = default
+                meta[name] = {"stale": False, "error": True}
+        
+        return results, meta
+
 class MCPConnectionMonitor:
     def __init__(self):
         self.trae_app_support = "/Users/alexchuang/Library/Application Support/Trae"
         self.status_file = "/tmp/mcp_trae_status_mac.json"
+        self.state_db = os.path.join(
+            self.trae_app_support,
+            "User/workspaceStorage/f002a9b85f221075092022809f5a075f/state.vscdb"
+        )
+        self.catalog = CodeKGCatalog(self.trae_app_support)
+        self.processes = ProcessScanner()
+        self.runner = CheckRunner()
+        self.ssh = SSHSession(host="serveo.net", port=41269, user="alexchuang")
         
     def check_trae_process(self) -> bool:
         """檢查Trae進程是否運行"""
         try:
-            for proc in psutil.process_iter(['pid', 'name', 'cmdline']):
-                if 'Trae' in proc.info['name'] or any('Trae' in cmd for cmd in proc.info['cmdline'] or []):
-                    return True
-            return False
+            return self.processes.is_running("trae")
         except Exception:
             return False
     
     def check_mcp_process(self) -> bool:
         """檢查MCP相關進程"""
         try:
-            for proc in psutil.process_iter(['pid', 'name', 'cmdline']):
-                cmdline = proc.info['cmdline'] or []
-                if any('mcp' in cmd.lower() for cmd in cmdline):
-                    return True
-            return False
+            return self.processes.is_running("mcp")
         except Exception:
             return False
     
     def check_trae_database(self) -> bool:
         """檢查Trae數據庫是否可訪問"""
         try:
-            db_path = os.path.join(
-                self.trae_app_support,
-                "User/workspaceStorage/f002a9b85f221075092022809f5a075f/state.vscdb"
-            )
+            db_path = self.state_db
             
             if not os.path.exists(db_path):
                 return False
@@ -70,42 +144,16 @@ class MCPConnectionMonitor:
         }
         
         try:
-            ckg_storage_path = os.path.join(
-                self.trae_app_support,
-                "User/globalStorage/.ckg/storage"
-            )
-            
-            if not os.path.exists(ckg_storage_path):
-                return repos_info
-            
-            for user_dir in os.listdir(ckg_storage_path):
-                user_path = os.path.join(ckg_storage_path, user_dir)
-                if not os.path.isdir(user_path):
-                    continue
-                
-                for file in os.listdir(user_path):
-                    if file.endswith("_codekg.db"):
-                        repo_name = file.split("_")[0]
-                        if repo_name and repo_name not in ["Shared"]:
-                            repos_info["total_repos"] += 1
-                            
-                            # 檢查數據庫是否可訪問
-                            db_path = os.path.join(user_path, file)
-                            try:
-                                conn = sqlite3.connect(db_path, timeout=2)
-                                conn.close()
-                                repos_info["accessible_repos"] += 1
-                                repos_info["repositories"].append({
-                                    "name": repo_name,
-                                    "status": "accessible",
-                                    "db_path": db_path
-                                })
-                            except Exception:
-                                repos_info["repositories"].append({
-                                    "name": repo_name,
-                                    "status": "inaccessible",
-                                    "db_path": db_path
-                                })
+            # 目錄未變化時直接使用緩存，不再遍歷和打開數據庫
+            for entry in self.catalog.entries():
+                repos_info["total_repos"] += 1
+                if entry["accessible"]:
+                    repos_info["accessible_repos"] += 1
+                repos_info["repositories"].append({
+                    "name": entry["name"],
+                    "status": "accessible" if entry["accessible"] else "inaccessible",
+                    "db_path": entry["db_path"]
+                })
             
             return repos_info
             
@@ -114,29 +162,27 @@ class MCPConnectionMonitor:
     
     def check_ssh_connection(self) -> bool:
         """檢查SSH連接到EC2服務器"""
-        try:
-            result = subprocess.run([
-                "ssh",
-                "-o", "StrictHostKeyChecking=no",
-                "-o", "ConnectTimeout=5",
-                "-p", "41269",
-                "alexchuang@serveo.net",
-                "echo 'SSH連接測試'"
-            ], capture_output=True, text=True, timeout=10)
-            
-            return result.returncode == 0
-        except Exception:
-            return False
+        # 複用共享的SSH主連接，不再每次握手
+        return self.ssh.probe(timeout=CHECK_DEADLINES["ssh_connection"])
     
     def get_connection_status(self) -> dict:
         """獲取完整的連接狀態"""
+        empty_repos = {"total_repos": 0, "accessible_repos": 0, "repositories": []}
+        checks = {
+            "trae_running": (self.check_trae_process, CHECK_DEADLINES["trae_running"], False),
+            "mcp_running": (self.check_mcp_process, CHECK_DEADLINES["mcp_running"], False),
+            "database_accessible": (self.check_trae_database, CHECK_DEADLINES["database_accessible"], False),
+            "ssh_connection": (self.check_ssh_connection, CHECK_DEADLINES["ssh_connection"], False),
+            "repositories": (self.check_git_repositories, CHECK_DEADLINES["repositories"], empty_repos)
+        }
+        
+        # 所有檢查並行執行，耗時由最慢的一項決定而不是所有檢查之和
+        results, meta = self.runner.run(checks)
+        
         status = {
             "timestamp": datetime.now().isoformat(),
-            "trae_running": self.check_trae_process(),
-            "mcp_running": self.check_mcp_process(),
-            "database_accessible": self.check_trae_database(),
-            "ssh_connection": self.check_ssh_connection(),
-            "repositories": self.check_git_repositories(),
+            **results,
+            "stale_checks": [name for name, info in meta.items() if info.get("stale")],
             "connection_ready": False,
             "platform": "mac"
         }
@@ -185,6 +231,8 @@ class MCPConnectionMonitor:
         print(f"🌐 SSH連接: {'✅' if status['ssh_connection'] else '❌'}")
         print(f"📦 倉庫: {status['repositories']['accessible_repos']}/{status['repositories']['total_repos']} 可訪問")
         print(f"🚀 同步就緒: {'✅' if status['connection_ready'] else '❌'}")
+        if status.get('stale_checks'):
+            print(f"⏳ 超時使用上次結果: {', '.join(status['stale_checks'])}")
         
         if status['repositories']['repositories']:
             print("\n📋 倉庫列表:")
@@ -200,14 +248,40 @@ def main():
         print("🔍 開始持續監控MCP與Trae連接狀態 (Mac端)...")
         print("按 Ctrl+C 停止監控\n")
         
+        interval = 10
+        try:
+            next_tick = time.monotonic()
+            while True:
+                status = monitor.monitor_once()
+                monitor.print_status(status)
+                print("-" * 50)
+                
+                # 按固定節奏執行，檢查耗時不會累積到間隔中
+                next_tick += interval
+                now = time.monotonic()
+                if next_tick < now:
+                    next_tick += ((now - next_tick) // interval + 1) * interval
+                time.sleep(next_tick - now)
+        except KeyboardInterrupt:
+            print("\n🛑 監控已停止")
+    elif len(sys.argv) > 1 and sys.argv[1] == "--watch":
+        print("👀 開始事件驅動監控MCP與Trae連接狀態 (Mac端)...")
+        print("按 Ctrl+C 停止監控\n")
+        
+        targets = trae_watch_targets(monitor.trae_app_support, monitor.state_db)
+        watcher = ChangeWatcher(targets["files"], targets["trees"])
         try:
             while True:
                 status = monitor.monitor_once()
                 monitor.print_status(status)
                 print("-" * 50)
-                time.sleep(10)
+                
+                # 只在Trae數據變化時重新檢查，無變化時每分鐘檢查一次
+                watcher.wait(timeout=60)
         except KeyboardInterrupt:
             print("\n🛑 監控已停止")
+        finally:
+            watcher.close()
     else:
         # 執行一次檢查
         status = monitor.monitor_once()
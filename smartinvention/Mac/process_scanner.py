@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Trae Process Scanner
+單次進程表快照，回答Trae / MCP等所有進程存活檢查
+
+一次 psutil.process_iter 遍歷同時評估所有規則，並緩存匹配到的PID。
+只有緩存的PID消失（或被複用）或緩存超時時才重新遍歷進程表。
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Callable, Dict, List, Optional
+
+import psutil
+
+logger = logging.getLogger(__name__)
+
+# 規則: (進程名, 命令行參數列表) -> 是否匹配
+DEFAULT_RULES: Dict[str, Callable[[str, List[str]], bool]] = {
+    "trae": lambda name, cmdline: 'Trae' in name or any('Trae' in arg for arg in cmdline),
+    "mcp": lambda name, cmdline: any('mcp' in arg.lower() for arg in cmdline)
+}
+
+
+class ProcessScanner:
+    def __init__(self, rules: Optional[Dict[str, Callable]] = None, max_age: float = 30.0):
+        self.rules = dict(rules or DEFAULT_RULES)
+        self.max_age = max_age
+        self.scan_count = 0
+        self._matches: Dict[str, Dict[int, float]] = {rule: {} for rule in self.rules}
+        self._scanned_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def _scan(self):
+        """遍歷一次進程表，評估所有規則"""
+        matches = {rule: {} for rule in self.rules}
+        own_pid = os.getpid()
+
+        for proc in psutil.process_iter(['pid', 'name', 'cmdline', 'create_time']):
+            info = proc.info
+            # 排除監控程序自身，否則命令行中的mcp總是匹配
+            if info['pid'] == own_pid:
+                continue
+            name = info.get('name') or ''
+            cmdline = info.get('cmdline') or []
+            for rule, predicate in self.rules.items():
+                try:
+                    if predicate(name, cmdline):
+                        matches[rule][info['pid']] = info.get('create_time')
+                except Exception:
+                    continue
+
+        self._matches = matches
+        self._scanned_at = time.monotonic()
+        self.scan_count += 1
+        logger.debug(f"進程表已掃描: {', '.join(f'{rule}={len(pids)}' for rule, pids in matches.items())}")
+
+    def _cache_valid(self) -> bool:
+        """緩存未超時且所有緩存的PID仍然存活"""
+        if self._scanned_at is None or time.monotonic() - self._scanned_at > self.max_age:
+            return False
+
+        for pids in self._matches.values():
+            for pid, create_time in pids.items():
+                try:
+                    # 比較創建時間，防止PID被其他進程複用
+                    if psutil.Process(pid).create_time() != create_time:
+                        return False
+                except psutil.Error:
+                    return False
+        return True
+
+    def refresh(self, force: bool = False) -> bool:
+        """需要時重新掃描進程表，返回是否執行了掃描"""
+        with self._lock:
+            if not force and self._cache_valid():
+                return False
+            self._scan()
+            return True
+
+    def pids(self, rule: str) -> List[int]:
+        """返回匹配規則的PID"""
+        self.refresh()
+        return sorted(self._matches.get(rule, {}))
+
+    def is_running(self, rule: str) -> bool:
+        """檢查是否有匹配規則的進程"""
+        return bool(self.pids(rule))
+
+    def status(self) -> Dict[str, bool]:
+        """一次返回所有規則的檢查結果"""
+        self.refresh()
+        return {rule: bool(pids) for rule, pids in self._matches.items()}
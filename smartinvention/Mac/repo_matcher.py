@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Trae Repository Name Matcher
+將所有倉庫名稱模式合併為單個正則表達式，在原始字節上匹配
+
+支持 bytes / memoryview / mmap，不需要先解碼為字符串。
+
+用法: python3 repo_matcher.py --benchmark [文件 ...]
+"""
+
+import re
+import sys
+import time
+from typing import Iterable, Set
+
+# 倉庫名稱允許的字符
+NAME_CHARS = rb"[a-z0-9._-]"
+NAME_BYTES = frozenset(b"abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789._-")
+
+# 流式掃描的塊大小與重疊長度，重疊部分需大於最長的倉庫名稱
+CHUNK_SIZE = 1024 * 1024
+CHUNK_OVERLAP = 1024
+
+# 倉庫名稱中常見的關鍵字
+DEFAULT_KEYWORDS = ("powerauto", "community", "automation", "integration")
+
+
+class RepoNameMatcher:
+    """
+    合併的倉庫名稱匹配器
+
+    所有關鍵字、已知倉庫名稱和GitHub URL前綴組成一個分支表達式，在小寫化的
+    緩衝區上只做一次掃描；命中後向兩側擴展到完整的名稱。CPython的re不是
+    自動機，分支表達式需要在每個位置逐一嘗試，因此先用C實現的子串查找做
+    預篩選，不包含任何字面量的緩衝區直接跳過。
+
+    quoted=True 時沿用歷史文件原有的規則：關鍵字和已知名稱必須是完整的
+    帶引號字符串 ("...")，只有GitHub URL不需要引號。以引號開頭的表達式讓re
+    可以直接跳到下一個引號，比逐位置嘗試分支快得多。
+    """
+
+    def __init__(self, github_username: str, keywords: Iterable[str] = DEFAULT_KEYWORDS,
+                 known_names: Iterable[str] = ()):
+        self.github_username = github_username
+        self.keywords = {keyword.lower().encode("ascii") for keyword in keywords if keyword}
+        self.known_names = {name.lower().encode("ascii") for name in known_names if name}
+        self.url_prefix = b"github.com"
+
+        # 較長的字面量優先，保證已知名稱不會被其中的關鍵字截斷
+        literals = sorted(self.keywords | self.known_names, key=len, reverse=True)
+        self.literals = [self.url_prefix] + literals
+        self.pattern = re.compile(
+            rb"(?P<url>github\.com[/:]" + re.escape(github_username.lower().encode("ascii")) + rb"[/:])|" +
+            b"|".join(re.escape(literal) for literal in literals)
+        )
+        self.tail = re.compile(NAME_CHARS + b"*")
+        self.quoted_pattern = re.compile(
+            b'"(' + NAME_CHARS + b"*(?:" + b"|".join(re.escape(literal) for literal in literals) + b")" +
+            NAME_CHARS + b'*)"'
+        )
+        self.url_pattern = re.compile(
+            rb"github\.com[/:]" + re.escape(github_username.lower().encode("ascii")) + rb"[/:](" + NAME_CHARS + b"+)"
+        )
+
+    def findall(self, buffer, partial_start: bool = False, partial_end: bool = False,
+                quoted: bool = False) -> Set[str]:
+        """
+        掃描緩衝區 (bytes / memoryview / mmap / str)，返回發現的倉庫名稱
+
+        partial_start / partial_end 表示緩衝區是文件中的一塊，緊貼塊邊界的名稱
+        可能被截斷，這些名稱會在相鄰重疊的塊中完整出現，因此在此跳過。
+        quoted 見類說明。
+        """
+        if isinstance(buffer, str):
+            buffer = buffer.encode("utf-8", "ignore")
+        # bytes.lower只轉換ASCII字母，位置與原緩衝區一一對應
+        lowered = buffer.lower() if isinstance(buffer, bytes) else bytes(buffer).lower()
+
+        names = set()
+        if not any(literal in lowered for literal in self.literals):
+            return names
+        if quoted:
+            return self._findall_quoted(buffer, lowered, partial_end)
+
+        position = 0
+        while True:
+            match = self.pattern.search(lowered, position)
+            if match is None:
+                break
+
+            if match.lastgroup == "url":
+                start = match.end()
+                end = self.tail.match(lowered, start).end()
+            else:
+                start = match.start()
+                while start > 0 and lowered[start - 1] in NAME_BYTES:
+                    start -= 1
+                end = self.tail.match(lowered, match.end()).end()
+            position = max(end, match.start() + 1)
+
+            if (partial_end and end == len(lowered)) or \
+                    (partial_start and start == 0 and match.lastgroup != "url"):
+                continue
+
+            token = lowered[start:end]
+            if match.lastgroup == "url":
+                if token.endswith(b".git"):
+                    end -= 4
+            elif token not in self.known_names and not any(keyword in token for keyword in self.keywords):
+                # 已知名稱只接受完整匹配的詞
+                continue
+
+            name = bytes(buffer[start:end]).decode("ascii")
+            if len(name) > 2 and not name.startswith('.'):
+                names.add(name)
+        return names
+
+    def _findall_quoted(self, buffer, lowered: bytes, partial_end: bool) -> Set[str]:
+        """帶引號的完整字符串和GitHub URL；引號內的名稱不會被塊邊界截斷"""
+        names = set()
+        for match in self.quoted_pattern.finditer(lowered):
+            token = match.group(1)
+            if token in self.known_names or any(keyword in token for keyword in self.keywords):
+                names.add(bytes(buffer[match.start(1):match.end(1)]).decode("ascii"))
+        for match in self.url_pattern.finditer(lowered):
+            start, end = match.span(1)
+            if partial_end and end == len(lowered):
+                continue
+            if lowered.endswith(b".git", start, end):
+                end -= 4
+            names.add(bytes(buffer[start:end]).decode("ascii"))
+        return {name for name in names if len(name) > 2 and not name.startswith('.')}
+
+    def scan_file(self, path, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP,
+                  quoted: bool = False) -> Set[str]:
+        """以固定大小的重疊塊流式掃描文件，內存佔用與文件大小無關"""
+        names = set()
+        overlap = min(overlap, chunk_size)
+
+        with open(path, "rb") as f:
+            previous = b""
+            while True:
+                data = f.read(chunk_size)
+                final = len(data) < chunk_size
+                chunk = previous + data if previous else data
+                if chunk:
+                    names.update(self.findall(chunk, partial_start=bool(previous), partial_end=not final,
+                                              quoted=quoted))
+                if final:
+                    break
+                previous = chunk[-overlap:]
+
+        return names
+
+
+def legacy_findall(content: str, github_username: str) -> Set[str]:
+    """原有的逐個模式匹配實現，僅用於基準測試"""
+    repos = set()
+    patterns = [
+        r'"([a-zA-Z0-9._-]*powerauto[a-zA-Z0-9._-]*)"',
+        r'"([a-zA-Z0-9._-]*community[a-zA-Z0-9._-]*)"',
+        r'"([a-zA-Z0-9._-]*automation[a-zA-Z0-9._-]*)"',
+        r'"([a-zA-Z0-9._-]*integration[a-zA-Z0-9._-]*)"',
+        r'github\.com[/:]' + github_username + r'[/:]([a-zA-Z0-9._-]+)'
+    ]
+    for pattern in patterns:
+        for match in re.findall(pattern, content, re.IGNORECASE):
+            if len(match) > 2 and not match.startswith('.'):
+                repos.add(match)
+    return repos
+
+
+def benchmark(paths, github_username: str = "alexchuang650730", rounds: int = 5):
+    """比較原有循環與合併模式的耗時"""
+    if paths:
+        buffers = []
+        for path in paths:
+            with open(path, "rb") as f:
+                buffers.append(f.read())
+    else:
+        # 生成模擬的歷史文件內容
+        sample = (
+            b'{"resource":"file:///Users/alexchuang/work/powerauto_v0.3/src/main.py",'
+            b'"entries":[{"id":"x1","source":"communitypowerautomation","timestamp":1718870400}],'
+            b'"remote":"https://github.com/' + github_username.encode() + b'/final_integration_fixed.git",'
+            b'"text":"lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod"}\n'
+        )
+        filler = b'{"id":"x2","text":"lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod"}\n'
+        # 一半包含倉庫名稱，一半為不相關內容
+        buffers = [sample * 2000 for _ in range(10)] + [filler * 6000 for _ in range(10)]
+
+    from repository_discovery import KNOWN_REPOSITORIES
+    matcher = RepoNameMatcher(github_username, known_names=KNOWN_REPOSITORIES)
+    total_bytes = sum(len(buffer) for buffer in buffers)
+
+    def run(label, func):
+        best = None
+        for _ in range(rounds):
+            start = time.perf_counter()
+            for buffer in buffers:
+                func(buffer)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print(f"   {label:20s} {best * 1000:9.2f} ms  {total_bytes / best / 1024 / 1024:8.1f} MB/s")
+
+    print(f"📊 基準測試: {len(buffers)} 個緩衝區, {total_bytes / 1024 / 1024:.1f} MB, 取 {rounds} 輪最佳")
+    run("原有循環 (解碼+5次)", lambda buffer: legacy_findall(buffer.decode("utf-8", "ignore"), github_username))
+    # 歷史文件使用帶引號的規則，與原有循環的匹配結果一致
+    run("合併模式 (引號)", lambda buffer: matcher.findall(buffer, quoted=True))
+    run("合併模式 (不限引號)", matcher.findall)
+
+
+def main():
+    """主函數"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Trae Repository Name Matcher")
+    parser.add_argument("--benchmark", action="store_true", help="運行匹配器基準測試")
+    parser.add_argument("--rounds", type=int, default=5, help="基準測試輪數")
+    parser.add_argument("files", nargs="*", help="用於基準測試的文件 (默認使用模擬數據)")
+
+    args = parser.parse_args()
+
+    if not args.benchmark:
+        parser.print_help()
+        sys.exit(1)
+
+    benchmark(args.files, rounds=args.rounds)
+
+
+if __name__ == "__main__":
+    main()
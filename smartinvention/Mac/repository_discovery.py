@@ -7,47 +7,72 @@ Trae Repository Discovery Tool
 import os
 import sys
 import json
-import sqlite3
 import re
 import glob
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Set
+from typing import List, Dict, Set, Optional, Iterable
 import logging
 
+from codekg_catalog import CodeKGCatalog
+from discovery_index import DiscoveryIndex
+from repo_matcher import RepoNameMatcher, CHUNK_SIZE
+from workspace_db_reader import WorkspaceDBReader
+
 # 設置日誌
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# 已知的倉庫列表
+KNOWN_REPOSITORIES = (
+    "powerauto.ai_0.53",
+    "communitypowerautomation",
+    "powerauto_v0.3",
+    "powerautomation",
+    "final_integration_fixed",
+    "communitypowerauto",
+    "automation",
+    "subtitles",
+    "powerautoadmin",
+    "healthcare",
+    "ourdaily",
+    "alexc"
+)
+
 class TraeRepositoryDiscovery:
-    def __init__(self, trae_app_support: str = "/Users/alexchuang/Library/Application Support/Trae"):
+    def __init__(self, trae_app_support: str = "/Users/alexchuang/Library/Application Support/Trae",
+                 index: Optional[DiscoveryIndex] = None, max_workers: int = 1,
+                 chunk_size: int = CHUNK_SIZE, db_reader: Optional[WorkspaceDBReader] = None):
         self.trae_app_support = Path(trae_app_support)
         self.github_username = "alexchuang650730"
         self.repositories = set()
+        self.index = index
+        self.max_workers = max(1, max_workers)
+        self.source_stats: Dict[str, Dict] = {}
+        self._stats_lock = threading.Lock()
+        self._file_pool: Optional[ThreadPoolExecutor] = None
+        self.matcher = RepoNameMatcher(self.github_username, known_names=KNOWN_REPOSITORIES)
+        self.chunk_size = chunk_size
+        self.db_reader = db_reader or WorkspaceDBReader()
+        self.catalog = CodeKGCatalog(str(self.trae_app_support))
         
     def search_codekg_databases(self) -> Set[str]:
         """從CodeKG數據庫中搜索倉庫"""
         repos = set()
         
         try:
-            ckg_storage_path = self.trae_app_support / "User/globalStorage/.ckg/storage"
-            
-            if not ckg_storage_path.exists():
-                logger.warning(f"CodeKG存儲路徑不存在: {ckg_storage_path}")
+            if not self.catalog.exists:
+                logger.warning(f"CodeKG存儲路徑不存在: {self.catalog.storage_path}")
                 return repos
             
-            logger.info(f"搜索CodeKG數據庫: {ckg_storage_path}")
+            logger.info(f"搜索CodeKG數據庫: {self.catalog.storage_path}")
             
-            # 遍歷所有用戶目錄
-            for user_dir in ckg_storage_path.iterdir():
-                if not user_dir.is_dir():
-                    continue
-                
-                # 查找codekg數據庫文件
-                for db_file in user_dir.glob("*_codekg.db"):
-                    repo_name = db_file.stem.replace("_codekg", "")
-                    if repo_name and repo_name not in ["Shared", "temp"]:
-                        repos.add(repo_name)
-                        logger.info(f"發現倉庫 (CodeKG): {repo_name}")
+            for entry in self.catalog.entries():
+                self._record_stats("codekg", files=1)
+                repos.add(entry["name"])
+                logger.info(f"發現倉庫 (CodeKG): {entry['name']}")
             
             return repos
             
@@ -69,45 +94,8 @@ class TraeRepositoryDiscovery:
             logger.info(f"搜索工作區存儲: {workspace_path}")
             
             # 搜索所有.vscdb文件
-            for db_file in workspace_path.rglob("*.vscdb"):
-                try:
-                    conn = sqlite3.connect(str(db_file), timeout=5)
-                    cursor = conn.cursor()
-                    
-                    # 查找包含Git相關信息的表
-                    cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-                    tables = cursor.fetchall()
-                    
-                    for table in tables:
-                        table_name = table[0]
-                        try:
-                            cursor.execute(f"SELECT * FROM {table_name} LIMIT 10")
-                            rows = cursor.fetchall()
-                            
-                            for row in rows:
-                                row_str = str(row)
-                                # 搜索GitHub倉庫模式
-                                git_patterns = [
-                                    r'github\.com[/:]' + self.github_username + r'[/:]([a-zA-Z0-9._-]+)',
-                                    r'powerauto[a-zA-Z0-9._-]*',
-                                    r'community[a-zA-Z0-9._-]*',
-                                    r'automation[a-zA-Z0-9._-]*'
-                                ]
-                                
-                                for pattern in git_patterns:
-                                    matches = re.findall(pattern, row_str, re.IGNORECASE)
-                                    for match in matches:
-                                        if isinstance(match, str) and len(match) > 2:
-                                            repos.add(match.strip())
-                                            logger.info(f"發現倉庫 (WorkspaceStorage): {match}")
-                        except Exception:
-                            continue
-                    
-                    conn.close()
-                    
-                except Exception as e:
-                    logger.debug(f"無法讀取數據庫 {db_file}: {e}")
-                    continue
+            repos.update(self._scan_files("workspace", workspace_path.rglob("*.vscdb"),
+                                          self._scan_workspace_db, sqlite=True))
             
             return repos
             
@@ -129,30 +117,7 @@ class TraeRepositoryDiscovery:
             logger.info(f"搜索歷史文件: {history_path}")
             
             # 搜索所有JSON文件
-            for json_file in history_path.rglob("*.json"):
-                try:
-                    with open(json_file, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                        
-                        # 搜索倉庫名稱模式
-                        patterns = [
-                            r'"([a-zA-Z0-9._-]*powerauto[a-zA-Z0-9._-]*)"',
-                            r'"([a-zA-Z0-9._-]*community[a-zA-Z0-9._-]*)"',
-                            r'"([a-zA-Z0-9._-]*automation[a-zA-Z0-9._-]*)"',
-                            r'"([a-zA-Z0-9._-]*integration[a-zA-Z0-9._-]*)"',
-                            r'github\.com[/:]' + self.github_username + r'[/:]([a-zA-Z0-9._-]+)'
-                        ]
-                        
-                        for pattern in patterns:
-                            matches = re.findall(pattern, content, re.IGNORECASE)
-                            for match in matches:
-                                if len(match) > 2 and not match.startswith('.'):
-                                    repos.add(match)
-                                    logger.info(f"發現倉庫 (History): {match}")
-                
-                except Exception as e:
-                    logger.debug(f"無法讀取文件 {json_file}: {e}")
-                    continue
+            repos.update(self._scan_files("history", history_path.rglob("*.json"), self._scan_history_file))
             
             return repos
             
@@ -168,48 +133,8 @@ class TraeRepositoryDiscovery:
             # 搜索輸入數據庫
             input_db_pattern = self.trae_app_support / "User/workspaceStorage/*/state.vscdb"
             
-            for db_file in glob.glob(str(input_db_pattern)):
-                try:
-                    conn = sqlite3.connect(db_file, timeout=5)
-                    cursor = conn.cursor()
-                    
-                    # 查詢ItemTable中的輸入記錄
-                    cursor.execute("SELECT value FROM ItemTable WHERE key LIKE '%input%'")
-                    rows = cursor.fetchall()
-                    
-                    for row in rows:
-                        try:
-                            data = json.loads(row[0])
-                            if isinstance(data, list):
-                                for item in data:
-                                    if isinstance(item, dict):
-                                        # 檢查multiMedia字段
-                                        multi_media = item.get('multiMedia', [])
-                                        for media in multi_media:
-                                            if isinstance(media, dict):
-                                                file_name = media.get('fileName', '')
-                                                if file_name:
-                                                    # 提取可能的倉庫名稱
-                                                    repo_patterns = [
-                                                        r'([a-zA-Z0-9._-]*powerauto[a-zA-Z0-9._-]*)',
-                                                        r'([a-zA-Z0-9._-]*community[a-zA-Z0-9._-]*)',
-                                                        r'([a-zA-Z0-9._-]*automation[a-zA-Z0-9._-]*)'
-                                                    ]
-                                                    
-                                                    for pattern in repo_patterns:
-                                                        matches = re.findall(pattern, file_name, re.IGNORECASE)
-                                                        for match in matches:
-                                                            if len(match) > 2:
-                                                                repos.add(match)
-                                                                logger.info(f"發現倉庫 (Input): {match}")
-                        except Exception:
-                            continue
-                    
-                    conn.close()
-                    
-                except Exception as e:
-                    logger.debug(f"無法讀取輸入數據庫 {db_file}: {e}")
-                    continue
+            db_files = (Path(db_file) for db_file in glob.glob(str(input_db_pattern)))
+            repos.update(self._scan_files("input", db_files, self._scan_input_db, sqlite=True))
             
             return repos
             
@@ -217,22 +142,105 @@ class TraeRepositoryDiscovery:
             logger.error(f"搜索輸入數據庫時出錯: {e}")
             return repos
     
+    def _record_stats(self, source: str, files: int = 0, bytes_read: int = 0, wall_time: float = None):
+        """累計來源的統計數據"""
+        with self._stats_lock:
+            stats = self.source_stats.setdefault(source, {"wall_time": 0.0, "files": 0, "bytes_read": 0})
+            stats["files"] += files
+            stats["bytes_read"] += bytes_read
+            if wall_time is not None:
+                stats["wall_time"] = round(wall_time, 3)
+    
+    def _scan_files(self, source: str, paths: Iterable[Path], scan, sqlite: bool = False) -> Set[str]:
+        """掃描一組文件，有線程池時並行執行"""
+        repos = set()
+        
+        if self._file_pool is None:
+            for path in paths:
+                repos.update(self._cached_scan(source, path, scan, sqlite))
+            return repos
+        
+        futures = [self._file_pool.submit(self._cached_scan, source, path, scan, sqlite) for path in paths]
+        for future in futures:
+            repos.update(future.result())
+        return repos
+    
+    def _cached_scan(self, source: str, path: Path, scan, sqlite: bool = False) -> Set[str]:
+        """掃描單個文件，指紋未變時直接使用索引中的結果"""
+        fingerprint = None
+        if self.index is not None:
+            fingerprint = self.index.fingerprint(path, sqlite=sqlite)
+            cached = self.index.lookup(source, path, fingerprint)
+            if cached is not None:
+                logger.debug(f"索引命中: {path}")
+                self._record_stats(source, files=1)
+                return cached
+        
+        try:
+            size = fingerprint[0] if fingerprint else os.path.getsize(path)
+            repos = scan(path)
+        except Exception as e:
+            # 讀取失敗的文件不寫入索引，下次重新掃描
+            logger.debug(f"無法讀取 {path}: {e}")
+            self._record_stats(source, files=1)
+            return set()
+        
+        self._record_stats(source, files=1, bytes_read=size)
+        if self.index is not None:
+            self.index.store(source, path, fingerprint, repos)
+        return repos
+    
+    def _scan_workspace_db(self, db_file: Path) -> Set[str]:
+        """掃描單個工作區數據庫"""
+        repos = set()
+        
+        # 只讀打開，先按key過濾，再分批讀取value
+        for key, value in self.db_reader.iter_items(db_file):
+            repos.update(self.matcher.findall(key))
+            if isinstance(value, bytes):
+                repos.update(self.matcher.findall(value))
+        
+        for repo in repos:
+            logger.info(f"發現倉庫 (WorkspaceStorage): {repo}")
+        return repos
+    
+    def _scan_history_file(self, json_file: Path) -> Set[str]:
+        """掃描單個歷史文件"""
+        # 分塊讀取原始字節，大文件不會一次性載入和解碼；與原有規則一樣只接受帶引號的名稱
+        repos = self.matcher.scan_file(json_file, chunk_size=self.chunk_size, quoted=True)
+        for repo in repos:
+            logger.info(f"發現倉庫 (History): {repo}")
+        return repos
+    
+    def _scan_input_db(self, db_file: Path) -> Set[str]:
+        """掃描單個輸入數據庫"""
+        repos = set()
+        
+        # 查詢ItemTable中的輸入記錄
+        for _, value in self.db_reader.iter_items(db_file, key_patterns=("%input%",)):
+            try:
+                data = json.loads(value)
+                if isinstance(data, list):
+                    for item in data:
+                        if isinstance(item, dict):
+                            # 檢查multiMedia字段
+                            multi_media = item.get('multiMedia', [])
+                            for media in multi_media:
+                                if isinstance(media, dict):
+                                    file_name = media.get('fileName', '')
+                                    if file_name:
+                                        # 提取可能的倉庫名稱
+                                        repos.update(self.matcher.findall(file_name))
+            except Exception:
+                continue
+        
+        for repo in repos:
+            logger.info(f"發現倉庫 (Input): {repo}")
+        return repos
+    
     def get_known_repositories(self) -> Set[str]:
         """獲取已知的倉庫列表"""
-        known_repos = {
-            "powerauto.ai_0.53",
-            "communitypowerautomation",
-            "powerauto_v0.3",
-            "powerautomation",
-            "final_integration_fixed",
-            "communitypowerauto",
-            "automation",
-            "subtitles",
-            "powerautoadmin",
-            "healthcare",
-            "ourdaily",
-            "alexc"
-        }
+        known_repos = set(KNOWN_REPOSITORIES)
         
         logger.info(f"添加已知倉庫: {len(known_repos)} 個")
         return known_repos
@@ -277,19 +285,56 @@ class TraeRepositoryDiscovery:
         
         return unique_repos
     
+    def _timed_source(self, source: str, search) -> Set[str]:
+        """執行單個來源的搜索並記錄耗時"""
+        start = time.perf_counter()
+        repos = search()
+        self._record_stats(source, wall_time=time.perf_counter() - start)
+        return repos
+    
     def discover_repositories(self) -> List[Dict]:
         """執行完整的倉庫發現"""
         logger.info("🔍 開始從Trae中發現Git倉庫...")
         
         all_repos = set()
+        self.source_stats = {}
+        
+        # 各來源讀取的文件互不重疊，可以並行搜索
+        sources = {
+            "codekg": self.search_codekg_databases,
+            "workspace": self.search_workspace_storage,
+            "history": self.search_history_files,
+            "input": self.search_input_database
+        }
+        
+        if self.max_workers > 1:
+            # 來源和文件使用不同的線程池，避免來源任務佔滿線程後等待文件任務
+            with ThreadPoolExecutor(max_workers=self.max_workers) as file_pool, \
+                    ThreadPoolExecutor(max_workers=len(sources)) as source_pool:
+                self._file_pool = file_pool
+                try:
+                    futures = [source_pool.submit(self._timed_source, name, search)
+                               for name, search in sources.items()]
+                    for future in futures:
+                        all_repos.update(future.result())
+                finally:
+                    self._file_pool = None
+        else:
+            for name, search in sources.items():
+                all_repos.update(self._timed_source(name, search))
         
-        # 從各個來源搜索倉庫
-        all_repos.update(self.search_codekg_databases())
-        all_repos.update(self.search_workspace_storage())
-        all_repos.update(self.search_history_files())
-        all_repos.update(self.search_input_database())
         all_repos.update(self.get_known_repositories())
         
+        for name, stats in self.source_stats.items():
+            logger.info(f"⏱️ {name}: {stats['wall_time']:.3f}s, "
+                        f"{stats['files']} 個文件, {stats['bytes_read'] / 1024 / 1024:.1f} MB")
+        
+        # 保存索引
+        if self.index is not None:
+            self.index.save()
+            stats = self.index.stats()
+            logger.info(f"📇 索引命中 {stats['hits']} / 未命中 {stats['misses']}")
+        
         # 過濾和格式化
         repositories = self.filter_repositories(all_repos)
         
@@ -307,6 +352,7 @@ class TraeRepositoryDiscovery:
                 "discovery_time": str(Path().cwd()),
                 "total_repositories": len(repositories),
                 "github_username": self.github_username,
+                "source_stats": self.source_stats,
                 "repositories": repositories
             }
             
@@ -329,6 +375,19 @@ def main():
                        help="Trae應用支持目錄路徑")
     parser.add_argument("--output", help="輸出文件路徑")
     parser.add_argument("--verbose", "-v", action="store_true", help="詳細輸出")
+    parser.add_argument("--index-file", help="指紋索引文件路徑")
+    parser.add_argument("--rebuild", action="store_true", help="忽略現有索引並重新建立")
+    parser.add_argument("--no-index", action="store_true", help="不使用指紋索引，完整掃描")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE // 1024,
+                       help="歷史文件流式掃描的塊大小 (KB)")
+    parser.add_argument("--key-pattern", action="append", dest="key_patterns",
+                       help="工作區數據庫的key過濾模式 (SQL LIKE，可重複)")
+    parser.add_argument("--all-keys", action="store_true", help="讀取工作區數據庫的全部key")
+    parser.add_argument("--arraysize", type=int, default=256, help="SQLite每批讀取的行數")
+    parser.add_argument("--immutable", action="store_true",
+                       help="以immutable方式打開數據庫 (僅在Trae未運行時使用)")
+    parser.add_argument("--workers", type=int, default=min(8, os.cpu_count() or 1),
+                       help="並行掃描的線程數 (1為順序執行)")
     
     args = parser.parse_args()
     
@@ -344,7 +403,16 @@ def main():
         sys.exit(1)
     
     # 創建發現工具
-    discovery = TraeRepositoryDiscovery(args.trae_path)
+    index = None if args.no_index else DiscoveryIndex(args.index_file, rebuild=args.rebuild)
+    if args.all_keys:
+        db_reader = WorkspaceDBReader(key_patterns=None, arraysize=args.arraysize, immutable=args.immutable)
+    elif args.key_patterns:
+        db_reader = WorkspaceDBReader(key_patterns=args.key_patterns, arraysize=args.arraysize,
+                                      immutable=args.immutable)
+    else:
+        db_reader = WorkspaceDBReader(arraysize=args.arraysize, immutable=args.immutable)
+    discovery = TraeRepositoryDiscovery(args.trae_path, index=index, max_workers=args.workers,
+                                        chunk_size=max(4, args.chunk_size) * 1024, db_reader=db_reader)
     
     try:
         # 執行倉庫發現
@@ -357,6 +425,14 @@ def main():
         print(f"\n📊 發現結果:")
         print(f"   總計倉庫: {len(repositories)}")
         print(f"   輸出文件: {output_file}")
+        if index is not None:
+            stats = index.stats()
+            print(f"   索引命中: {stats['hits']} / 未命中: {stats['misses']}{' (重建)' if stats['rebuild'] else ''}")
+        
+        print(f"\n⏱️ 來源耗時:")
+        for name, stats in sorted(discovery.source_stats.items(), key=lambda item: -item[1]["wall_time"]):
+            print(f"   {name:10s} {stats['wall_time']:8.3f}s  {stats['files']:6d} 個文件  "
+                  f"{stats['bytes_read'] / 1024 / 1024:8.1f} MB")
         
         print(f"\n📋 倉庫列表:")
         for i, repo in enumerate(repositories, 1):
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Trae SSH Session
+Mac端共享的長連接SSH會話 (OpenSSH ControlMaster)
+
+監控工具和同步守護進程使用同一個ControlPath，第一個連接建立主連接，
+之後的探測、scp傳輸和遠程命令都複用這條已認證的通道，不再每次握手。
+主連接失效時自動清理並重新建立。ssh / scp 可執行文件可以替換，便於
+對本地sshd或模擬的傳輸進行測試。
+"""
+
+import os
+import time
+import hashlib
+import logging
+import threading
+import subprocess
+from typing import List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+CONTROL_PATH_TEMPLATE = "~/.ssh/cm-trae-{digest}"
+
+
+def default_control_path(user: str, host: str, port: int) -> str:
+    """按連接目標生成具體的ControlPath
+
+    不使用ssh的 %C 佔位符，這樣Python端能判斷socket文件是否存在並清理殘留的socket。
+    """
+    digest = hashlib.sha1(f"{user}@{host}:{port}".encode()).hexdigest()[:12]
+    return os.path.expanduser(CONTROL_PATH_TEMPLATE.format(digest=digest))
+
+
+class SSHSession:
+    def __init__(self, host: str = "serveo.net", port: int = 41269, user: str = "alexchuang",
+                 control_path: Optional[str] = None, persist: int = 600, connect_timeout: int = 5,
+                 ssh_binary: str = "ssh", scp_binary: str = "scp", extra_options: Sequence[str] = ()):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.control_path = (os.path.expanduser(control_path) if control_path
+                             else default_control_path(user, host, port))
+        self.persist = persist
+        self.connect_timeout = connect_timeout
+        self.ssh_binary = ssh_binary
+        self.scp_binary = scp_binary
+        self.extra_options = list(extra_options)
+        self.reconnects = 0
+        self._lock = threading.Lock()
+
+    @property
+    def destination(self) -> str:
+        return f"{self.user}@{self.host}"
+
+    def options(self) -> List[str]:
+        """ssh和scp共用的連接選項"""
+        return [
+            "-o", "StrictHostKeyChecking=no",
+            "-o", f"ConnectTimeout={self.connect_timeout}",
+            "-o", "ControlMaster=auto",
+            "-o", f"ControlPath={self.control_path}",
+            "-o", f"ControlPersist={self.persist}",
+            # 隧道斷開時讓主連接及時退出，而不是掛起
+            "-o", "ServerAliveInterval=15",
+            "-o", "ServerAliveCountMax=3",
+        ] + self.extra_options
+
+    def ssh_command(self, command: Optional[str] = None) -> List[str]:
+        """構造通過共享會話執行的ssh命令"""
+        cmd = [self.ssh_binary] + self.options() + ["-p", str(self.port), self.destination]
+        if command is not None:
+            cmd.append(command)
+        return cmd
+
+    def _control(self, operation: str, timeout: float = 5) -> bool:
+        """向主連接發送控制命令 (check / exit)"""
+        try:
+            result = subprocess.run(
+                [self.ssh_binary, "-o", f"ControlPath={self.control_path}", "-O", operation,
+                 "-p", str(self.port), self.destination],
+                capture_output=True, text=True, timeout=timeout
+            )
+            return result.returncode == 0
+        except Exception:
+            return False
+
+    def is_alive(self) -> bool:
+        """檢查主連接是否存活"""
+        return self._control("check")
+
+    @staticmethod
+    def _remaining(deadline: Optional[float], limit: float) -> float:
+        """距截止時間的剩餘秒數，不超過 limit"""
+        if deadline is None:
+            return limit
+        return min(limit, deadline - time.monotonic())
+
+    def ensure(self, retries: int = 2, deadline: Optional[float] = None) -> bool:
+        """確保主連接存在，失效時重新建立
+
+        deadline 是 time.monotonic() 的截止時間，每次嘗試和重試之間的等待都不會超過它。
+        """
+        # 等待其他線程建立連接的時間也計入截止時間
+        lock_timeout = -1 if deadline is None else deadline - time.monotonic()
+        if deadline is not None and lock_timeout <= 0:
+            return False
+        if not self._lock.acquire(timeout=lock_timeout):
+            return False
+        try:
+            remaining = self._remaining(deadline, 5)
+            if remaining <= 0:
+                return False
+            if self._control("check", timeout=remaining):
+                return True
+
+            # 殘留的socket文件會讓新連接失敗
+            if os.path.exists(self.control_path):
+                try:
+                    os.remove(self.control_path)
+                except OSError:
+                    pass
+
+            os.makedirs(os.path.dirname(self.control_path), exist_ok=True)
+            for attempt in range(retries + 1):
+                remaining = self._remaining(deadline, self.connect_timeout + 10)
+                if remaining <= 0:
+                    break
+                try:
+                    result = subprocess.run(
+                        [self.ssh_binary] + self.options() +
+                        ["-o", "ControlMaster=yes", "-N", "-f", "-p", str(self.port), self.destination],
+                        capture_output=True, text=True, timeout=remaining
+                    )
+                    if result.returncode == 0 and self._control("check", timeout=max(self._remaining(deadline, 5), 1)):
+                        self.reconnects += 1
+                        logger.info(f"🔐 SSH主連接已建立: {self.destination}:{self.port}")
+                        return True
+                    logger.warning(f"建立SSH主連接失敗: {result.stderr.strip()}")
+                except Exception as e:
+                    logger.warning(f"建立SSH主連接時出錯: {e}")
+                # 最後一次失敗後不再等待，等待也不能越過截止時間
+                if attempt == retries:
+                    break
+                delay = self._remaining(deadline, min(2 ** attempt, 5))
+                if delay <= 0:
+                    break
+                time.sleep(delay)
+            return False
+        finally:
+            self._lock.release()
+
+    @staticmethod
+    def _deadline(timeout: Optional[float]) -> Optional[float]:
+        return None if timeout is None else time.monotonic() + timeout
+
+    def _time_left(self, command: List[str], deadline: Optional[float]) -> Optional[float]:
+        """建立連接後留給命令本身的時間，已超時則直接拋出 TimeoutExpired"""
+        if deadline is None:
+            return None
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise subprocess.TimeoutExpired(command, 0)
+        return remaining
+
+    def run(self, command: str, timeout: Optional[float] = None, input: Optional[str] = None,
+            text: bool = True) -> subprocess.CompletedProcess:
+        """通過共享會話執行遠程命令，timeout 同時限制建立主連接的時間"""
+        deadline = self._deadline(timeout)
+        self.ensure(deadline=deadline)
+        cmd = self.ssh_command(command)
+        return subprocess.run(cmd, capture_output=True, text=text,
+                              input=input, timeout=self._time_left(cmd, deadline))
+
+    def popen(self, command: str, **kwargs) -> subprocess.Popen:
+        """通過共享會話啟動遠程命令，用於流式讀寫標準輸入輸出"""
+        self.ensure()
+        return subprocess.Popen(self.ssh_command(command), **kwargs)
+
+    def copy(self, local_path: str, remote_path: str, timeout: Optional[float] = None) -> subprocess.CompletedProcess:
+        """通過共享會話傳輸文件，timeout 同時限制建立主連接的時間"""
+        deadline = self._deadline(timeout)
+        self.ensure(deadline=deadline)
+        cmd = [self.scp_binary] + self.options() + [
+            "-P", str(self.port), local_path, f"{self.destination}:{remote_path}"
+        ]
+        return subprocess.run(cmd, capture_output=True, text=True, timeout=self._time_left(cmd, deadline))
+
+    def probe(self, timeout: float = 10) -> bool:
+        """探測遠程是否可用"""
+        try:
+            return self.run("true", timeout=timeout).returncode == 0
+        except Exception:
+            return False
+
+    def close(self):
+        """關閉主連接"""
+        self._control("exit")
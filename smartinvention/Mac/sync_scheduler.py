@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Trae Sync Scheduler
+按倉庫調度同步時間的優先隊列，取代全局的每小時同步閘門
+
+每個倉庫有自己的到期時間：
+- 新倉庫立即到期
+- 檢測到變化後等待一段平靜期（防抖），連續變化最多推遲到 max_debounce
+- 同步成功後按活躍度決定下次定期同步：剛有變化的倉庫使用最短間隔，
+  沒有變化的倉庫間隔逐次翻倍直到最長間隔
+- 同步失敗的倉庫按指數退避重試
+"""
+
+import time
+import heapq
+import logging
+import threading
+from typing import Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SyncScheduler:
+    def __init__(self, debounce: float = 30, max_debounce: float = 300, min_spacing: float = 60,
+                 min_interval: float = 900, max_interval: float = 21600,
+                 backoff_base: float = 60, backoff_max: float = 3600,
+                 clock: Callable[[], float] = time.time):
+        self.debounce = debounce
+        self.max_debounce = max_debounce
+        self.min_spacing = min_spacing
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.clock = clock
+        self.entries: Dict[str, Dict] = {}
+        # (到期時間, 序號, 倉庫名)，重新調度時壓入新記錄，舊記錄在彈出時丟棄
+        self._heap: List[tuple] = []
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def _schedule(self, entry: Dict, due: float, reason: str):
+        entry["due"] = due
+        entry["reason"] = reason
+        self._seq += 1
+        heapq.heappush(self._heap, (due, self._seq, entry["name"]))
+
+    def add(self, name: str, last_synced: Optional[float] = None, interval: Optional[float] = None,
+            failures: int = 0) -> bool:
+        """加入倉庫，可以從保存的狀態恢復調度，返回是否為新加入"""
+        with self._lock:
+            if name in self.entries:
+                return False
+            interval = min(max(interval or self.min_interval, self.min_interval), self.max_interval)
+            entry = {
+                "name": name,
+                "due": None,
+                "reason": None,
+                "interval": interval,
+                "failures": failures,
+                "last_synced": last_synced,
+                "first_change": None,
+                "active": False,
+                "in_flight": False,
+                "changed_in_flight": False
+            }
+            self.entries[name] = entry
+            if last_synced is None or failures:
+                self._schedule(entry, self.clock(), "retry" if failures else "new")
+            else:
+                self._schedule(entry, last_synced + interval, "periodic")
+            return True
+
+    def remove(self, name: str):
+        with self._lock:
+            self.entries.pop(name, None)
+
+    def update(self, names: Iterable[str]) -> List[str]:
+        """同步倉庫集合：加入新倉庫，移除已消失的倉庫，返回新加入的倉庫"""
+        names = set(names)
+        for name in set(self.entries) - names:
+            self.remove(name)
+        return [name for name in sorted(names) if self.add(name)]
+
+    def notify_change(self, name: str):
+        """倉庫有變化：防抖後到期，同時不早於與上次同步的最小間隔"""
+        with self._lock:
+            entry = self.entries.get(name)
+            if entry is None:
+                return
+            now = self.clock()
+            entry["active"] = True
+            # 同步進行中的變化在結果記錄後再調度
+            if entry["in_flight"]:
+                entry["changed_in_flight"] = True
+                return
+            if entry["first_change"] is None:
+                entry["first_change"] = now
+            due = min(now + self.debounce, entry["first_change"] + self.max_debounce)
+            if entry["last_synced"] is not None:
+                due = max(due, entry["last_synced"] + self.min_spacing)
+            # 失敗退避中的倉庫不提前重試
+            if entry["failures"] and entry["due"] is not None:
+                due = max(due, entry["due"])
+            if entry["due"] is None or due < entry["due"] or entry["reason"] == "change":
+                self._schedule(entry, due, "change")
+
+    def pop_due(self, limit: Optional[int] = None) -> List[str]:
+        """取出所有已到期的倉庫，結果記錄前它們不再參與調度"""
+        with self._lock:
+            now = self.clock()
+            due = []
+            while self._heap and self._heap[0][0] <= now and (limit is None or len(due) < limit):
+                due_time, _, name = heapq.heappop(self._heap)
+                entry = self.entries.get(name)
+                # 已移除或已被重新調度的舊記錄
+                if entry is None or entry["in_flight"] or entry["due"] != due_time:
+                    continue
+                entry["in_flight"] = True
+                entry["due"] = None
+                due.append(name)
+            return due
+
+    def record_result(self, name: str, success: bool):
+        """記錄同步結果並安排下一次同步"""
+        with self._lock:
+            entry = self.entries.get(name)
+            if entry is None:
+                return
+            now = self.clock()
+            entry["in_flight"] = False
+            entry["first_change"] = None
+            if success:
+                entry["failures"] = 0
+                entry["last_synced"] = now
+                # 活躍的倉庫保持最短間隔，沉寂的倉庫逐次放寬
+                if entry["active"]:
+                    entry["interval"] = self.min_interval
+                else:
+                    entry["interval"] = min(entry["interval"] * 2, self.max_interval)
+                entry["active"] = False
+                self._schedule(entry, now + entry["interval"], "periodic")
+                if entry["changed_in_flight"]:
+                    entry["active"] = True
+                    self._schedule(entry, now + max(self.debounce, self.min_spacing), "change")
+            else:
+                entry["failures"] += 1
+                delay = min(self.backoff_base * 2 ** (entry["failures"] - 1), self.backoff_max)
+                logger.debug(f"倉庫 {name} 第 {entry['failures']} 次同步失敗，{delay:.0f} 秒後重試")
+                self._schedule(entry, now + delay, "retry")
+            entry["changed_in_flight"] = False
+
+    def next_due(self) -> Optional[float]:
+        """最早的到期時間，沒有待調度的倉庫時返回None"""
+        with self._lock:
+            while self._heap:
+                due_time, _, name = self._heap[0]
+                entry = self.entries.get(name)
+                if entry is not None and not entry["in_flight"] and entry["due"] == due_time:
+                    return due_time
+                heapq.heappop(self._heap)
+            return None
+
+    def seconds_until_next(self, default: float) -> float:
+        """距離下一個到期倉庫的秒數，不超過default"""
+        next_due = self.next_due()
+        if next_due is None:
+            return default
+        return max(0.0, min(default, next_due - self.clock()))
+
+    def export(self, name: str) -> Dict:
+        """需要持久化的調度狀態"""
+        entry = self.entries.get(name)
+        if entry is None:
+            return {}
+        return {"interval": entry["interval"], "failures": entry["failures"]}
+
+    def queue(self) -> List[Dict]:
+        """按到期時間排列的隊列快照，供查看"""
+        with self._lock:
+            now = self.clock()
+            snapshot = []
+            for entry in self.entries.values():
+                item = {key: value for key, value in entry.items()
+                        if key not in ("first_change", "changed_in_flight")}
+                item["due_in"] = None if entry["due"] is None else round(entry["due"] - now, 1)
+                snapshot.append(item)
+        return sorted(snapshot, key=lambda item: (item["due"] is None, item["due"] or 0))
@@ -13,14 +13,23 @@ Trae MCP Git Repository Auto-Sync Tool (Mac端)
 import os
 import sys
 import time
+import gzip
 import json
+import zlib
 import sqlite3
 import subprocess
 import logging
 import threading
 from pathlib import Path
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Optional
+
+from agent_client import AgentClient, AgentError
+from change_watcher import ChangeWatcher, trae_watch_targets
+from codekg_catalog import CodeKGCatalog
+from process_scanner import ProcessScanner
+from ssh_session import SSHSession
+from sync_scheduler import SyncScheduler
 
 # Mac端配置
 CONFIG = {
@@ -31,8 +40,27 @@ CONFIG = {
     "ssh_key_path": "~/.ssh/id_rsa",
     "serveo_port": 41269,
     "check_interval": 30,  # 檢查間隔（秒）
+    "state_db": "User/workspaceStorage/f002a9b85f221075092022809f5a075f/state.vscdb",
+    "watch_debounce": 3,  # 事件模式下的防抖時間（秒）
+    "watch_idle_timeout": 600,  # 事件模式下無變化時的最長等待（秒）
+    "min_sync_interval": 60,  # 同一倉庫兩次同步之間的最短間隔（秒）
+    "sync_debounce": 30,  # 倉庫變化後等待平靜的時間（秒）
+    "sync_max_debounce": 300,  # 連續變化時最多推遲同步的時間（秒）
+    "min_repo_interval": 900,  # 活躍倉庫的定期同步間隔（秒）
+    "max_repo_interval": 21600,  # 沉寂倉庫的最長定期同步間隔（秒）
+    "retry_backoff": 60,  # 同步失敗後的首次重試等待（秒），之後指數增長
+    "max_retry_backoff": 3600,  # 失敗重試的最長等待（秒）
+    "state_file": "~/.trae_mcp_sync_state.json",  # 每個倉庫的同步狀態
+    "full_sync_interval": 86400,  # 完整對賬同步的間隔（秒）
     "log_file": "/tmp/trae_mcp_sync_mac.log",
-    "sync_script_path": "/home/alexchuang/aiengine/trae/ec2/sync_repositories.py"
+    "sync_script_path": "/home/alexchuang/aiengine/trae/ec2/sync_repositories.py",
+    "agent_script_path": "/home/alexchuang/aiengine/trae/ec2/sync_agent.py",
+    # rpc: 調用EC2常駐同步代理; stream: 單個SSH會話傳輸壓縮NDJSON; scp: 臨時文件 + scp + ssh
+    "sync_transport": "rpc",
+    "sync_timeout": 1800,  # 遠程同步超時（秒）
+    # 按倉庫名指定EC2端的克隆策略: "full" / "blobless" / "shallow" 或
+    # {"filter": "blob:none", "depth": 50, "sparse": ["src"]}，未列出的倉庫完整克隆
+    "clone_policies": {}
 }
 
 # 設置日誌
@@ -46,42 +74,98 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def iter_ndjson_stream(stream):
+    """增量解碼遠程返回的NDJSON（gzip壓縮或明文），每收到一行立即產出"""
+    decompressor = None
+    buffer = b""
+    first = True
+    while True:
+        chunk = stream.read1(65536)
+        if not chunk:
+            break
+        if first:
+            # 32 + MAX_WBITS 自動識別gzip頭
+            if chunk[:2] == b"\x1f\x8b":
+                decompressor = zlib.decompressobj(32 + zlib.MAX_WBITS)
+            first = False
+        buffer += decompressor.decompress(chunk) if decompressor else chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+    if buffer.strip():
+        yield json.loads(buffer)
+
+class SyncProgress:
+    """逐個處理遠程同步事件：跟蹤進行中的倉庫，結果一到達立即回調"""
+    
+    def __init__(self, on_result: Optional[Callable[[Dict], None]] = None):
+        self.on_result = on_result
+        self.in_flight = set()
+        self.results: Dict[str, Dict] = {}
+    
+    def handle(self, event: Dict):
+        name = event.get("name")
+        if event.get("type") == "start":
+            self.in_flight.add(name)
+            policy = event.get("clone_policy")
+            suffix = f", {policy}" if policy and policy != "full" else ""
+            logger.info(f"⏳ {name} ({event.get('action', 'sync')}{suffix})")
+        elif event.get("type") == "result":
+            self.in_flight.discard(name)
+            # 代理的匯總響應會重複已通知過的結果
+            if name in self.results:
+                return
+            self.results[name] = event
+            if event.get("action") == "unchanged":
+                logger.info(f"➖ {name} (無變化)")
+            else:
+                icon = "✅" if event.get("success") else "❌"
+                logger.info(f"{icon} {name} ({event.get('duration') or 0:.1f}s, "
+                            f"{(event.get('bytes_fetched') or 0) / 1048576:.2f} MB)")
+            if self.on_result is not None:
+                self.on_result(event)
+
 class TraeMCPSyncMonitor:
     def __init__(self):
         self.is_running = False
         self.last_sync_time = None
-        self.known_repositories = set()
+        self.sync_state = self.load_sync_state()
+        self.known_repositories = set(self.sync_state["repositories"])
+        self.catalog = CodeKGCatalog(CONFIG["trae_app_support"])
+        self.processes = ProcessScanner()
+        self.ssh = SSHSession(host="serveo.net", port=CONFIG["serveo_port"], user="alexchuang")
+        self.agent = AgentClient(self.ssh, f"python3 {CONFIG['agent_script_path']} --forward --spawn")
+        self.scheduler = SyncScheduler(
+            debounce=CONFIG["sync_debounce"],
+            max_debounce=CONFIG["sync_max_debounce"],
+            min_spacing=CONFIG["min_sync_interval"],
+            min_interval=CONFIG["min_repo_interval"],
+            max_interval=CONFIG["max_repo_interval"],
+            backoff_base=CONFIG["retry_backoff"],
+            backoff_max=CONFIG["max_retry_backoff"]
+        )
+        # 每個倉庫最後一次觀察到的CodeKG修改時間，用於發現新的變化
+        self.observed_mtimes: Dict[str, Optional[float]] = {
+            name: state.get("codekg_mtime") for name, state in self.sync_state["repositories"].items()
+        }
         
     def check_mcp_connection(self) -> bool:
         """檢查MCP與Trae的連接狀態"""
         try:
-            # 檢查Trae進程是否運行
-            result = subprocess.run(
-                ["pgrep", "-f", "Trae"],
-                capture_output=True,
-                text=True
-            )
+            # 從同一個進程快照檢查Trae和MCP進程
+            processes = self.processes.status()
             
-            if result.returncode != 0:
+            if not processes["trae"]:
                 logger.debug("Trae進程未運行")
                 return False
             
-            # 檢查MCP相關進程
-            result = subprocess.run(
-                ["pgrep", "-f", "mcp"],
-                capture_output=True,
-                text=True
-            )
-            
-            if result.returncode != 0:
+            if not processes["mcp"]:
                 logger.debug("MCP進程未運行")
                 return False
             
             # 檢查Trae數據庫是否可訪問
-            db_path = os.path.join(
-                CONFIG["trae_app_support"],
-                "User/workspaceStorage/f002a9b85f221075092022809f5a075f/state.vscdb"
-            )
+            db_path = os.path.join(CONFIG["trae_app_support"], CONFIG["state_db"])
             
             if not os.path.exists(db_path):
                 logger.debug("Trae數據庫文件不存在")
@@ -100,32 +184,18 @@ class TraeMCPSyncMonitor:
         
         try:
             # 從Trae的codekg數據庫中獲取倉庫信息
-            ckg_storage_path = os.path.join(
-                CONFIG["trae_app_support"],
-                "User/globalStorage/.ckg/storage"
-            )
-            
-            if not os.path.exists(ckg_storage_path):
+            if not self.catalog.exists:
                 logger.warning("CodeKG存儲路徑不存在")
                 return repositories
             
-            # 遍歷所有用戶目錄
-            for user_dir in os.listdir(ckg_storage_path):
-                user_path = os.path.join(ckg_storage_path, user_dir)
-                if not os.path.isdir(user_path):
-                    continue
-                
-                # 查找codekg數據庫文件
-                for file in os.listdir(user_path):
-                    if file.endswith("_codekg.db"):
-                        # 從文件名提取倉庫名
-                        repo_name = file.split("_")[0]
-                        if repo_name and repo_name not in ["Shared"]:
-                            repositories.append({
-                                "name": repo_name,
-                                "github_url": f"https://github.com/{CONFIG['github_username']}/{repo_name}.git",
-                                "db_file": os.path.join(user_path, file)
-                            })
+            for entry in self.catalog.entries():
+                repo_name = entry["name"]
+                if not any(r["name"] == repo_name for r in repositories):
+                    repositories.append({
+                        "name": repo_name,
+                        "github_url": f"https://github.com/{CONFIG['github_username']}/{repo_name}.git",
+                        "db_file": entry["db_path"]
+                    })
             
             # 添加已知的主要倉庫
             known_repos = [
@@ -145,6 +215,10 @@ class TraeMCPSyncMonitor:
                         "db_file": None
                     })
             
+            for repo in repositories:
+                if repo["name"] in CONFIG["clone_policies"]:
+                    repo["clone_policy"] = CONFIG["clone_policies"][repo["name"]]
+            
             logger.info(f"發現 {len(repositories)} 個倉庫")
             return repositories
             
@@ -152,8 +226,132 @@ class TraeMCPSyncMonitor:
             logger.error(f"從Trae獲取倉庫列表時出錯: {e}")
             return repositories
     
-    def trigger_remote_sync(self, repositories: List[Dict]) -> bool:
-        """觸發遠程同步"""
+    def trigger_remote_sync(self, repositories: List[Dict],
+                            on_result: Optional[Callable[[Dict], None]] = None) -> bool:
+        """觸發遠程同步，on_result在每個倉庫的結果到達時立即被調用"""
+        progress = SyncProgress(on_result)
+        if CONFIG["sync_transport"] == "rpc":
+            success = self.trigger_remote_sync_rpc(repositories, progress)
+        elif CONFIG["sync_transport"] == "stream":
+            success = self.trigger_remote_sync_stream(repositories, progress)
+        else:
+            success = self.trigger_remote_sync_scp(repositories)
+        
+        # 超時或連接中斷只影響尚未返回結果的倉庫
+        if not success and progress.results:
+            unfinished = [repo["name"] for repo in repositories if repo["name"] not in progress.results]
+            logger.warning(f"⚠️ 已收到 {len(progress.results)} 個倉庫的結果，未完成: {', '.join(unfinished) or '無'}")
+        return success
+    
+    def trigger_remote_sync_rpc(self, repositories: List[Dict], progress: SyncProgress) -> bool:
+        """通過JSON-RPC調用EC2端常駐同步代理，逐個接收進度通知"""
+        def on_notification(message: Dict):
+            if message.get("method") == "sync.event":
+                progress.handle(message.get("params") or {})
+        
+        try:
+            logger.info("🚀 觸發EC2端倉庫同步 (同步代理)...")
+            result = self.agent.call("sync", {
+                "repositories": repositories,
+                "source": {"sync_time": datetime.now().isoformat(), "source": "mac_trae_mcp"}
+            }, timeout=CONFIG["sync_timeout"], on_notification=on_notification)
+            
+            for detail in result.get("details", []):
+                progress.handle({"type": "result", **detail})
+            
+            logger.info(f"✅ 遠程同步執行成功: {result.get('success')}/{result.get('total')} 成功，"
+                        f"{result.get('unchanged', 0)} 個無變化")
+            return True
+            
+        except TimeoutError:
+            logger.error(f"❌ 遠程同步執行超時，進行中: {', '.join(sorted(progress.in_flight)) or '無'}")
+            return False
+        except AgentError as e:
+            logger.error(f"❌ 遠程同步執行失敗: {e}")
+            return False
+        except Exception as e:
+            logger.error(f"❌ 觸發遠程同步時出錯: {e}")
+            return False
+    
+    def trigger_remote_sync_stream(self, repositories: List[Dict], progress: SyncProgress) -> bool:
+        """通過單個SSH會話的標準輸入發送壓縮NDJSON，並逐個接收同步結果"""
+        process = None
+        try:
+            logger.info("🚀 觸發EC2端倉庫同步 (流式傳輸)...")
+            
+            # 第一行為請求頭，之後每行一個倉庫
+            lines = [{
+                "type": "header",
+                "sync_time": datetime.now().isoformat(),
+                "source": "mac_trae_mcp"
+            }] + [{"type": "repository", **repo} for repo in repositories]
+            payload = gzip.compress(
+                "".join(json.dumps(line, ensure_ascii=False) + "\n" for line in lines).encode("utf-8")
+            )
+            
+            if not self.ssh.ensure():
+                logger.error("無法建立SSH連接")
+                return False
+            
+            process = self.ssh.popen(
+                f"python3 {CONFIG['sync_script_path']} --repo-list -",
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            )
+            
+            # 遠程日誌寫到標準錯誤，需要持續讀取避免管道阻塞
+            stderr_lines = []
+            stderr_reader = threading.Thread(
+                target=lambda: stderr_lines.extend(process.stderr.read().decode("utf-8", "replace").splitlines()[-20:]),
+                daemon=True
+            )
+            stderr_reader.start()
+            
+            # 超時後終止SSH進程，讀取循環隨之結束
+            timed_out = threading.Event()
+            
+            def on_timeout():
+                timed_out.set()
+                process.kill()
+            
+            timer = threading.Timer(CONFIG["sync_timeout"], on_timeout)
+            timer.start()
+            try:
+                process.stdin.write(payload)
+                process.stdin.close()
+                
+                summary = None
+                for record in iter_ndjson_stream(process.stdout):
+                    if record.get("type") in ("start", "result"):
+                        progress.handle(record)
+                    elif record.get("type") == "summary":
+                        summary = record
+                
+                returncode = process.wait()
+            finally:
+                timer.cancel()
+            stderr_reader.join(timeout=5)
+            
+            if timed_out.is_set():
+                logger.error(f"❌ 遠程同步執行超時，進行中: {', '.join(sorted(progress.in_flight)) or '無'}")
+                return False
+            
+            if returncode == 0 and summary is not None:
+                logger.info(f"✅ 遠程同步執行成功: {summary.get('success')}/{summary.get('total')} 成功，"
+                            f"{summary.get('unchanged', 0)} 個無變化")
+                return True
+            else:
+                logger.error(f"❌ 遠程同步執行失敗: {chr(10).join(stderr_lines)}")
+                return False
+            
+        except Exception as e:
+            logger.error(f"❌ 觸發遠程同步時出錯: {e}")
+            if process is not None and process.poll() is None:
+                process.kill()
+            return False
+    
+    def trigger_remote_sync_scp(self, repositories: List[Dict]) -> bool:
+        """通過臨時文件 + scp + ssh 觸發遠程同步"""
+        temp_file = "/tmp/trae_repo_list.json"
         try:
             logger.info("🚀 觸發EC2端倉庫同步...")
             
@@ -165,42 +363,24 @@ class TraeMCPSyncMonitor:
             }
             
             # 將倉庫列表寫入臨時文件
-            temp_file = "/tmp/trae_repo_list.json"
             with open(temp_file, "w", encoding="utf-8") as f:
                 json.dump(repo_data, f, indent=2, ensure_ascii=False)
             
-            # 通過SSH將文件傳輸到EC2並執行同步腳本
-            ssh_cmd = [
-                "ssh",
-                "-o", "StrictHostKeyChecking=no",
-                "-p", str(CONFIG["serveo_port"]),
-                f"alexchuang@serveo.net"
-            ]
+            # 通過共享的SSH會話將文件傳輸到EC2並執行同步腳本
+            if not self.ssh.ensure():
+                logger.error("無法建立SSH連接")
+                return False
             
             # 傳輸倉庫列表文件
-            scp_cmd = [
-                "scp",
-                "-o", "StrictHostKeyChecking=no",
-                "-P", str(CONFIG["serveo_port"]),
-                temp_file,
-                f"alexchuang@serveo.net:/tmp/trae_repo_list.json"
-            ]
-            
-            result = subprocess.run(scp_cmd, capture_output=True, text=True)
+            result = self.ssh.copy(temp_file, "/tmp/trae_repo_list.json")
             if result.returncode != 0:
                 logger.error(f"傳輸倉庫列表失敗: {result.stderr}")
                 return False
             
             # 執行遠程同步腳本
-            remote_cmd = ssh_cmd + [
-                f"python3 {CONFIG['sync_script_path']} --repo-list /tmp/trae_repo_list.json"
-            ]
-            
-            result = subprocess.run(
-                remote_cmd,
-                capture_output=True,
-                text=True,
-                timeout=1800  # 30分鐘超時
+            result = self.ssh.run(
+                f"python3 {CONFIG['sync_script_path']} --repo-list /tmp/trae_repo_list.json",
+                timeout=CONFIG["sync_timeout"]
             )
             
             if result.returncode == 0:
@@ -222,8 +402,83 @@ class TraeMCPSyncMonitor:
             if os.path.exists(temp_file):
                 os.remove(temp_file)
     
-    def sync_all_repositories(self):
-        """同步所有倉庫"""
+    def load_sync_state(self) -> Dict:
+        """加載每個倉庫的同步狀態"""
+        state = {"last_full_sync": None, "repositories": {}}
+        try:
+            state_file = os.path.expanduser(CONFIG["state_file"])
+            if os.path.exists(state_file):
+                with open(state_file, "r", encoding="utf-8") as f:
+                    state.update(json.load(f))
+        except Exception as e:
+            logger.warning(f"加載同步狀態失敗，將執行完整同步: {e}")
+        return state
+    
+    def save_sync_state(self):
+        """保存同步狀態"""
+        try:
+            state_file = os.path.expanduser(CONFIG["state_file"])
+            temp_file = state_file + ".tmp"
+            with open(temp_file, "w", encoding="utf-8") as f:
+                json.dump(self.sync_state, f, indent=2, ensure_ascii=False)
+            os.replace(temp_file, state_file)
+        except Exception as e:
+            logger.error(f"保存同步狀態時出錯: {e}")
+    
+    @staticmethod
+    def get_codekg_mtime(repo: Dict) -> Optional[float]:
+        """CodeKG數據庫及其WAL文件的最新修改時間"""
+        db_file = repo.get("db_file")
+        if not db_file:
+            return None
+        mtimes = []
+        for path in (db_file, db_file + "-wal"):
+            try:
+                mtimes.append(os.stat(path).st_mtime)
+            except OSError:
+                continue
+        return max(mtimes) if mtimes else None
+    
+    def full_sync_due(self) -> bool:
+        """是否需要執行完整對賬同步"""
+        last_full_sync = self.sync_state.get("last_full_sync")
+        if not last_full_sync:
+            return True
+        elapsed = (datetime.now() - datetime.fromisoformat(last_full_sync)).total_seconds()
+        return elapsed > CONFIG["full_sync_interval"]
+    
+    def select_changed_repositories(self, repositories: List[Dict]) -> List[Dict]:
+        """只選出新增或CodeKG數據庫有變化的倉庫"""
+        changed = []
+        for repo in repositories:
+            state = self.sync_state["repositories"].get(repo["name"])
+            # 從未成功同步過的倉庫（可能只有失敗的調度記錄）
+            if state is None or not state.get("last_synced"):
+                changed.append(repo)
+                continue
+            mtime = self.get_codekg_mtime(repo)
+            if mtime is not None and mtime != state.get("codekg_mtime"):
+                changed.append(repo)
+        return changed
+    
+    def mark_synced(self, repositories: List[Dict], full: bool, heads: Optional[Dict[str, str]] = None):
+        """記錄倉庫已同步"""
+        now = datetime.now().isoformat()
+        for repo in repositories:
+            state = self.sync_state["repositories"].setdefault(repo["name"], {})
+            state["codekg_mtime"] = self.get_codekg_mtime(repo)
+            state["last_synced"] = now
+            if heads and heads.get(repo["name"]):
+                state["remote_head"] = heads[repo["name"]]
+            else:
+                state.setdefault("remote_head", None)
+        if full:
+            self.sync_state["last_full_sync"] = now
+        self.known_repositories = set(self.sync_state["repositories"])
+        self.save_sync_state()
+    
+    def sync_all_repositories(self, full: bool = False):
+        """同步所有倉庫，默認只發送新增或有變化的倉庫"""
         logger.info("🚀 開始倉庫同步任務")
         
         repositories = self.get_repositories_from_trae()
@@ -231,23 +486,114 @@ class TraeMCPSyncMonitor:
             logger.warning("未發現任何倉庫")
             return
         
-        # 觸發遠程同步
-        success = self.trigger_remote_sync(repositories)
+        # 定期執行完整對賬，其他時候只同步有變化的倉庫
+        full = full or self.full_sync_due()
+        pending = repositories if full else self.select_changed_repositories(repositories)
+        logger.info(f"📋 {'完整同步' if full else '增量同步'}: {len(pending)}/{len(repositories)} 個倉庫")
         
-        if success:
+        if not pending:
             self.last_sync_time = datetime.now()
+            logger.info("✅ 沒有需要同步的倉庫")
+            return
+        
+        # 觸發遠程同步，每個倉庫的結果到達時即已記錄
+        success, _ = self.sync_batch(pending)
+        
+        if success:
+            if full:
+                self.sync_state["last_full_sync"] = datetime.now().isoformat()
+                self.save_sync_state()
             logger.info(f"🎉 倉庫同步任務完成")
         else:
             logger.error("❌ 倉庫同步任務失敗")
         
         # 生成同步報告
-        self.generate_sync_report(repositories, success)
+        self.generate_sync_report(pending, success, full=full, discovered=len(repositories))
     
-    def generate_sync_report(self, repositories: List[Dict], success: bool):
+    def record_repository_result(self, repo: Dict, success: bool, head: Optional[str] = None):
+        """記錄單個倉庫的同步結果，更新調度並立即保存狀態"""
+        self.scheduler.record_result(repo["name"], success)
+        schedule = self.scheduler.export(repo["name"])
+        if schedule:
+            self.sync_state["repositories"].setdefault(repo["name"], {}).update(schedule)
+        if success:
+            self.last_sync_time = datetime.now()
+            self.mark_synced([repo], full=False, heads={repo["name"]: head} if head else None)
+        else:
+            self.save_sync_state()
+    
+    def sync_batch(self, repositories: List[Dict]):
+        """觸發遠程同步並逐個記錄結果，返回 (整體是否成功, 成功的倉庫名)"""
+        by_name = {repo["name"]: repo for repo in repositories}
+        outcomes: Dict[str, bool] = {}
+        
+        def on_result(event: Dict):
+            repo = by_name.get(event.get("name"))
+            if repo is None or repo["name"] in outcomes:
+                return
+            outcomes[repo["name"]] = bool(event.get("success"))
+            self.record_repository_result(repo, outcomes[repo["name"]], event.get("head"))
+        
+        success = self.trigger_remote_sync(repositories, on_result=on_result)
+        
+        # 沒有逐個結果的倉庫（scp傳輸，或超時、斷線時仍在進行）以整體結果為準
+        for repo in repositories:
+            if repo["name"] not in outcomes:
+                outcomes[repo["name"]] = success
+                self.record_repository_result(repo, success)
+        return success, [name for name, ok in outcomes.items() if ok]
+    
+    def update_schedule(self, repositories: List[Dict]):
+        """將倉庫加入調度器，並為CodeKG有新變化的倉庫安排同步"""
+        for repo in repositories:
+            state = self.sync_state["repositories"].get(repo["name"], {})
+            last_synced = state.get("last_synced")
+            self.scheduler.add(
+                repo["name"],
+                last_synced=datetime.fromisoformat(last_synced).timestamp() if last_synced else None,
+                interval=state.get("interval"),
+                failures=state.get("failures", 0)
+            )
+        self.scheduler.update(repo["name"] for repo in repositories)
+        
+        for repo in repositories:
+            mtime = self.get_codekg_mtime(repo)
+            if mtime is None or mtime == self.observed_mtimes.get(repo["name"]):
+                continue
+            # 新倉庫加入時已經到期，只有已知倉庫需要通知變化
+            if repo["name"] in self.observed_mtimes:
+                self.scheduler.notify_change(repo["name"])
+            self.observed_mtimes[repo["name"]] = mtime
+    
+    def run_scheduled_syncs(self):
+        """同步調度器中已到期的倉庫"""
+        repositories = self.get_repositories_from_trae()
+        self.update_schedule(repositories)
+        
+        due = set(self.scheduler.pop_due())
+        if not due:
+            logger.debug("沒有到期的倉庫")
+            return
+        pending = [repo for repo in repositories if repo["name"] in due]
+        logger.info(f"📋 調度同步: {len(pending)}/{len(repositories)} 個倉庫")
+        
+        success, succeeded = self.sync_batch(pending)
+        
+        if len(succeeded) == len(pending):
+            logger.info(f"🎉 倉庫同步任務完成")
+        else:
+            logger.error(f"❌ {len(pending) - len(succeeded)} 個倉庫同步失敗，將退避重試")
+        
+        self.generate_sync_report(pending, success, full=False, discovered=len(repositories))
+    
+    def generate_sync_report(self, repositories: List[Dict], success: bool, full: bool = True,
+                             discovered: Optional[int] = None):
         """生成同步報告"""
         try:
             report = {
                 "sync_time": self.last_sync_time.isoformat() if self.last_sync_time else None,
+                "sync_mode": "full" if full else "delta",
+                "discovered_repositories": discovered if discovered is not None else len(repositories),
                 "total_repositories": len(repositories),
                 "sync_success": success,
                 "repositories": [repo["name"] for repo in repositories],
@@ -263,37 +609,53 @@ class TraeMCPSyncMonitor:
         except Exception as e:
             logger.error(f"生成同步報告時出錯: {e}")
     
-    def start_monitoring(self):
-        """開始監控"""
+    def start_monitoring(self, watch: bool = False):
+        """開始監控，watch為True時由文件變化事件驅動"""
         logger.info("🔍 開始監控MCP與Trae連接狀態...")
         self.is_running = True
         
-        while self.is_running:
-            try:
-                if self.check_mcp_connection():
-                    # 檢查是否需要同步（避免過於頻繁）
-                    if (self.last_sync_time is None or 
-                        (datetime.now() - self.last_sync_time).seconds > 3600):  # 1小時間隔
-                        
-                        self.sync_all_repositories()
+        watcher = None
+        if watch:
+            targets = trae_watch_targets(
+                CONFIG["trae_app_support"],
+                os.path.join(CONFIG["trae_app_support"], CONFIG["state_db"])
+            )
+            watcher = ChangeWatcher(targets["files"], targets["trees"], debounce=CONFIG["watch_debounce"])
+        
+        try:
+            while self.is_running:
+                try:
+                    connected = self.check_mcp_connection()
+                    if connected:
+                        # 由調度器決定哪些倉庫到期
+                        self.run_scheduled_syncs()
                     else:
-                        logger.debug("距離上次同步時間過短，跳過本次同步")
-                else:
-                    logger.debug("MCP與Trae未連接，等待連接...")
-                
-                time.sleep(CONFIG["check_interval"])
-                
-            except KeyboardInterrupt:
-                logger.info("收到中斷信號，停止監控...")
-                self.stop_monitoring()
-                break
-            except Exception as e:
-                logger.error(f"監控過程中出錯: {e}")
-                time.sleep(CONFIG["check_interval"])
+                        logger.debug("MCP與Trae未連接，等待連接...")
+                    
+                    default = CONFIG["watch_idle_timeout"] if watcher is not None else CONFIG["check_interval"]
+                    timeout = max(1.0, self.scheduler.seconds_until_next(default)) if connected else default
+                    if watcher is not None:
+                        # 沒有變化時阻塞等待到下一個倉庫到期，不佔用CPU
+                        if watcher.wait(timeout=timeout):
+                            logger.info("📝 檢測到Trae數據變化")
+                    else:
+                        time.sleep(timeout)
+                    
+                except KeyboardInterrupt:
+                    logger.info("收到中斷信號，停止監控...")
+                    self.stop_monitoring()
+                    break
+                except Exception as e:
+                    logger.error(f"監控過程中出錯: {e}")
+                    time.sleep(CONFIG["check_interval"])
+        finally:
+            if watcher is not None:
+                watcher.close()
     
     def stop_monitoring(self):
         """停止監控"""
         self.is_running = False
+        self.agent.close()
         logger.info("🛑 監控已停止")
 
 def main():
@@ -314,6 +676,20 @@ def main():
         if len(sys.argv) > 1 and sys.argv[1] == "--sync-once":
             logger.info("執行一次性同步...")
             monitor.sync_all_repositories()
+        elif len(sys.argv) > 1 and sys.argv[1] == "--full-sync":
+            logger.info("執行一次性完整同步...")
+            monitor.sync_all_repositories(full=True)
+        elif len(sys.argv) > 1 and sys.argv[1] == "--queue":
+            # 查看每個倉庫的調度狀態
+            monitor.update_schedule(monitor.get_repositories_from_trae())
+            print(f"{'倉庫':<36} {'原因':<9} {'到期(秒)':>10} {'間隔(秒)':>10} {'失敗':>5}")
+            for item in monitor.scheduler.queue():
+                due_in = "-" if item["due_in"] is None else f"{item['due_in']:.0f}"
+                print(f"{item['name']:<36} {item['reason'] or '-':<9} {due_in:>10} "
+                      f"{item['interval']:>10.0f} {item['failures']:>5}")
+        elif len(sys.argv) > 1 and sys.argv[1] == "--watch":
+            # 由文件變化事件驅動的監控
+            monitor.start_monitoring(watch=True)
         else:
             # 開始持續監控
             monitor.start_monitoring()
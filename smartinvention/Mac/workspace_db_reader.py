@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Trae Workspace Database Reader
+按VS Code / Trae的 ItemTable(key, value) 結構讀取 .vscdb 數據庫
+
+以只讀URI打開數據庫，不會與正在運行的Trae爭用寫鎖；先在key列上過濾，
+再按批次流式讀取value，覆蓋全部匹配的記錄且每個數據庫的開銷可預期。
+"""
+
+import sqlite3
+import logging
+from pathlib import Path
+from typing import Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import quote
+
+logger = logging.getLogger(__name__)
+
+# 可能包含倉庫信息的key
+DEFAULT_KEY_PATTERNS = (
+    "%git%",
+    "%scm%",
+    "%repositor%",
+    "%workspace%",
+    "%folder%",
+    "%recent%",
+    "%history%",
+    "%memento%",
+    "%input%"
+)
+
+
+class WorkspaceDBReader:
+    def __init__(self, key_patterns: Optional[Sequence[str]] = DEFAULT_KEY_PATTERNS,
+                 arraysize: int = 256, timeout: float = 5, immutable: bool = False):
+        self.key_patterns = tuple(key_patterns) if key_patterns else ()
+        self.arraysize = max(1, arraysize)
+        self.timeout = timeout
+        self.immutable = immutable
+
+    def connect(self, db_file: Path) -> sqlite3.Connection:
+        """以只讀方式打開數據庫"""
+        # immutable=1 跳過所有鎖和WAL，只適合Trae未運行時使用
+        mode = "immutable=1" if self.immutable else "mode=ro"
+        uri = f"file:{quote(str(db_file))}?{mode}"
+        conn = sqlite3.connect(uri, uri=True, timeout=self.timeout)
+        # 文本列直接以bytes返回，不做解碼
+        conn.text_factory = bytes
+        return conn
+
+    @staticmethod
+    def item_tables(conn: sqlite3.Connection) -> List[str]:
+        """查找具有 (key, value) 結構的表"""
+        tables = []
+        cursor = conn.execute("SELECT name FROM sqlite_master WHERE type='table'")
+        for (name,) in cursor.fetchall():
+            name = name.decode("utf-8") if isinstance(name, bytes) else name
+            columns = {
+                (column[1].decode("utf-8") if isinstance(column[1], bytes) else column[1]).lower()
+                for column in conn.execute(f'PRAGMA table_info("{name}")').fetchall()
+            }
+            if {"key", "value"} <= columns:
+                tables.append(name)
+        return tables
+
+    def iter_items(self, db_file: Path, key_patterns: Optional[Sequence[str]] = None) -> Iterator[Tuple[bytes, bytes]]:
+        """按批次迭代匹配key的 (key, value) 記錄"""
+        patterns = self.key_patterns if key_patterns is None else tuple(key_patterns)
+
+        conn = self.connect(db_file)
+        try:
+            for table in self.item_tables(conn):
+                query = f'SELECT key, value FROM "{table}"'
+                if patterns:
+                    query += " WHERE " + " OR ".join(["key LIKE ?"] * len(patterns))
+
+                cursor = conn.cursor()
+                cursor.arraysize = self.arraysize
+                cursor.execute(query, patterns)
+                while True:
+                    rows = cursor.fetchmany()
+                    if not rows:
+                        break
+                    for key, value in rows:
+                        yield key, value
+        finally:
+            conn.close()
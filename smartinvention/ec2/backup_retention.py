@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+Backup Retention (EC2端)
+按備份索引決定保留哪些快照，取代每次同步後 `find -mtime +7 -exec rm -rf`
+
+- 索引 (backup_directory/index.json) 記錄每個快照的倉庫、時間、大小和HEAD，
+  由 SnapshotStore 在創建和丟棄快照時維護；保留策略按索引選擇，不需要逐個讀取快照元數據
+- 硬鏈接快照的大小是只被備份持有的字節：倉庫gc/重新打包後舊的pack只剩快照中的鏈接，
+  這些文件計入引用它的最新快照（按從舊到新刪除時，刪除一個快照正好釋放它被計入的字節）；
+  與倉庫共用的文件不計入。快照創建時在索引中記錄它鏈接的pack inode，清理前只需重新stat
+  每個倉庫最新快照中的pack，不遍歷備份目錄，使 max_bytes 限制的是實際佔用的磁盤
+- 每個倉庫保留最新的 keep_last 個，另外按天/周/月各保留每個時段最新的一個
+  (grandfather-father-son)
+- 所有倉庫的快照總大小超過 max_bytes 時，從最舊的開始繼續刪除，
+  但每個倉庫至少保留最新的一個
+- 過期快照先改名移入 .trash 並從索引刪除，再由後台線程並行刪除
+"""
+
+import os
+import re
+import json
+import shutil
+import logging
+import threading
+import contextlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, ContextManager, Dict, List, Optional
+
+from object_store import directory_size
+from repo_snapshot import METADATA_FILE, link_stats
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = "index.json"
+TRASH_DIR = ".trash"
+# <倉庫>_<YYYYmmdd>_<HHMMSS>[_n]
+SNAPSHOT_NAME = re.compile(r"^(?P<repository>.+)_\d{8}_\d{6}(?:_\d+)?$")
+
+DEFAULT_POLICY = {
+    "keep_last": 3,  # 每個倉庫無條件保留的最新快照數
+    "daily": 7,  # 保留最近7個有快照的日子各一個
+    "weekly": 4,
+    "monthly": 6,
+    "max_age_days": None,  # 超過天數的快照不參與分層保留，None表示不限
+    "max_bytes": None  # 所有快照的總大小上限，None表示不限
+}
+
+
+class BackupIndex:
+    """快照索引；硬鏈接快照記錄鏈接的pack inode，大小由 account() 按引用計數統計"""
+
+    def __init__(self, backup_dir: Path):
+        self.backup_dir = Path(backup_dir)
+        self.index_file = self.backup_dir / INDEX_FILE
+        self.entries: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.index_file, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+            # 舊版索引沒有記錄硬鏈接快照的pack，重建一次
+            if any(entry.get("backend") == "hardlink" and "packs" not in entry for entry in self.entries.values()):
+                self.rebuild()
+        except FileNotFoundError:
+            # 第一次使用時從現有備份建立索引
+            self.rebuild()
+        except Exception as e:
+            logger.warning(f"讀取備份索引失敗，重新建立: {e}")
+            self.rebuild()
+
+    def _write(self, entries: Dict[str, Dict]):
+        temp_file = f"{self.index_file}.{os.getpid()}.tmp"
+        with open(temp_file, "w", encoding="utf-8") as f:
+            json.dump(entries, f, indent=2, ensure_ascii=False)
+        os.replace(temp_file, self.index_file)
+
+    def _save(self, keys: List[str]):
+        """合併寫回變化的條目，其他進程同時寫入的條目不會丟失"""
+        try:
+            try:
+                with open(self.index_file, "r", encoding="utf-8") as f:
+                    entries = json.load(f)
+            except (FileNotFoundError, ValueError):
+                entries = {}
+            for key in keys:
+                if key in self.entries:
+                    entries[key] = self.entries[key]
+                else:
+                    entries.pop(key, None)
+            self._write(entries)
+        except Exception as e:
+            logger.warning(f"保存備份索引失敗: {e}")
+
+    def rebuild(self) -> int:
+        """遍歷備份目錄重建索引，只在索引缺失或手動要求時使用"""
+        entries = {}
+        if self.backup_dir.exists():
+            for path in self.backup_dir.iterdir():
+                match = SNAPSHOT_NAME.match(path.name)
+                if not match or not path.is_dir():
+                    continue
+                try:
+                    with open(path / METADATA_FILE, "r", encoding="utf-8") as f:
+                        info = json.load(f)
+                except (OSError, ValueError):
+                    # 舊版 cp -r 備份
+                    info = {"id": path.name, "repository": match["repository"], "backend": "copy", "head": None,
+                            "created": datetime.fromtimestamp(path.stat().st_mtime).isoformat()}
+                if info.get("backend") == "hardlink":
+                    # 舊版快照的元數據沒有pack記錄，重建時按現有鏈接補上；大小在下面統一統計
+                    if "packs" not in info:
+                        info.update(link_stats(path / ".git"))
+                    size = info.get("bytes_copied", 0)
+                else:
+                    size = directory_size(path)
+                entries[path.name] = self._entry(info, size)
+        with self._lock:
+            self.entries = entries
+            self._apply_sizes(self._hardlink_sizes(entries))
+            try:
+                self.backup_dir.mkdir(parents=True, exist_ok=True)
+                self._write(self.entries)
+            except Exception as e:
+                logger.warning(f"保存備份索引失敗: {e}")
+        logger.info(f"📇 已建立備份索引: {len(entries)} 個快照")
+        return len(entries)
+
+    @staticmethod
+    def _entry(info: Dict, size: int) -> Dict:
+        entry = {
+            "repository": info["repository"],
+            "created": info["created"],
+            "size": size,
+            "head": info.get("head"),
+            "backend": info.get("backend")
+        }
+        if info.get("backend") == "hardlink" and "packs" in info:
+            # {pack文件名: [inode, 大小]}，松散對象只記錄總字節
+            entry.update({key: info.get(key, 0) for key in ("bytes_copied", "loose_bytes")})
+            entry["packs"] = info["packs"]
+        return entry
+
+    def add(self, info: Dict):
+        """記錄新快照"""
+        if info.get("backend") == "hardlink":
+            size = info.get("bytes_copied", 0)
+        else:
+            size = directory_size(Path(info["path"]))
+        with self._lock:
+            self.entries[info["id"]] = self._entry(info, size)
+            self._save([info["id"]])
+
+    def remove(self, snapshot_ids: List[str]):
+        with self._lock:
+            for snapshot_id in snapshot_ids:
+                self.entries.pop(snapshot_id, None)
+            self._save(snapshot_ids)
+
+    def _hardlink_sizes(self, entries: Dict[str, Dict]) -> Dict[str, int]:
+        """按索引中記錄的pack inode統計硬鏈接快照只被備份持有的字節
+
+        同一個pack被多個快照鏈接時計入最新的一個。只有每個倉庫最新快照中的pack可能仍被倉庫
+        使用，重新stat這些文件：鏈接數多於引用它的快照數說明倉庫（或待刪除的快照）還持有它。
+        更舊快照中不在最新快照裡的pack，在創建最新快照時已經不在倉庫中，不需要stat。
+        松散對象沒有逐個記錄，最新快照的算作與倉庫共用，更舊快照的算作只被備份持有。
+        """
+        snapshots = sorted((entry["created"], snapshot_id) for snapshot_id, entry in entries.items()
+                           if entry.get("backend") == "hardlink" and "packs" in entry)
+        references: Dict[int, int] = {}
+        owners: Dict[int, str] = {}
+        pack_sizes: Dict[int, int] = {}
+        newest: Dict[str, str] = {}
+        for _, snapshot_id in snapshots:
+            entry = entries[snapshot_id]
+            newest[entry["repository"]] = snapshot_id
+            for inode, size in entry["packs"].values():
+                references[inode] = references.get(inode, 0) + 1
+                # 按創建時間從舊到新遍歷，最後記錄的就是最新的快照
+                owners[inode] = snapshot_id
+                pack_sizes[inode] = size
+
+        shared = set()
+        for snapshot_id in newest.values():
+            pack_dir = self.backup_dir / snapshot_id / ".git" / "objects" / "pack"
+            for name, (inode, _) in entries[snapshot_id]["packs"].items():
+                try:
+                    links = os.lstat(pack_dir / name).st_nlink
+                except OSError:
+                    continue
+                if links > references[inode]:
+                    shared.add(inode)
+
+        latest = set(newest.values())
+        sizes = {snapshot_id: entries[snapshot_id]["bytes_copied"] +
+                 (0 if snapshot_id in latest else entries[snapshot_id]["loose_bytes"])
+                 for _, snapshot_id in snapshots}
+        for inode, owner in owners.items():
+            if inode not in shared:
+                sizes[owner] += pack_sizes[inode]
+        return sizes
+
+    def _apply_sizes(self, sizes: Dict[str, int]) -> List[str]:
+        """更新條目大小，返回大小變化的快照ID，調用方需持有 self._lock"""
+        changed = [snapshot_id for snapshot_id, size in sizes.items()
+                   if snapshot_id in self.entries and self.entries[snapshot_id]["size"] != size]
+        for snapshot_id in changed:
+            self.entries[snapshot_id] = {**self.entries[snapshot_id], "size": sizes[snapshot_id]}
+        return changed
+
+    def account(self) -> int:
+        """按pack引用重新計算硬鏈接快照的大小並保存，返回所有快照的總字節數"""
+        with self._lock:
+            changed = self._apply_sizes(self._hardlink_sizes(self.entries))
+            if changed:
+                self._save(changed)
+        return self.total_bytes()
+
+    def total_bytes(self) -> int:
+        return sum(entry["size"] for entry in self.entries.values())
+
+
+def select_expired(entries: Dict[str, Dict], policy: Dict, now: Optional[datetime] = None) -> Dict[str, str]:
+    """按策略選出要刪除的快照，返回 {快照ID: 原因}"""
+    policy = {**DEFAULT_POLICY, **(policy or {})}
+    now = now or datetime.now()
+    by_repository: Dict[str, List[tuple]] = {}
+    for snapshot_id, entry in entries.items():
+        by_repository.setdefault(entry["repository"], []).append((datetime.fromisoformat(entry["created"]), snapshot_id))
+
+    tiers = (
+        ("daily", lambda created: created.date()),
+        ("weekly", lambda created: created.isocalendar()[:2]),
+        ("monthly", lambda created: (created.year, created.month))
+    )
+    cutoff = now - timedelta(days=policy["max_age_days"]) if policy["max_age_days"] is not None else None
+
+    expired = {}
+    newest = set()
+    for snapshots in by_repository.values():
+        snapshots.sort(reverse=True)
+        newest.add(snapshots[0][1])
+        keep = {snapshot_id for _, snapshot_id in snapshots[:max(1, policy["keep_last"])]}
+        for tier, bucket_of in tiers:
+            buckets = set()
+            for created, snapshot_id in snapshots:
+                if cutoff is not None and created < cutoff:
+                    break
+                bucket = bucket_of(created)
+                if bucket in buckets:
+                    continue
+                if len(buckets) >= policy[tier]:
+                    break
+                buckets.add(bucket)
+                keep.add(snapshot_id)
+        for created, snapshot_id in snapshots:
+            if snapshot_id not in keep:
+                expired[snapshot_id] = "age" if cutoff is not None and created < cutoff else "retention"
+
+    # 總大小超出預算時從最舊的開始刪除，每個倉庫至少保留最新的一個
+    if policy["max_bytes"] is not None:
+        remaining = sum(entry["size"] for snapshot_id, entry in entries.items() if snapshot_id not in expired)
+        candidates = sorted(
+            (entry["created"], snapshot_id) for snapshot_id, entry in entries.items()
+            if snapshot_id not in expired and snapshot_id not in newest
+        )
+        for _, snapshot_id in candidates:
+            if remaining <= policy["max_bytes"]:
+                break
+            expired[snapshot_id] = "budget"
+            remaining -= entries[snapshot_id]["size"]
+    return expired
+
+
+class RetentionEngine:
+    def __init__(self, backup_dir: Path, index: BackupIndex, policy: Optional[Dict] = None, workers: int = 4,
+                 delete_lock: Optional[Callable[[Path], ContextManager]] = None):
+        self.backup_dir = Path(backup_dir)
+        # 刪除快照時持有的鎖，例如共用對象庫的共享鎖，避免與對象庫回收同時進行
+        self.delete_lock = delete_lock or (lambda path: contextlib.nullcontext())
+        self.trash_dir = self.backup_dir / TRASH_DIR
+        self.index = index
+        self.policy = {**DEFAULT_POLICY, **(policy or {})}
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="backup-delete")
+        self._pending: List[Future] = []
+        self._lock = threading.Lock()
+
+    def _delete(self, path: Path):
+        with self.delete_lock(path):
+            shutil.rmtree(path, ignore_errors=True)
+
+    def _submit(self, path: Path):
+        with self._lock:
+            self._pending = [future for future in self._pending if not future.done()]
+            self._pending.append(self.executor.submit(self._delete, path))
+
+    def apply(self, policy: Optional[Dict] = None, dry_run: bool = False) -> Dict:
+        """刪除過期快照，立即返回，實際刪除在後台進行"""
+        policy = {**self.policy, **(policy or {})}
+        if policy["max_bytes"] is not None:
+            # 倉庫gc後舊pack只剩快照持有；只重新stat各倉庫最新快照中的pack
+            self.index.account()
+        expired = select_expired(self.index.entries, policy)
+        freed = sum(self.index.entries[snapshot_id]["size"] for snapshot_id in expired)
+        summary = {
+            "expired": len(expired),
+            "bytes_freed": freed,
+            "reasons": {reason: sum(1 for value in expired.values() if value == reason)
+                        for reason in set(expired.values())},
+            "kept": len(self.index.entries) - len(expired),
+            "bytes_kept": self.index.total_bytes() - freed
+        }
+        if dry_run:
+            summary["snapshots"] = expired
+            return summary
+
+        self.trash_dir.mkdir(parents=True, exist_ok=True)
+        # 上次中斷時留下的待刪除目錄
+        for path in self.trash_dir.iterdir():
+            self._submit(path)
+
+        moved = []
+        for snapshot_id in expired:
+            source = self.backup_dir / snapshot_id
+            target = self.trash_dir / snapshot_id
+            try:
+                # 同目錄下改名是原子的，之後再慢慢刪除
+                os.rename(source, target)
+                self._submit(target)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"⚠️ 無法移走快照 {snapshot_id}，直接刪除: {e}")
+                self._submit(source)
+            moved.append(snapshot_id)
+        self.index.remove(moved)
+        return summary
+
+    def wait(self):
+        """等待後台刪除完成"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for future in pending:
+            future.result()
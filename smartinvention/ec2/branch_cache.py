@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Git Default Branch Cache (EC2端)
+解析並緩存每個倉庫的默認分支，供 sync_repositories.py 和 trae-sync 共用
+
+優先讀取本地的 origin/HEAD，沒有時使用 `git ls-remote --symref` 查詢遠程。
+解析結果按倉庫路徑持久化，只有pull/fetch失敗時才清除並重新解析，
+不再每次先嘗試main、失敗後再嘗試master。
+緩存文件被其他進程（例如 trae-sync）修改後，常駐進程在下次讀取時重新加載。
+"""
+
+import os
+import json
+import logging
+import threading
+import subprocess
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_FILE = "~/.trae_branch_cache.json"
+# 無法解析默認分支時依次嘗試
+FALLBACK_BRANCHES = ("main", "master")
+
+GIT_ENV = {**os.environ, "GIT_TERMINAL_PROMPT": "0"}
+
+
+def parse_ls_remote_symref(output: str) -> Tuple[Optional[str], Optional[str]]:
+    """解析 `git ls-remote --symref <url> HEAD` 的輸出，返回 (默認分支, HEAD提交)"""
+    branch = None
+    head = None
+    for line in output.splitlines():
+        if line.startswith("ref: "):
+            ref, _, name = line[5:].partition("\t")
+            if name == "HEAD" and ref.startswith("refs/heads/"):
+                branch = ref[len("refs/heads/"):]
+        else:
+            sha, _, name = line.partition("\t")
+            if name == "HEAD" and sha:
+                head = sha
+    return branch, head
+
+
+class BranchCache:
+    def __init__(self, cache_file: str = DEFAULT_CACHE_FILE):
+        self.cache_file = os.path.expanduser(cache_file)
+        self.entries: Dict[str, Dict] = {}
+        # get() 會重新加載，store() 持有鎖時也會調用 get()
+        self._lock = threading.RLock()
+        self._signature = None
+        self.load()
+
+    def _file_signature(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.cache_file)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def load(self):
+        self._signature = self._file_signature()
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            self.entries = {}
+        except Exception as e:
+            logger.warning(f"讀取分支緩存失敗，將重新解析: {e}")
+            self.entries = {}
+
+    def reload_if_changed(self):
+        """緩存文件在上次讀取後被修改時重新加載"""
+        with self._lock:
+            if self._file_signature() != self._signature:
+                self.load()
+
+    def _save(self, key: str):
+        """合併寫回單個條目，其他進程同時寫入的條目不會丟失"""
+        try:
+            try:
+                with open(self.cache_file, "r", encoding="utf-8") as f:
+                    entries = json.load(f)
+            except (FileNotFoundError, ValueError):
+                entries = {}
+            if key in self.entries:
+                entries[key] = self.entries[key]
+            else:
+                entries.pop(key, None)
+
+            temp_file = f"{self.cache_file}.{os.getpid()}.tmp"
+            with open(temp_file, "w", encoding="utf-8") as f:
+                json.dump(entries, f, indent=2, ensure_ascii=False)
+            os.replace(temp_file, self.cache_file)
+        except Exception as e:
+            logger.warning(f"保存分支緩存失敗: {e}")
+
+    def get(self, repo_path: Union[str, Path]) -> Optional[str]:
+        self.reload_if_changed()
+        entry = self.entries.get(str(repo_path))
+        return entry.get("branch") if entry else None
+
+    def store(self, repo_path: Union[str, Path], branch: str, source: str):
+        key = str(repo_path)
+        with self._lock:
+            if self.get(key) == branch:
+                return
+            self.entries[key] = {"branch": branch, "source": source, "resolved_at": datetime.now().isoformat()}
+            self._save(key)
+
+    def invalidate(self, repo_path: Union[str, Path]):
+        key = str(repo_path)
+        with self._lock:
+            if self.entries.pop(key, None) is not None:
+                self._save(key)
+
+    @staticmethod
+    def local_default_branch(repo_path: Union[str, Path]) -> Optional[str]:
+        """讀取克隆時記錄的 origin/HEAD"""
+        try:
+            result = subprocess.run([
+                "git", "-C", str(repo_path), "symbolic-ref", "--quiet", "--short", "refs/remotes/origin/HEAD"
+            ], capture_output=True, text=True, timeout=10)
+        except Exception:
+            return None
+        ref = result.stdout.strip()
+        if result.returncode != 0 or not ref.startswith("origin/"):
+            return None
+        return ref[len("origin/"):]
+
+    @staticmethod
+    def remote_default_branch(url: str, timeout: float = 30) -> Optional[str]:
+        """通過 ls-remote --symref 查詢遠程的默認分支"""
+        try:
+            result = subprocess.run([
+                "git", "ls-remote", "--symref", url, "HEAD"
+            ], capture_output=True, text=True, timeout=timeout, env=GIT_ENV)
+        except Exception:
+            return None
+        if result.returncode != 0:
+            return None
+        return parse_ls_remote_symref(result.stdout)[0]
+
+    def resolve(self, repo_path: Union[str, Path], url: str, remote_only: bool = False) -> Optional[str]:
+        """返回默認分支，依次使用緩存、origin/HEAD、ls-remote"""
+        if not remote_only:
+            branch = self.get(repo_path)
+            if branch:
+                return branch
+            branch = self.local_default_branch(repo_path)
+            if branch:
+                self.store(repo_path, branch, "origin/HEAD")
+                return branch
+
+        branch = self.remote_default_branch(url)
+        if branch:
+            self.store(repo_path, branch, "ls-remote")
+        return branch
+
+
+def _pull(repo_path: Union[str, Path], branch: str, timeout: float) -> subprocess.CompletedProcess:
+    return subprocess.run([
+        "git", "-C", str(repo_path), "pull", "origin", branch
+    ], capture_output=True, text=True, timeout=timeout, env=GIT_ENV)
+
+
+def _fetch(repo_path: Union[str, Path], branch: str, timeout: float) -> subprocess.CompletedProcess:
+    return subprocess.run([
+        "git", "-C", str(repo_path), "fetch", "origin", branch
+    ], capture_output=True, text=True, timeout=timeout, env=GIT_ENV)
+
+
+def _with_default_branch(cache: BranchCache, repo_path: Union[str, Path], url: str, operation, source: str,
+                         timeout: float) -> Tuple[bool, Optional[str], str]:
+    """對默認分支執行 operation (_pull / _fetch)，返回 (是否成功, 分支, 錯誤信息)
+
+    失敗時清除緩存並向遠程重新查詢，默認分支已改名時用新分支再試一次。
+    """
+    branch = cache.resolve(repo_path, url)
+    result = None
+    for candidate in ([branch] if branch else FALLBACK_BRANCHES):
+        result = operation(repo_path, candidate, timeout)
+        if result.returncode == 0:
+            if branch is None:
+                cache.store(repo_path, candidate, source)
+            return True, candidate, ""
+
+    cache.invalidate(repo_path)
+    if branch is not None:
+        fresh = cache.resolve(repo_path, url, remote_only=True)
+        if fresh and fresh != branch:
+            logger.info(f"默認分支已從 {branch} 變為 {fresh}")
+            result = operation(repo_path, fresh, timeout)
+            if result.returncode == 0:
+                return True, fresh, ""
+    return False, branch, result.stderr if result is not None else ""
+
+
+def pull_default_branch(cache: BranchCache, repo_path: Union[str, Path], url: str,
+                        timeout: float = 300) -> Tuple[bool, Optional[str], str]:
+    """拉取並合併默認分支，返回 (是否成功, 分支, 錯誤信息)"""
+    return _with_default_branch(cache, repo_path, url, _pull, "pull", timeout)
+
+
+def fetch_default_branch(cache: BranchCache, repo_path: Union[str, Path], url: str,
+                         timeout: float = 300) -> Tuple[bool, Optional[str], str]:
+    """只獲取默認分支的對象，不改動工作區，之後用 merge_fetched() 合併"""
+    return _with_default_branch(cache, repo_path, url, _fetch, "fetch", timeout)
+
+
+def fetched_head(repo_path: Union[str, Path]) -> Optional[str]:
+    """上一次fetch得到的提交 (FETCH_HEAD)"""
+    result = subprocess.run([
+        "git", "-C", str(repo_path), "rev-parse", "--verify", "-q", "FETCH_HEAD^{commit}"
+    ], capture_output=True, text=True, timeout=30)
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+def merge_fetched(repo_path: Union[str, Path], timeout: float = 300) -> subprocess.CompletedProcess:
+    """把FETCH_HEAD快進合併到當前分支，與pull在分支分叉時的默認行為一致"""
+    return subprocess.run([
+        "git", "-C", str(repo_path), "merge", "--ff-only", "FETCH_HEAD"
+    ], capture_output=True, text=True, timeout=timeout, env=GIT_ENV)
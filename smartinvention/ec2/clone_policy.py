@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Git Clone Policy (EC2端)
+每個倉庫的克隆策略，供 sync_repositories.py 和 trae-sync 共用
+
+倉庫列表中的 "clone_policy" 字段（或 ~/.trae_clone_policies.json 中按倉庫名配置）：
+- "full" 或省略：完整克隆
+- "blobless"：--filter=blob:none，文件內容在檢出時按需下載
+- "shallow"：--depth 1
+- 對象形式可以組合，例如 {"filter": "blob:none", "depth": 50, "sparse": ["src", "docs"]}
+
+策略在克隆時生效，並記錄在倉庫的 trae.clonepolicy 配置中；之後的pull會保留
+過濾器、淺克隆邊界和稀疏檢出。稀疏路徑變化時在更新時重新設置；
+過濾器或深度變化時按新策略重新克隆到臨時目錄，成功後替換現有倉庫。
+"""
+
+import os
+import json
+import shutil
+import logging
+import subprocess
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POLICY_FILE = "~/.trae_clone_policies.json"
+FILTERS = ("blob:none", "tree:0")
+SHORTHANDS = {
+    "full": {},
+    "blobless": {"filter": "blob:none"},
+    "treeless": {"filter": "tree:0"},
+    "shallow": {"depth": 1}
+}
+CONFIG_KEY = "trae.clonepolicy"
+# 重新克隆時的臨時目錄和被替換的舊倉庫: <Git目錄>/.<倉庫>.reclone / .<倉庫>.retired
+STAGING_SUFFIX = ".reclone"
+RETIRED_SUFFIX = ".retired"
+
+
+def parse_policy(value) -> Dict:
+    """把倉庫列表中的策略規範化為 {"filter", "depth", "sparse"} 中出現的鍵，無效時拋出ValueError"""
+    if value is None:
+        return {}
+    if isinstance(value, str):
+        if value not in SHORTHANDS:
+            raise ValueError(f"未知的克隆策略: {value}")
+        return dict(SHORTHANDS[value])
+    if not isinstance(value, dict):
+        raise ValueError(f"無效的克隆策略: {value!r}")
+
+    policy = dict(SHORTHANDS.get(value.get("mode", "full"), {}))
+    if "mode" in value and value["mode"] not in SHORTHANDS:
+        raise ValueError(f"未知的克隆策略: {value['mode']}")
+    if value.get("filter"):
+        if value["filter"] not in FILTERS:
+            raise ValueError(f"不支持的過濾器: {value['filter']}")
+        policy["filter"] = value["filter"]
+    if value.get("depth") is not None:
+        depth = value["depth"]
+        if not isinstance(depth, int) or isinstance(depth, bool) or depth < 1:
+            raise ValueError(f"無效的深度: {depth!r}")
+        policy["depth"] = depth
+    if value.get("sparse"):
+        sparse = value["sparse"]
+        if isinstance(sparse, str):
+            sparse = [sparse]
+        if not isinstance(sparse, list) or not all(isinstance(path, str) and path.strip("/") for path in sparse):
+            raise ValueError(f"無效的稀疏檢出路徑: {sparse!r}")
+        policy["sparse"] = sorted({path.strip("/") for path in sparse})
+    return policy
+
+
+def describe(policy: Dict) -> str:
+    """日誌中使用的簡短描述"""
+    if not policy:
+        return "full"
+    parts = []
+    if policy.get("filter"):
+        parts.append(f"filter={policy['filter']}")
+    if policy.get("depth"):
+        parts.append(f"depth={policy['depth']}")
+    if policy.get("sparse"):
+        parts.append(f"sparse={','.join(policy['sparse'])}")
+    return " ".join(parts)
+
+
+def load_policies(policy_file: str = DEFAULT_POLICY_FILE) -> Dict[str, Dict]:
+    """讀取按倉庫名配置的策略，無效條目忽略"""
+    try:
+        with open(os.path.expanduser(policy_file), "r", encoding="utf-8") as f:
+            raw = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.warning(f"讀取克隆策略失敗: {e}")
+        return {}
+
+    policies = {}
+    for name, value in raw.items():
+        try:
+            policies[name] = parse_policy(value)
+        except ValueError as e:
+            logger.warning(f"忽略倉庫 {name} 的克隆策略: {e}")
+    return policies
+
+
+class PolicyFile:
+    """按倉庫名配置的策略，文件修改後在下次查詢時重新讀取（供常駐的同步代理使用）"""
+
+    def __init__(self, policy_file: str = DEFAULT_POLICY_FILE):
+        self.policy_file = os.path.expanduser(policy_file)
+        self._signature = None
+        self.policies: Dict[str, Dict] = {}
+        self.reload_if_changed()
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.policy_file)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def reload_if_changed(self):
+        signature = self._file_signature()
+        if signature != self._signature:
+            self._signature = signature
+            self.policies = load_policies(self.policy_file)
+
+    def get(self, name: str, default: Optional[Dict] = None) -> Optional[Dict]:
+        self.reload_if_changed()
+        return self.policies.get(name, default)
+
+
+def clone_args(policy: Dict) -> List[str]:
+    """git clone 的額外參數"""
+    args = []
+    if policy.get("filter"):
+        args.append(f"--filter={policy['filter']}")
+    if policy.get("depth"):
+        # --depth 默認只克隆默認分支，與pull默認分支的更新方式一致
+        args += ["--depth", str(policy["depth"])]
+    if policy.get("sparse"):
+        args.append("--sparse")
+    return args
+
+
+def is_partial(repo_path: Union[str, Path]) -> bool:
+    """倉庫是否是淺克隆或部分克隆（缺少部分對象，不能作為其他倉庫的對象來源）"""
+    git_dir = Path(repo_path) / ".git"
+    if (git_dir / "shallow").exists():
+        return True
+    result = subprocess.run(["git", "-C", str(repo_path), "config", "--get", "remote.origin.promisor"],
+                            capture_output=True, text=True)
+    return result.stdout.strip() == "true"
+
+
+def applied_policy(repo_path: Union[str, Path]) -> Optional[Dict]:
+    """克隆時記錄的策略，沒有記錄（舊倉庫）時返回None"""
+    result = subprocess.run(["git", "-C", str(repo_path), "config", "--get", CONFIG_KEY],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    try:
+        return json.loads(result.stdout)
+    except ValueError:
+        return None
+
+
+def _record(repo_path: Union[str, Path], policy: Dict):
+    subprocess.run(["git", "-C", str(repo_path), "config", CONFIG_KEY, json.dumps(policy, sort_keys=True)],
+                   capture_output=True, text=True)
+
+
+def _set_sparse(repo_path: Union[str, Path], paths: List[str], timeout: float) -> subprocess.CompletedProcess:
+    if paths:
+        return subprocess.run(["git", "-C", str(repo_path), "sparse-checkout", "set", "--", *paths],
+                              capture_output=True, text=True, timeout=timeout)
+    return subprocess.run(["git", "-C", str(repo_path), "sparse-checkout", "disable"],
+                          capture_output=True, text=True, timeout=timeout)
+
+
+def finish_clone(repo_path: Union[str, Path], policy: Dict, timeout: float = 300) -> subprocess.CompletedProcess:
+    """克隆後設置稀疏檢出路徑並記錄策略"""
+    result = subprocess.CompletedProcess([], 0, "", "")
+    if policy.get("sparse"):
+        result = _set_sparse(repo_path, policy["sparse"], timeout)
+        if result.returncode != 0:
+            return result
+    _record(repo_path, policy)
+    return result
+
+
+def needs_reclone(repo_path: Union[str, Path], policy: Dict) -> bool:
+    """過濾器或深度與克隆時的策略不同，只能重新克隆才能生效"""
+    current = applied_policy(repo_path) or {}
+    return current.get("filter") != policy.get("filter") or current.get("depth") != policy.get("depth")
+
+
+def _reclone_paths(repo_path: Path) -> Tuple[Path, Path]:
+    return (repo_path.with_name(f".{repo_path.name}{STAGING_SUFFIX}"),
+            repo_path.with_name(f".{repo_path.name}{RETIRED_SUFFIX}"))
+
+
+def reclone(repo_path: Union[str, Path], url: str, policy: Dict, extra_args: Sequence[str] = (),
+            timeout: float = 300) -> subprocess.CompletedProcess:
+    """按新策略克隆到臨時目錄，成功後替換現有倉庫；失敗時現有倉庫保持不變"""
+    repo_path = Path(repo_path)
+    staging, retired = _reclone_paths(repo_path)
+    shutil.rmtree(staging, ignore_errors=True)
+    result = subprocess.run(["git", "clone", *extra_args, *clone_args(policy), url, str(staging)],
+                            capture_output=True, text=True, timeout=timeout)
+    if result.returncode == 0:
+        result = finish_clone(staging, policy, timeout=timeout)
+    if result.returncode != 0:
+        shutil.rmtree(staging, ignore_errors=True)
+        return result
+
+    shutil.rmtree(retired, ignore_errors=True)
+    os.rename(repo_path, retired)
+    os.rename(staging, repo_path)
+    shutil.rmtree(retired, ignore_errors=True)
+    return result
+
+
+def recover_reclone(repo_path: Union[str, Path]):
+    """清理被中斷的重新克隆；中斷在兩次改名之間時把舊倉庫移回原處"""
+    repo_path = Path(repo_path)
+    staging, retired = _reclone_paths(repo_path)
+    if retired.exists() and not repo_path.exists():
+        os.rename(retired, repo_path)
+    shutil.rmtree(staging, ignore_errors=True)
+    shutil.rmtree(retired, ignore_errors=True)
+
+
+def reconcile(repo_path: Union[str, Path], policy: Dict, timeout: float = 300) -> bool:
+    """更新前讓現有倉庫符合策略中可以原地調整的部分（稀疏路徑）
+
+    過濾器和深度不同時調用方應先用 reclone() 重新克隆；這裡只記錄實際生效的部分。
+    """
+    current = applied_policy(repo_path)
+    if current == policy:
+        return True
+    current = current or {}
+    if current.get("sparse") != policy.get("sparse"):
+        result = _set_sparse(repo_path, policy.get("sparse", []), timeout)
+        if result.returncode != 0:
+            logger.warning(f"⚠️ 設置稀疏檢出失敗 {repo_path}: {result.stderr.strip()}")
+            return False
+    if current.get("filter") != policy.get("filter") or current.get("depth") != policy.get("depth"):
+        policy = {**policy, "filter": current.get("filter"), "depth": current.get("depth")}
+        policy = {key: value for key, value in policy.items() if value}
+    _record(repo_path, policy)
+    return True
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Shared Git Object Store (EC2端)
+多個倉庫（以及它們的快照）共用的對象庫，fork之間相同的歷史只保存一份
+
+- 共用對象庫是一個bare倉庫，依賴它的倉庫在 .git/objects/info/alternates 中指向它
+- 克隆時使用 `--reference-if-able`，已有的對象不再下載
+- 同步後把倉庫的引用抓取到 refs/deps/repos/<倉庫>/ 下（快照在 refs/deps/backups/<快照ID>/），
+  之後克隆的fork可以直接復用
+- 回收時先為所有依賴者（Git目錄中的倉庫和備份目錄中的快照）刷新引用，
+  刪除已消失依賴者的引用，再對共用庫執行gc；依賴者仍可達的對象都有引用保護
+- 同步持有共享鎖，回收持有排他鎖，兩者不會同時進行
+"""
+
+import os
+import fcntl
+import logging
+import subprocess
+import contextlib
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+REF_NAMESPACE = "refs/deps"
+GIT_ENV = {**os.environ, "GIT_TERMINAL_PROMPT": "0"}
+
+
+def _git(*args, timeout: float = 600) -> subprocess.CompletedProcess:
+    return subprocess.run(["git", *args], capture_output=True, text=True, timeout=timeout, env=GIT_ENV)
+
+
+def directory_size(path: Path) -> int:
+    """目錄下所有文件的字節數，硬鏈接的文件只計算一次"""
+    total = 0
+    seen = set()
+    for root, _, files in os.walk(path):
+        for file in files:
+            try:
+                stat = os.lstat(os.path.join(root, file))
+            except OSError:
+                continue
+            if stat.st_nlink > 1:
+                if (stat.st_dev, stat.st_ino) in seen:
+                    continue
+                seen.add((stat.st_dev, stat.st_ino))
+            total += stat.st_size
+    return total
+
+
+class SharedObjectStore:
+    def __init__(self, path: Path, prune_expire: str = "2.weeks.ago"):
+        self.path = Path(path)
+        self.objects_dir = self.path / "objects"
+        self.prune_expire = prune_expire
+        self.lock_file = self.path / "shared.lock"
+
+    def ensure(self):
+        """初始化bare倉庫，關閉自動gc以免在引用刷新前刪除對象"""
+        if (self.path / "HEAD").exists():
+            return
+        self.path.mkdir(parents=True, exist_ok=True)
+        result = _git("init", "--bare", "-q", str(self.path))
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip())
+        _git("-C", str(self.path), "config", "gc.auto", "0")
+        logger.info(f"📦 已創建共用對象庫: {self.path}")
+
+    @contextlib.contextmanager
+    def _locked(self, mode: int) -> Iterator[None]:
+        self.ensure()
+        with open(self.lock_file, "a") as f:
+            fcntl.flock(f, mode)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def using(self):
+        """克隆或更新依賴者時持有的共享鎖"""
+        return self._locked(fcntl.LOCK_SH)
+
+    @staticmethod
+    def _git_dir(path: Path) -> Path:
+        """普通倉庫返回其 .git，硬鏈接快照只有 .git 目錄"""
+        path = Path(path)
+        return path / ".git" if (path / ".git").is_dir() else path
+
+    def is_attached(self, path: Path) -> bool:
+        """倉庫是否使用本對象庫作為alternates"""
+        alternates = self._git_dir(path) / "objects" / "info" / "alternates"
+        try:
+            lines = alternates.read_text(encoding="utf-8").splitlines()
+        except OSError:
+            return False
+        target = os.path.realpath(self.objects_dir)
+        return any(os.path.realpath(line.strip()) == target for line in lines if line.strip())
+
+    def clone_args(self) -> List[str]:
+        """git clone 的額外參數"""
+        self.ensure()
+        return ["--reference-if-able", str(self.path)]
+
+    def register(self, path: Path, key: str, timeout: float = 600) -> bool:
+        """把依賴者的引用抓取到 refs/deps/<key>/，使其對象受回收保護並可供其他倉庫復用
+
+        key 形如 repos/<倉庫名> 或 backups/<快照ID>
+        """
+        result = _git("-C", str(self.path), "fetch", "--quiet", "--no-tags", "--prune",
+                      str(self._git_dir(path)), f"+refs/*:{REF_NAMESPACE}/{key}/*",
+                      f"+HEAD:{REF_NAMESPACE}/{key}/HEAD", timeout=timeout)
+        if result.returncode != 0:
+            logger.warning(f"⚠️ 登記 {key} 到共用對象庫失敗: {result.stderr.strip()}")
+            return False
+        return True
+
+    def attach(self, path: Path, key: str, timeout: float = 600) -> bool:
+        """讓已存在的倉庫改用共用對象庫，並刪除本地重複的對象"""
+        git_dir = self._git_dir(path)
+        if not self.register(path, key, timeout):
+            return False
+        if not self.is_attached(path):
+            alternates = git_dir / "objects" / "info" / "alternates"
+            alternates.parent.mkdir(parents=True, exist_ok=True)
+            with open(alternates, "a", encoding="utf-8") as f:
+                f.write(f"{self.objects_dir}\n")
+        return self.deduplicate(path, timeout)
+
+    def deduplicate(self, path: Path, timeout: float = 600) -> bool:
+        """重新打包依賴者，只保留共用庫中沒有的對象"""
+        git_dir = self._git_dir(path)
+        result = _git("--git-dir", str(git_dir), "repack", "-a", "-d", "-l", "-q", timeout=timeout)
+        if result.returncode != 0:
+            logger.warning(f"⚠️ 重新打包 {path} 失敗: {result.stderr.strip()}")
+            return False
+        _git("--git-dir", str(git_dir), "prune-packed", timeout=timeout)
+        return True
+
+    def registered_keys(self) -> List[str]:
+        result = _git("-C", str(self.path), "for-each-ref", "--format=%(refname)", f"{REF_NAMESPACE}/")
+        prefix = f"{REF_NAMESPACE}/"
+        return sorted({"/".join(line[len(prefix):].split("/", 2)[:2])
+                       for line in result.stdout.splitlines() if line.startswith(prefix)})
+
+    def forget(self, key: str):
+        """刪除已消失依賴者的引用"""
+        result = _git("-C", str(self.path), "for-each-ref", "--format=delete %(refname)",
+                      f"{REF_NAMESPACE}/{key}/")
+        if result.stdout:
+            subprocess.run(["git", "-C", str(self.path), "update-ref", "--stdin"],
+                           input=result.stdout, capture_output=True, text=True)
+
+    def gc(self, dependents: Dict[str, Path], deduplicate: bool = True) -> Dict:
+        """回收共用庫中不再被任何依賴者引用的對象
+
+        dependents 必須包含所有指向本對象庫的倉庫和快照；刷新引用失敗時中止，
+        不會在引用不完整的情況下刪除對象。
+        """
+        with self._locked(fcntl.LOCK_EX):
+            size_before = directory_size(self.objects_dir)
+            failed = [key for key, path in dependents.items() if not self.register(path, key)]
+            if failed:
+                raise RuntimeError(f"無法刷新依賴者的引用，已中止回收: {', '.join(failed)}")
+
+            forgotten = [key for key in self.registered_keys() if key not in dependents]
+            for key in forgotten:
+                self.forget(key)
+
+            result = _git("-C", str(self.path), "gc", "--quiet", f"--prune={self.prune_expire}", timeout=3600)
+            if result.returncode != 0:
+                raise RuntimeError(result.stderr.strip())
+
+            if deduplicate:
+                for path in dependents.values():
+                    self.deduplicate(path)
+
+            return {
+                "dependents": len(dependents),
+                "forgotten": forgotten,
+                "bytes_before": size_before,
+                "bytes_after": directory_size(self.objects_dir)
+            }
+
+    def usage(self, dependents: Dict[str, Path]) -> Tuple[int, int]:
+        """返回 (共用庫字節數, 依賴者本地對象字節數之和)"""
+        local = sum(directory_size(self._git_dir(path) / "objects") for path in dependents.values())
+        return directory_size(self.objects_dir), local
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Repository Snapshot Store (EC2端)
+更新倉庫前的低成本快照，取代每次 `cp -r` 整個倉庫
+
+後端：
+- hardlink：Git對象（.git/objects下的pack和loose對象）內容不可變，直接硬鏈接；
+  其他元數據（refs、HEAD、config、index等）複製。工作區可以由HEAD重建，不保存。
+- reflink：`cp --reflink=always` 整個倉庫，只在支持寫時複製的文件系統
+  (btrfs、XFS等) 上可用，不支持時回退到hardlink
+- copy：原來的 `cp -r`，保留用於對比
+
+每個快照是 backup_directory/<倉庫>_<時間戳>/ 目錄，其中的 snapshot.json 記錄
+後端、HEAD和創建時間；傳入備份索引時同時登記到索引，供保留策略使用。
+"""
+
+import os
+import json
+import time
+import shutil
+import logging
+import tempfile
+import subprocess
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("hardlink", "reflink", "copy")
+METADATA_FILE = "snapshot.json"
+
+
+def _is_immutable(relative_path: str) -> bool:
+    """.git/objects 下除 info/ 之外的文件內容不會被修改"""
+    parts = Path(relative_path).parts
+    return len(parts) >= 2 and parts[0] == "objects" and parts[1] != "info"
+
+
+def _record(stats: Dict, relative_path: str, stat: os.stat_result, linked: bool):
+    """登記一個文件：pack目錄下的硬鏈接記錄inode，供備份索引統計只被快照持有的字節"""
+    if not linked:
+        stats["copied"] += 1
+        stats["bytes_copied"] += stat.st_size
+        return
+    stats["linked"] += 1
+    parts = Path(relative_path).parts
+    if parts[:2] == ("objects", "pack"):
+        stats["packs"][parts[-1]] = [stat.st_ino, stat.st_size]
+    else:
+        stats["loose_bytes"] += stat.st_size
+
+
+def _new_stats() -> Dict:
+    return {"linked": 0, "copied": 0, "bytes_copied": 0, "loose_bytes": 0, "packs": {}}
+
+
+def link_tree(source: Path, target: Path) -> Dict:
+    """硬鏈接不可變的Git對象，複製其他文件，返回統計（含每個pack文件的inode和大小）"""
+    stats = _new_stats()
+    for root, _, files in os.walk(source):
+        relative_root = os.path.relpath(root, source)
+        target_root = target / relative_root
+        target_root.mkdir(parents=True, exist_ok=True)
+        for file in files:
+            source_file = os.path.join(root, file)
+            target_file = target_root / file
+            relative_path = os.path.join(relative_root, file)
+            linked = False
+            if _is_immutable(relative_path):
+                try:
+                    os.link(source_file, target_file)
+                    linked = True
+                except OSError:
+                    # 跨文件系統等情況無法硬鏈接，退回複製
+                    pass
+            if not linked:
+                shutil.copy2(source_file, target_file, follow_symlinks=False)
+            _record(stats, relative_path, os.lstat(target_file), linked)
+    return stats
+
+
+def link_stats(git_dir: Path) -> Dict:
+    """按 link_tree 的規則統計已有的硬鏈接快照，用於重建索引"""
+    stats = _new_stats()
+    for root, _, files in os.walk(git_dir):
+        relative_root = os.path.relpath(root, git_dir)
+        for file in files:
+            relative_path = os.path.join(relative_root, file)
+            try:
+                stat = os.lstat(os.path.join(root, file))
+            except OSError:
+                continue
+            _record(stats, relative_path, stat, _is_immutable(relative_path))
+    return stats
+
+
+class SnapshotStore:
+    def __init__(self, backup_dir: Path, backend: str = "hardlink", index=None):
+        if backend not in BACKENDS:
+            raise ValueError(f"未知的備份後端: {backend}")
+        self.backup_dir = Path(backup_dir)
+        self.backend = backend
+        self.index = index
+
+    def _new_snapshot_path(self, repo_name: str) -> Path:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        path = self.backup_dir / f"{repo_name}_{timestamp}"
+        suffix = 1
+        while path.exists():
+            path = self.backup_dir / f"{repo_name}_{timestamp}_{suffix}"
+            suffix += 1
+        return path
+
+    @staticmethod
+    def _head(repo_path: Path) -> Optional[str]:
+        result = subprocess.run(["git", "-C", str(repo_path), "rev-parse", "HEAD"], capture_output=True, text=True)
+        return result.stdout.strip() if result.returncode == 0 else None
+
+    def snapshot(self, repo_path: Path, repo_name: str, backend: Optional[str] = None) -> Dict:
+        """為倉庫創建快照，返回快照信息"""
+        backend = backend or self.backend
+        snapshot_path = self._new_snapshot_path(repo_name)
+        started = time.monotonic()
+        stats: Dict = {}
+
+        if backend == "reflink":
+            result = subprocess.run(["cp", "-a", "--reflink=always", str(repo_path), str(snapshot_path)],
+                                    capture_output=True, text=True)
+            if result.returncode != 0:
+                logger.debug(f"文件系統不支持reflink，改用hardlink: {result.stderr.strip()}")
+                shutil.rmtree(snapshot_path, ignore_errors=True)
+                backend = "hardlink"
+
+        if backend == "copy":
+            result = subprocess.run(["cp", "-r", str(repo_path), str(snapshot_path)], capture_output=True, text=True)
+            if result.returncode != 0:
+                shutil.rmtree(snapshot_path, ignore_errors=True)
+                raise RuntimeError(result.stderr.strip())
+        elif backend == "hardlink":
+            try:
+                stats = link_tree(repo_path / ".git", snapshot_path / ".git")
+            except Exception:
+                shutil.rmtree(snapshot_path, ignore_errors=True)
+                raise
+
+        info = {
+            "id": snapshot_path.name,
+            "repository": repo_name,
+            "backend": backend,
+            "head": self._head(repo_path),
+            "worktree": backend != "hardlink",
+            "created": datetime.now().isoformat(),
+            "duration": round(time.monotonic() - started, 3),
+            **stats
+        }
+        with open(snapshot_path / METADATA_FILE, "w", encoding="utf-8") as f:
+            json.dump(info, f, indent=2, ensure_ascii=False)
+        info["path"] = str(snapshot_path)
+        if self.index is not None:
+            self.index.add(info)
+        return info
+
+    def discard(self, snapshot_id: str):
+        """刪除快照"""
+        shutil.rmtree(self.backup_dir / snapshot_id, ignore_errors=True)
+        if self.index is not None:
+            self.index.remove([snapshot_id])
+
+    def list_snapshots(self, repo_name: str) -> List[Dict]:
+        """列出倉庫的快照，最新的在前；舊版 cp -r 備份沒有元數據文件"""
+        snapshots = []
+        if not self.backup_dir.exists():
+            return snapshots
+        for path in self.backup_dir.iterdir():
+            if not path.is_dir() or not path.name.startswith(f"{repo_name}_"):
+                continue
+            # 排除名稱以此倉庫名為前綴的其他倉庫
+            if not path.name[len(repo_name) + 1:][:8].isdigit():
+                continue
+            try:
+                with open(path / METADATA_FILE, "r", encoding="utf-8") as f:
+                    info = json.load(f)
+            except (OSError, ValueError):
+                info = {"id": path.name, "repository": repo_name, "backend": "copy", "worktree": True,
+                        "head": None, "created": datetime.fromtimestamp(path.stat().st_mtime).isoformat()}
+            info["path"] = str(path)
+            snapshots.append(info)
+        return sorted(snapshots, key=lambda info: info["id"], reverse=True)
+
+    def restore(self, repo_name: str, target: Path, snapshot_id: Optional[str] = None) -> Dict:
+        """用快照替換倉庫，未指定快照時使用最新的一個"""
+        snapshots = self.list_snapshots(repo_name)
+        if snapshot_id:
+            snapshots = [info for info in snapshots if info["id"] == snapshot_id]
+        if not snapshots:
+            raise FileNotFoundError(f"沒有找到倉庫 {repo_name} 的快照 {snapshot_id or ''}".strip())
+        info = snapshots[0]
+        snapshot_path = Path(info["path"])
+
+        # 先在同目錄下組裝完整的倉庫，再原子地替換
+        target = Path(target)
+        staging = Path(tempfile.mkdtemp(prefix=f".restore_{repo_name}_", dir=target.parent))
+        try:
+            restored = staging / repo_name
+            if info.get("worktree"):
+                result = subprocess.run(["cp", "-a", "--reflink=auto", str(snapshot_path), str(restored)],
+                                        capture_output=True, text=True)
+                if result.returncode != 0:
+                    raise RuntimeError(result.stderr.strip())
+                (restored / METADATA_FILE).unlink(missing_ok=True)
+            else:
+                link_tree(snapshot_path / ".git", restored / ".git")
+                result = subprocess.run(["git", "-C", str(restored), "reset", "--hard", "-q", "HEAD"],
+                                        capture_output=True, text=True)
+                if result.returncode != 0:
+                    raise RuntimeError(result.stderr.strip())
+
+            replaced = staging / f"{repo_name}.replaced"
+            if target.exists():
+                os.rename(target, replaced)
+            try:
+                os.rename(restored, target)
+            except OSError:
+                # 放回原倉庫，避免隨臨時目錄一起被刪除
+                if replaced.exists():
+                    os.rename(replaced, target)
+                raise
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        logger.info(f"♻️ 倉庫 {repo_name} 已恢復到快照 {info['id']}")
+        return info
+
+
+def disk_free(path: Path) -> int:
+    stat = os.statvfs(path)
+    return stat.f_bfree * stat.f_frsize
+
+
+def benchmark(repo_path: Path, backends=BACKENDS, rounds: int = 3) -> List[Dict]:
+    """比較各後端創建快照的耗時和實際佔用的磁盤空間"""
+    repo_path = Path(repo_path)
+    results = []
+    with tempfile.TemporaryDirectory(prefix="snapshot_bench_", dir=repo_path.parent) as bench_dir:
+        for backend in backends:
+            store = SnapshotStore(Path(bench_dir) / backend, backend)
+            store.backup_dir.mkdir(parents=True)
+            durations = []
+            consumed = []
+            actual_backend = backend
+            for _ in range(rounds):
+                os.sync()
+                free_before = disk_free(store.backup_dir)
+                started = time.monotonic()
+                info = store.snapshot(repo_path, repo_path.name)
+                os.sync()
+                durations.append(time.monotonic() - started)
+                consumed.append(max(0, free_before - disk_free(store.backup_dir)))
+                actual_backend = info["backend"]
+            results.append({
+                "backend": backend if actual_backend == backend else f"{backend}->{actual_backend}",
+                "duration": round(sorted(durations)[len(durations) // 2], 4),
+                "bytes_written": sorted(consumed)[len(consumed) // 2]
+            })
+    return results
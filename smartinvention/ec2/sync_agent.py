@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+"""
+Trae Sync Agent (EC2端)
+常駐的Git倉庫同步代理，通過Unix socket接收JSON-RPC請求
+
+代理進程只初始化一次 GitRepositorySync，在請求之間保留分支緩存、克隆策略和歷史數據庫連接，
+Mac端觸發同步不再需要每次冷啟動 sync_repositories.py。
+SSH端使用 --forward 把標準輸入輸出轉發到本機socket，代理未運行時可自動啟動。
+
+協議：每行一個JSON-RPC 2.0請求，每行一個響應
+方法：ping / status / sync / cleanup / gc_shared / shutdown
+sync執行期間以 sync.event 通知逐個推送倉庫的開始和結果事件，最後返回匯總響應
+
+用法：
+  python3 sync_agent.py --serve                 # 前台運行代理
+  python3 sync_agent.py --forward [--spawn]     # 標準輸入輸出 <-> 代理socket
+  python3 sync_agent.py --call status           # 本機調用一個方法
+"""
+
+import os
+import sys
+import json
+import time
+import errno
+import select
+import socket
+import argparse
+import threading
+import subprocess
+from typing import Callable, Dict, Optional
+
+DEFAULT_SOCKET = "/tmp/trae_sync_agent.sock"
+
+# JSON-RPC 錯誤碼
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
+
+class RPCError(Exception):
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+class SyncAgent:
+    """常駐的同步代理，持有預熱的 GitRepositorySync"""
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET):
+        # 只在代理模式下導入，轉發器保持輕量且不寫同步日誌
+        import sync_repositories
+
+        sync_repositories.setup_logging()
+        self.logger = sync_repositories.logger
+        self.socket_path = socket_path
+        self.sync_tool = sync_repositories.GitRepositorySync()
+        self.started_at = time.time()
+        self.request_count = 0
+        self.last_sync: Optional[Dict] = None
+        self.server: Optional[socket.socket] = None
+        self._sync_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self.methods = {
+            "ping": self.rpc_ping,
+            "status": self.rpc_status,
+            "sync": self.rpc_sync,
+            "cleanup": self.rpc_cleanup,
+            "gc_shared": self.rpc_gc_shared,
+            "shutdown": self.rpc_shutdown
+        }
+
+    def rpc_ping(self, params: Dict, notify: Callable) -> Dict:
+        return {"pong": True, "pid": os.getpid()}
+
+    def rpc_status(self, params: Dict, notify: Callable) -> Dict:
+        # HEAD每次都從倉庫讀取，trae-sync或命令行同步修改倉庫後也不會返回過期的值
+        repositories = self.sync_tool.list_repositories()
+        return {
+            "pid": os.getpid(),
+            "uptime": round(time.time() - self.started_at, 3),
+            "requests": self.request_count,
+            "syncing": self._sync_lock.locked(),
+            "git_directory": str(self.sync_tool.git_dir),
+            "backup_directory": str(self.sync_tool.backup_dir),
+            "last_sync": self.last_sync,
+            "repositories": [{"name": name, "head": self.sync_tool.get_head(name)} for name in repositories]
+        }
+
+    def rpc_sync(self, params: Dict, notify: Callable) -> Dict:
+        repositories = params.get("repositories")
+        resume = bool(params.get("resume"))
+        # 續傳時可以不指定倉庫列表，使用被中斷同步的列表
+        if resume and repositories is None:
+            repositories = []
+        elif not isinstance(repositories, list) or not repositories:
+            raise RPCError(INVALID_PARAMS, "倉庫列表為空")
+        for repo in repositories:
+            if not isinstance(repo, dict) or not repo.get("name") or not repo.get("github_url"):
+                raise RPCError(INVALID_PARAMS, f"無效的倉庫記錄: {repo}")
+        max_workers = params.get("max_workers")
+        if max_workers is not None and (not isinstance(max_workers, int) or max_workers < 1):
+            raise RPCError(INVALID_PARAMS, f"無效的並發數: {max_workers}")
+
+        def on_event(event: Dict):
+            notify("sync.event", event)
+        
+        # 同一時間只執行一個同步任務，後到的請求排隊等待
+        with self._sync_lock:
+            results = self.sync_tool.sync_repositories(repositories, on_event=on_event, max_workers=max_workers,
+                                                       force=bool(params.get("force")), resume=resume)
+            report_file = self.sync_tool.generate_report(results, params.get("source") or {})
+            if params.get("cleanup", True):
+                self.sync_tool.cleanup_old_backups()
+
+            heads = {detail["name"]: detail.get("head") for detail in results["details"]}
+            self.last_sync = {
+                "time": time.time(),
+                "total": results["total"],
+                "success": results["success"],
+                "failed": results["failed"],
+                "unchanged": results["unchanged"],
+                "report": report_file
+            }
+        return {**results, "report": report_file, "heads": heads}
+
+    def rpc_cleanup(self, params: Dict, notify: Callable) -> Dict:
+        days = params.get("days")
+        if days is not None and (not isinstance(days, int) or days < 0):
+            raise RPCError(INVALID_PARAMS, f"無效的天數: {days}")
+        with self._sync_lock:
+            summary = self.sync_tool.cleanup_old_backups(days, dry_run=bool(params.get("dry_run")))
+        return {"cleaned": True, "days": days, **summary}
+
+    def rpc_gc_shared(self, params: Dict, notify: Callable) -> Dict:
+        with self._sync_lock:
+            return self.sync_tool.gc_shared_objects()
+
+    def rpc_shutdown(self, params: Dict, notify: Callable) -> Dict:
+        self._stopping.set()
+        # 連接一次以喚醒accept循環
+        sock = connect(self.socket_path)
+        if sock is not None:
+            sock.close()
+        return {"stopping": True}
+
+    def dispatch(self, request, notify: Callable) -> Optional[Dict]:
+        """處理單個請求，通知（無id）不返回響應"""
+        request_id = request.get("id") if isinstance(request, dict) else None
+        try:
+            if not isinstance(request, dict) or not isinstance(request.get("method"), str):
+                raise RPCError(INVALID_REQUEST, "無效的請求")
+            method = self.methods.get(request["method"])
+            if method is None:
+                raise RPCError(METHOD_NOT_FOUND, f"未知方法: {request['method']}")
+            params = request.get("params") or {}
+            if not isinstance(params, dict):
+                raise RPCError(INVALID_PARAMS, "params必須是對象")
+
+            self.request_count += 1
+            result = method(params, notify)
+            response = {"jsonrpc": "2.0", "id": request_id, "result": result}
+        except RPCError as e:
+            response = {"jsonrpc": "2.0", "id": request_id, "error": {"code": e.code, "message": e.message}}
+        except Exception as e:
+            self.logger.error(f"❌ 處理請求時出錯: {e}")
+            response = {"jsonrpc": "2.0", "id": request_id, "error": {"code": INTERNAL_ERROR, "message": str(e)}}
+
+        if isinstance(request, dict) and "id" not in request:
+            return None
+        return response
+
+    def handle_line(self, line: bytes, notify: Callable):
+        """解析一行請求，支持批量請求"""
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            return {"jsonrpc": "2.0", "id": None, "error": {"code": PARSE_ERROR, "message": str(e)}}
+        if isinstance(request, list):
+            responses = [response for response in (self.dispatch(item, notify) for item in request)
+                         if response is not None]
+            return responses or None
+        return self.dispatch(request, notify)
+
+    def handle_connection(self, conn: socket.socket):
+        """一個連接上可以順序發送多個請求"""
+        send_lock = threading.Lock()
+        
+        def send(message):
+            with send_lock:
+                conn.sendall((json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8"))
+        
+        def notify(method: str, params: Dict):
+            # 客戶端斷開（例如Mac端超時）不影響正在進行的同步
+            try:
+                send({"jsonrpc": "2.0", "method": method, "params": params})
+            except OSError:
+                pass
+        
+        try:
+            with conn, conn.makefile("rb") as reader:
+                for line in reader:
+                    if not line.strip():
+                        continue
+                    response = self.handle_line(line, notify)
+                    if response is not None:
+                        send(response)
+                    if self._stopping.is_set():
+                        break
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        except Exception as e:
+            self.logger.error(f"❌ 連接處理出錯: {e}")
+
+    def bind(self):
+        """綁定socket，清理上次異常退出留下的socket文件"""
+        if os.path.exists(self.socket_path):
+            sock = connect(self.socket_path)
+            if sock is not None:
+                sock.close()
+                raise RuntimeError(f"代理已在運行: {self.socket_path}")
+            os.remove(self.socket_path)
+
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o177)
+        try:
+            self.server.bind(self.socket_path)
+        finally:
+            os.umask(old_umask)
+        self.server.listen(16)
+
+    def recover(self):
+        with self._sync_lock:
+            try:
+                self.sync_tool.recover()
+            except Exception as e:
+                self.logger.error(f"❌ 恢復中斷的同步時出錯: {e}")
+
+    def serve_forever(self):
+        """接受連接直到收到shutdown請求"""
+        self.bind()
+        self.logger.info(f"🛰️ 同步代理已啟動: {self.socket_path} (pid {os.getpid()})")
+        # 上一次同步被中斷時在後台恢復未完成的倉庫，期間的同步請求排隊等待
+        threading.Thread(target=self.recover, daemon=True).start()
+        try:
+            while not self._stopping.is_set():
+                try:
+                    conn, _ = self.server.accept()
+                except OSError:
+                    if self._stopping.is_set():
+                        break
+                    raise
+                threading.Thread(target=self.handle_connection, args=(conn,), daemon=True).start()
+        finally:
+            self.server.close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            self.sync_tool.history.close()
+            self.logger.info("🛑 同步代理已停止")
+
+
+def connect(socket_path: str) -> Optional[socket.socket]:
+    """連接代理，代理未運行時返回None"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        return sock
+    except OSError:
+        sock.close()
+        return None
+
+
+def spawn_agent(socket_path: str, wait: float = 10) -> Optional[socket.socket]:
+    """在後台啟動代理並等待其開始監聽"""
+    subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve", "--socket", socket_path],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        start_new_session=True
+    )
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        sock = connect(socket_path)
+        if sock is not None:
+            return sock
+        time.sleep(0.05)
+    return None
+
+
+def forward(socket_path: str, spawn: bool = False) -> int:
+    """在標準輸入輸出和代理socket之間雙向轉發"""
+    sock = connect(socket_path)
+    if sock is None and spawn:
+        sock = spawn_agent(socket_path)
+    if sock is None:
+        print(f"❌ 無法連接同步代理: {socket_path}", file=sys.stderr)
+        return 1
+
+    stdin_fd = sys.stdin.fileno()
+    stdout_fd = sys.stdout.fileno()
+    inputs = [stdin_fd, sock]
+    with sock:
+        while True:
+            readable, _, _ = select.select(inputs, [], [])
+            if stdin_fd in readable:
+                data = os.read(stdin_fd, 65536)
+                if data:
+                    sock.sendall(data)
+                else:
+                    # 客戶端結束輸入，代理處理完已收到的請求後關閉連接
+                    sock.shutdown(socket.SHUT_WR)
+                    inputs.remove(stdin_fd)
+            if sock in readable:
+                data = sock.recv(65536)
+                if not data:
+                    return 0
+                view = memoryview(data)
+                while view:
+                    try:
+                        written = os.write(stdout_fd, view)
+                    except OSError as e:
+                        if e.errno == errno.EPIPE:
+                            return 0
+                        raise
+                    view = view[written:]
+
+
+def call(socket_path: str, method: str, params: Optional[Dict] = None, spawn: bool = False,
+         on_notification: Optional[Callable[[Dict], None]] = None):
+    """調用代理的一個方法並返回響應，響應之前收到的通知交給on_notification"""
+    sock = connect(socket_path)
+    if sock is None and spawn:
+        sock = spawn_agent(socket_path)
+    if sock is None:
+        raise ConnectionError(f"無法連接同步代理: {socket_path}")
+    with sock, sock.makefile("rb") as reader:
+        request = {"jsonrpc": "2.0", "id": 1, "method": method, "params": params or {}}
+        sock.sendall((json.dumps(request, ensure_ascii=False) + "\n").encode("utf-8"))
+        for line in reader:
+            message = json.loads(line)
+            if "id" in message:
+                return message
+            if on_notification is not None:
+                on_notification(message)
+    raise ConnectionError("同步代理關閉了連接")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Trae Sync Agent (EC2端)")
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--serve", action="store_true", help="運行常駐代理")
+    mode.add_argument("--forward", action="store_true", help="將標準輸入輸出轉發到代理 (供SSH調用)")
+    mode.add_argument("--call", metavar="METHOD", help="調用代理方法並輸出結果")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help=f"代理socket路徑 (默認: {DEFAULT_SOCKET})")
+    parser.add_argument("--spawn", action="store_true", help="代理未運行時自動在後台啟動")
+    parser.add_argument("--params", default="{}", help="--call 的參數 (JSON)")
+
+    args = parser.parse_args()
+
+    if args.serve:
+        try:
+            SyncAgent(args.socket).serve_forever()
+        except KeyboardInterrupt:
+            pass
+        except Exception as e:
+            print(f"❌ 同步代理啟動失敗: {e}", file=sys.stderr)
+            sys.exit(1)
+    elif args.forward:
+        sys.exit(forward(args.socket, spawn=args.spawn))
+    else:
+        try:
+            response = call(args.socket, args.call, json.loads(args.params), spawn=args.spawn,
+                            on_notification=lambda message: print(json.dumps(message, ensure_ascii=False),
+                                                                  file=sys.stderr))
+        except Exception as e:
+            print(f"❌ {e}", file=sys.stderr)
+            sys.exit(1)
+        print(json.dumps(response, indent=2, ensure_ascii=False))
+        sys.exit(1 if "error" in response else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+"""
+Sync Benchmark (EC2端)
+不連接GitHub的同步基準測試：生成本地bare倉庫代替GitHub，通過 file:// URL 運行
+sync_repositories.py 和 trae-sync (--all 的逐個同步)，比較三種情況：
+- cold：目標目錄為空，全部克隆
+- warm：每個遠程倉庫新增若干提交後同步
+- noop：遠程沒有變化時再同步一次
+
+- 合成倉庫由 git fast-import 生成，歷史大小、提交數和文件數可配置，
+  內容是隨機文本行（壓縮率與源碼相近），同一個種子生成的倉庫完全相同
+- 各階段耗時：
+    backup / copy：包裝 backup_repository / copy_source_files 計時
+    ls_remote / fetch / checkout：git trace2 事件 (GIT_TRACE2_EVENT)，
+    checkout 是 unpack_trees 區域的耗時，fetch 是 clone/pull 進程總耗時減去 checkout
+- 磁盤寫入：/proc/self/io 的 write_bytes（包含已結束的git子進程）和目標目錄大小的變化
+- 所有路徑都在臨時工作目錄中，CONFIG 在測試後恢復，不影響正式的倉庫和備份
+
+用法: python3 sync_benchmark.py --repos 10 --size-mb 20 --commits 50 [--engine both] [--json]
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import base64
+import shutil
+import logging
+import tempfile
+import argparse
+import threading
+import contextlib
+import subprocess
+import importlib.util
+import importlib.machinery
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import branch_cache
+import object_store
+from branch_cache import BranchCache
+from object_store import directory_size
+
+logger = logging.getLogger(__name__)
+
+CASES = ("cold", "warm", "noop")
+PHASES = ("backup", "ls_remote", "fetch", "checkout", "copy")
+BRANCH = "main"
+LINE_BYTES = 76
+
+
+def _random_text(rng: random.Random, size: int) -> bytes:
+    """約size字節的隨機文本行"""
+    text = base64.b64encode(rng.randbytes(size * 3 // 4 + 3))[:size]
+    return b"\n".join(text[start:start + LINE_BYTES] for start in range(0, len(text), LINE_BYTES))
+
+
+def _layout(size_bytes: int, commits: int, files: int) -> Tuple[int, int]:
+    """返回 (每個後續提交改寫的文件數, 每個文件的字節數)
+
+    第一個提交創建所有文件，之後每個提交改寫約10%的文件，歷史總大小約為size_bytes
+    """
+    per_commit = max(1, files // 10)
+    return per_commit, max(1, size_bytes // (files + (commits - 1) * per_commit))
+
+
+def _fast_import(path: Path, first_commit: int, commits: int, files: int, layout: Tuple[int, int], seed: str):
+    """用 git fast-import 在默認分支上寫入提交，first_commit 大於0時追加在現有歷史之後"""
+    per_commit, file_bytes = layout
+    rng = random.Random(f"{seed}:{first_commit}")
+    process = subprocess.Popen(["git", "-C", str(path), "fast-import", "--quiet"],
+                               stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        for index in range(first_commit, first_commit + commits):
+            touched = range(files) if index == 0 else sorted(rng.sample(range(files), per_commit))
+            message = f"commit {index}\n".encode()
+            process.stdin.write(
+                f"commit refs/heads/{BRANCH}\n"
+                f"committer Bench <bench@example.invalid> {1700000000 + index * 60} +0000\n"
+                f"data {len(message)}\n".encode() + message
+            )
+            if first_commit and index == first_commit:
+                process.stdin.write(f"from refs/heads/{BRANCH}^0\n".encode())
+            for number in touched:
+                content = _random_text(rng, file_bytes)
+                process.stdin.write(
+                    f"M 100644 inline src/pkg{number % 16:02d}/file_{number:04d}.txt\n"
+                    f"data {len(content)}\n".encode() + content + b"\n"
+                )
+            process.stdin.write(b"\n")
+        process.stdin.close()
+    except BrokenPipeError:
+        pass
+    if process.wait() != 0:
+        raise RuntimeError(f"fast-import 失敗 {path}: {process.stderr.read().decode(errors='replace').strip()}")
+    process.stderr.close()
+
+
+def generate_repository(path: Path, size_bytes: int, commits: int, files: int, seed: int = 0) -> Dict:
+    """生成合成bare倉庫，size_bytes是歷史中所有文件版本的總字節數（未壓縮）"""
+    path = Path(path)
+    result = subprocess.run(["git", "init", "--bare", "-q", "-b", BRANCH, str(path)], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip())
+    # 允許 blobless / treeless 克隆策略
+    subprocess.run(["git", "-C", str(path), "config", "uploadpack.allowFilter", "true"], capture_output=True)
+    commits, files = max(1, commits), max(1, files)
+    _fast_import(path, 0, commits, files, _layout(size_bytes, commits, files), str(seed))
+    return {"path": str(path), "commits": commits, "size": directory_size(path)}
+
+
+def append_commits(path: Path, count: int, size_bytes: int, commits: int, files: int, seed: int = 0):
+    """在遠程倉庫的默認分支上追加count個提交，模擬上游更新
+
+    size_bytes / commits / files 是生成倉庫時的參數，追加的提交改寫同樣大小的文件
+    """
+    existing = subprocess.run(["git", "-C", str(path), "rev-list", "--count", BRANCH],
+                              capture_output=True, text=True)
+    commits, files = max(1, commits), max(1, files)
+    _fast_import(Path(path), int(existing.stdout.strip() or 1), count, files, _layout(size_bytes, commits, files),
+                 str(seed))
+
+
+def _write_bytes() -> Optional[int]:
+    """本進程及已回收子進程寫入存儲的字節數，不支持時返回None"""
+    try:
+        with open("/proc/self/io", "r") as f:
+            for line in f:
+                if line.startswith("write_bytes:"):
+                    return int(line.split(":")[1])
+    except OSError:
+        pass
+    return None
+
+
+@contextlib.contextmanager
+def traced(trace_dir: Path):
+    """期間啟動的git進程把trace2事件寫入trace_dir（每個進程一個文件）"""
+    # branch_cache / object_store 在導入時複製了環境變量，一併設置
+    environments = [os.environ, branch_cache.GIT_ENV, object_store.GIT_ENV]
+    for environment in environments:
+        environment["GIT_TRACE2_EVENT"] = str(trace_dir)
+    try:
+        yield
+    finally:
+        for environment in environments:
+            environment.pop("GIT_TRACE2_EVENT", None)
+
+
+def parse_trace(trace_dir: Path) -> List[Dict]:
+    """按頂層git進程匯總trace2事件：命令、參數、總耗時和checkout耗時（包含子進程）"""
+    processes: Dict[str, Dict] = {}
+    for trace_file in Path(trace_dir).iterdir():
+        try:
+            content = trace_file.read_text(encoding="utf-8", errors="replace")
+        except OSError:
+            continue
+        for line in content.splitlines():
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            sid = event.get("sid", "")
+            process = processes.setdefault(sid.split("/")[0], {"command": None, "argv": [], "elapsed": 0.0,
+                                                               "checkout": 0.0})
+            top_level = "/" not in sid
+            if event.get("event") == "start" and top_level:
+                process["argv"] = event.get("argv", [])
+            elif event.get("event") == "cmd_name" and top_level:
+                process["command"] = event.get("name")
+            elif event.get("event") == "exit" and top_level:
+                process["elapsed"] = event.get("t_abs", 0.0)
+            elif (event.get("event") == "region_leave" and event.get("category") == "unpack_trees"
+                  and event.get("label") == "unpack_trees"):
+                process["checkout"] += event.get("t_rel", 0.0)
+    return [process for process in processes.values() if process["command"]]
+
+
+def git_phases(processes: List[Dict], targets: Dict[str, str]) -> Dict[str, Dict[str, float]]:
+    """把頂層git進程歸到倉庫，targets 是 {倉庫路徑或URL: 倉庫名}"""
+    phases: Dict[str, Dict[str, float]] = {}
+    for process in processes:
+        name = next((targets[arg] for arg in process["argv"] if arg in targets), None)
+        if name is None:
+            continue
+        repo = phases.setdefault(name, {"ls_remote": 0.0, "fetch": 0.0, "checkout": 0.0})
+        if process["command"] == "ls-remote":
+            repo["ls_remote"] += process["elapsed"]
+        elif process["command"] in ("clone", "pull"):
+            repo["checkout"] += process["checkout"]
+            repo["fetch"] += max(0.0, process["elapsed"] - process["checkout"])
+    return phases
+
+
+class PhaseTimer:
+    """包裝同步工具的方法，按倉庫累計耗時"""
+
+    def __init__(self):
+        self.timings: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def wrap(self, method: Callable, phase: str, name_of: Callable) -> Callable:
+        def timed(*args, **kwargs):
+            started = time.monotonic()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                with self._lock:
+                    repo = self.timings.setdefault(name_of(*args), {})
+                    repo[phase] = repo.get(phase, 0.0) + time.monotonic() - started
+        return timed
+
+    def reset(self):
+        with self._lock:
+            self.timings = {}
+
+
+class SyncEngine:
+    """sync_repositories.py：並發同步，更新前做快照，遠程無變化時跳過"""
+    name = "sync"
+
+    def __init__(self, work_dir: Path, workers: Optional[int] = None):
+        import sync_repositories
+        self.config = sync_repositories.CONFIG
+        root = Path(work_dir) / self.name
+        overrides = {
+            "git_directory": str(root / "git"),
+            "backup_directory": str(root / "backup"),
+            "history_db": str(root / "sync_history.db"),
+            "journal_file": str(root / "sync_journal.ndjson"),
+            "branch_cache_file": str(root / "branches.json"),
+            "clone_policy_file": str(root / "clone_policies.json"),
+            "shared_object_store": str(root / "objects.git")
+        }
+        self._saved = {key: self.config[key] for key in overrides}
+        self.config.update(overrides)
+        self.workers = workers
+        self.tool = sync_repositories.GitRepositorySync()
+        self.timer = PhaseTimer()
+        self.tool.backup_repository = self.timer.wrap(self.tool.backup_repository, "backup", lambda name: name)
+        # 倉庫、快照和狀態文件都在root下，一次遍歷使硬鏈接快照只計算一次
+        self.root = root
+
+    def repo_path(self, name: str) -> Path:
+        return self.tool.git_dir / name
+
+    def run(self, remotes: Dict[str, str]) -> Dict[str, bool]:
+        results = self.tool.sync_repositories([{"name": name, "github_url": url} for name, url in remotes.items()],
+                                              max_workers=self.workers)
+        return {detail["name"]: detail["success"] for detail in results["details"]}
+
+    def close(self):
+        self.tool.retention.executor.shutdown(wait=True)
+        self.config.update(self._saved)
+
+
+class TraeSyncEngine:
+    """trae-sync --all：逐個倉庫串行 pull 並把工作樹複製到 source 目錄"""
+    name = "trae-sync"
+
+    def __init__(self, work_dir: Path, verbose: bool = False):
+        path = Path(__file__).with_name("trae-sync")
+        loader = importlib.machinery.SourceFileLoader("trae_sync", str(path))
+        module = importlib.util.module_from_spec(importlib.util.spec_from_loader(loader.name, loader))
+        loader.exec_module(module)
+        root = Path(work_dir) / self.name
+        self.syncer = module.TraeRepositorySync()
+        self.syncer.base_dir = str(root / "git")
+        self.syncer.branches = BranchCache(str(root / "branches.json"))
+        self.syncer.policies = {}
+        self.verbose = verbose
+        self.timer = PhaseTimer()
+        self.syncer.copy_source_files = self.timer.wrap(self.syncer.copy_source_files, "copy",
+                                                        lambda git_dir, *args: Path(git_dir).name)
+        Path(self.syncer.base_dir).mkdir(parents=True, exist_ok=True)
+        self.root = root
+
+    def repo_path(self, name: str) -> Path:
+        return Path(self.syncer.base_dir) / name
+
+    def run(self, remotes: Dict[str, str]) -> Dict[str, bool]:
+        outcomes = {}
+        # trae-sync 用 url_template 拼接URL，基準測試的遠程倉庫都在同一目錄
+        self.syncer.url_template = next(iter(remotes.values())).rsplit("/", 1)[0] + "/{repo}.git"
+        with contextlib.redirect_stdout(sys.stdout if self.verbose else io.StringIO()):
+            for name in remotes:
+                outcomes[name] = self.syncer.sync_repository(name)
+        return outcomes
+
+    def close(self):
+        pass
+
+
+def run_case(engine, case: str, remotes: Dict[str, str], trace_dir: Path) -> Dict:
+    """運行一次同步並收集吞吐量、各階段耗時和磁盤寫入"""
+    shutil.rmtree(trace_dir, ignore_errors=True)
+    trace_dir.mkdir(parents=True)
+    engine.timer.reset()
+
+    def objects_size(name: str) -> int:
+        return directory_size(engine.repo_path(name) / ".git" / "objects")
+
+    objects_before = {name: objects_size(name) for name in remotes}
+    disk_before = directory_size(engine.root)
+    written_before = _write_bytes()
+    started = time.monotonic()
+    with traced(trace_dir):
+        outcomes = engine.run(remotes)
+    wall = time.monotonic() - started
+    written_after = _write_bytes()
+    disk_after = directory_size(engine.root)
+    fetched = sum(max(0, objects_size(name) - objects_before[name]) for name in remotes)
+
+    targets = {str(engine.repo_path(name)): name for name in remotes}
+    targets.update({url: name for name, url in remotes.items()})
+    phases = git_phases(parse_trace(trace_dir), targets)
+    for name, timings in engine.timer.timings.items():
+        phases.setdefault(name, {}).update(timings)
+
+    totals = {phase: sum(repo.get(phase, 0.0) for repo in phases.values()) for phase in PHASES}
+    return {
+        "engine": engine.name,
+        "case": case,
+        "repositories": len(remotes),
+        "success": sum(1 for success in outcomes.values() if success),
+        "wall": round(wall, 3),
+        "repos_per_second": round(len(remotes) / wall, 2) if wall else None,
+        "bytes_fetched": fetched,
+        "mb_per_second": round(fetched / 1024 / 1024 / wall, 2) if wall else None,
+        "phases": {phase: {"total": round(total, 3), "mean": round(total / len(remotes), 4)}
+                   for phase, total in totals.items()},
+        "bytes_written": (written_after - written_before) if written_before is not None else None,
+        "disk_growth": disk_after - disk_before,
+        "per_repository": {name: {phase: round(value, 4) for phase, value in timings.items()}
+                           for name, timings in sorted(phases.items())}
+    }
+
+
+def run_benchmark(work_dir: Path, repos: int = 5, size_mb: float = 10, commits: int = 20, files: int = 50,
+                  warm_commits: int = 3, engines=("sync", "trae-sync"), workers: Optional[int] = None,
+                  seed: int = 0, verbose: bool = False) -> Dict:
+    """生成合成遠程倉庫，依次對每個引擎運行 cold / warm / noop"""
+    work_dir = Path(work_dir)
+    remotes_dir = work_dir / "remotes"
+    remotes_dir.mkdir(parents=True, exist_ok=True)
+    size_bytes = int(size_mb * 1024 * 1024)
+
+    started = time.monotonic()
+    remotes = {}
+    generated = 0
+    for index in range(repos):
+        name = f"bench_{index:03d}"
+        info = generate_repository(remotes_dir / f"{name}.git", size_bytes, commits, files, seed=seed + index)
+        generated += info["size"]
+        remotes[name] = f"file://{remotes_dir / name}.git"
+    logger.info(f"🧪 已生成 {repos} 個合成倉庫 ({generated / 1024 / 1024:.1f} MB 打包後)，"
+                f"耗時 {time.monotonic() - started:.1f}s")
+
+    instances = []
+    try:
+        for engine in engines:
+            if engine == "sync":
+                instances.append(SyncEngine(work_dir, workers))
+            elif engine == "trae-sync":
+                instances.append(TraeSyncEngine(work_dir, verbose))
+            else:
+                raise ValueError(f"未知的同步引擎: {engine}")
+
+        runs = []
+        for case in CASES:
+            # 所有引擎在同一個遠程狀態上運行，結果可以直接比較
+            if case == "warm":
+                for index, name in enumerate(remotes):
+                    append_commits(remotes_dir / f"{name}.git", warm_commits, size_bytes, commits, files,
+                                   seed=seed + index)
+            for instance in instances:
+                logger.info(f"⏱️ {instance.name} {case}")
+                runs.append(run_case(instance, case, remotes, work_dir / "trace"))
+    finally:
+        for instance in instances:
+            instance.close()
+
+    return {
+        "repositories": repos,
+        "size_mb": size_mb,
+        "commits": commits,
+        "files": files,
+        "warm_commits": warm_commits,
+        "remote_bytes": generated,
+        "runs": runs
+    }
+
+
+def _megabytes(value: Optional[int]) -> str:
+    return "-" if value is None else f"{value / 1024 / 1024:.1f} MB"
+
+
+def format_results(results: Dict) -> str:
+    """把run_benchmark()的結果格式化為終端輸出"""
+    lines = [
+        f"📊 同步基準測試: {results['repositories']} 個倉庫 × {results['size_mb']:g} MB 歷史，"
+        f"{results['commits']} 個提交，warm 追加 {results['warm_commits']} 個提交，"
+        f"遠程共 {_megabytes(results['remote_bytes'])}",
+        "   (各階段耗時是所有倉庫之和，並發同步時可能超過總耗時)",
+        ""
+    ]
+    for run in results["runs"]:
+        lines.append(
+            f"   {run['engine']:<10} {run['case']:<5} {run['success']}/{run['repositories']} 成功  "
+            f"{run['wall']:7.2f}s  {run['repos_per_second']:6.1f} 倉庫/s  {run['mb_per_second']:7.1f} MB/s  "
+            f"寫入 {_megabytes(run['bytes_written']):>9}  目錄 {run['disk_growth'] / 1024 / 1024:+.1f} MB"
+        )
+        lines.append("              " + "  ".join(f"{phase} {run['phases'][phase]['total']:.2f}s"
+                                                  for phase in PHASES))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline Git Sync Benchmark")
+    parser.add_argument("--repos", type=int, default=5, help="合成倉庫數量")
+    parser.add_argument("--size-mb", type=float, default=10, help="每個倉庫歷史中文件內容的總大小 (MB)")
+    parser.add_argument("--commits", type=int, default=20, help="每個倉庫的提交數")
+    parser.add_argument("--files", type=int, default=50, help="每個倉庫的文件數")
+    parser.add_argument("--warm-commits", type=int, default=3, help="warm 同步前每個遠程倉庫追加的提交數")
+    parser.add_argument("--engine", choices=["sync", "trae-sync", "both"], default="both", help="測試的同步程序")
+    parser.add_argument("--workers", type=int, help="sync_repositories 的並發數")
+    parser.add_argument("--seed", type=int, default=0, help="生成倉庫內容的隨機種子")
+    parser.add_argument("--work-dir", help="工作目錄 (默認使用臨時目錄)")
+    parser.add_argument("--keep", action="store_true", help="保留工作目錄")
+    parser.add_argument("--json", action="store_true", help="以JSON輸出結果")
+    parser.add_argument("--verbose", action="store_true", help="顯示同步程序的日誌")
+    args = parser.parse_args()
+
+    if args.repos < 1 or args.commits < 1 or args.files < 1 or args.size_mb <= 0 or args.warm_commits < 1:
+        print("❌ --repos / --commits / --files / --warm-commits 必須大於0，--size-mb 必須為正數")
+        sys.exit(1)
+
+    # 日誌寫到標準錯誤；同步程序的日誌只在 --verbose 時顯示，不寫入正式的同步日誌
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    logger.setLevel(logging.INFO)
+    engines = ("sync", "trae-sync") if args.engine == "both" else (args.engine,)
+    work_dir = Path(args.work_dir) if args.work_dir else Path(tempfile.mkdtemp(prefix="sync_bench_"))
+    if args.work_dir and work_dir.exists() and any(work_dir.iterdir()):
+        print(f"❌ 工作目錄不是空的: {work_dir}")
+        sys.exit(1)
+
+    try:
+        results = run_benchmark(work_dir, args.repos, args.size_mb, args.commits, args.files, args.warm_commits,
+                                engines, args.workers, args.seed, args.verbose)
+    finally:
+        if args.keep:
+            print(f"📁 工作目錄: {work_dir}", file=sys.stderr)
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(results, indent=2, ensure_ascii=False))
+    else:
+        print(format_results(results))
+
+
+if __name__ == "__main__":
+    main()
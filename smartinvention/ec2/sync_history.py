@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Sync History (EC2端)
+只追加的SQLite同步歷史，取代每次運行寫一個 /tmp/trae_sync_report_ec2_<時間>.json
+
+- runs：每次同步一行（時間、來源、總數/成功/失敗/無變化）
+- results：每個倉庫一行（耗時、拉取字節數、同步前後HEAD、結果、錯誤分類）
+- 按倉庫和時間建立索引，報告只掃描時間窗口內的行
+
+報告給出時間窗口內的耗時百分位、最慢的倉庫（與上一個同樣長的窗口對比）和失敗率。
+"""
+
+import json
+import time
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB = "/home/alexchuang/aiengine/trae/ec2/sync_history.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at REAL NOT NULL,
+    finished_at REAL NOT NULL,
+    source TEXT,
+    total INTEGER NOT NULL,
+    success INTEGER NOT NULL,
+    failed INTEGER NOT NULL,
+    unchanged INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    repository TEXT NOT NULL,
+    finished_at REAL NOT NULL,
+    action TEXT,
+    outcome TEXT NOT NULL,
+    duration REAL,
+    bytes_fetched INTEGER,
+    old_head TEXT,
+    new_head TEXT,
+    error_class TEXT,
+    error TEXT,
+    clone_policy TEXT
+);
+CREATE INDEX IF NOT EXISTS results_repository_time ON results (repository, finished_at);
+CREATE INDEX IF NOT EXISTS results_time ON results (finished_at);
+CREATE INDEX IF NOT EXISTS runs_time ON runs (started_at);
+"""
+
+# (錯誤分類, git輸出中的關鍵字)，按順序匹配
+ERROR_CLASSES = (
+    ("timeout", ("timed out", "timeout", "超時")),
+    ("auth", ("authentication failed", "permission denied", "could not read username", "error: 403")),
+    ("not_found", ("repository not found", "not found", "does not exist", "does not appear to be a git repository")),
+    ("network", ("could not resolve host", "connection refused", "connection reset", "early eof",
+                 "unable to access", "network is unreachable", "rpc failed")),
+    ("conflict", ("conflict", "not possible to fast-forward", "divergent branches", "would be overwritten",
+                  "unrelated histories")),
+    ("disk", ("no space left", "disk quota", "read-only file system")),
+)
+
+
+def classify_error(message: Optional[str]) -> Optional[str]:
+    """把git錯誤輸出歸類，便於按類型統計失敗"""
+    if not message:
+        return None
+    lowered = message.lower()
+    for error_class, keywords in ERROR_CLASSES:
+        if any(keyword in lowered for keyword in keywords):
+            return error_class
+    return "other"
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    """線性插值百分位，values需已排序"""
+    if not values:
+        return None
+    position = (len(values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+class SyncHistory:
+    def __init__(self, db_path: str = DEFAULT_DB):
+        self.db_path = str(Path(db_path).expanduser())
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            self._connection().executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        """常駐代理在多次同步之間複用同一個連接，調用方需持有 self._lock"""
+        if self._conn is None:
+            self._conn = self._connect()
+        return self._conn
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        # WAL模式下報告查詢不會阻塞同步寫入
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def record_run(self, results: Dict, started_at: float, source: Optional[Dict] = None) -> int:
+        """寫入一次同步及其每個倉庫的結果，返回運行ID"""
+        with self._lock, self._connection() as conn:
+            cursor = conn.execute(
+                "INSERT INTO runs (started_at, finished_at, source, total, success, failed, unchanged) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (started_at, time.time(), json.dumps(source or {}, ensure_ascii=False), results["total"],
+                 results["success"], results["failed"], results.get("unchanged", 0))
+            )
+            run_id = cursor.lastrowid
+            conn.executemany(
+                "INSERT INTO results (run_id, repository, finished_at, action, outcome, duration, bytes_fetched, "
+                "old_head, new_head, error_class, error, clone_policy) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(run_id, detail["name"], detail.get("finished_at") or time.time(), detail.get("action"),
+                  "unchanged" if detail.get("action") == "unchanged" else ("success" if detail["success"] else "failed"),
+                  detail.get("duration"), detail.get("bytes_fetched"), detail.get("old_head"), detail.get("head"),
+                  classify_error(detail.get("error")) if not detail["success"] else None,
+                  (detail.get("error") or "")[-2000:] or None, detail.get("clone_policy"))
+                 for detail in results["details"]]
+            )
+        return run_id
+
+    def _window(self, conn: sqlite3.Connection, since: float, until: float) -> Dict[str, List[sqlite3.Row]]:
+        rows = conn.execute(
+            "SELECT repository, outcome, duration, bytes_fetched, error_class FROM results "
+            "WHERE finished_at >= ? AND finished_at < ?", (since, until)
+        ).fetchall()
+        by_repository: Dict[str, List[sqlite3.Row]] = {}
+        for row in rows:
+            by_repository.setdefault(row["repository"], []).append(row)
+        return by_repository
+
+    def report(self, days: float = 7, top: int = 10, now: Optional[float] = None) -> Dict:
+        """時間窗口內的統計；耗時只計算實際執行了同步的結果（不含無變化）"""
+        now = now or time.time()
+        since = now - days * 86400
+        with self._lock:
+            conn = self._connection()
+            current = self._window(conn, since, now)
+            previous = self._window(conn, since - days * 86400, since)
+            runs = conn.execute("SELECT COUNT(*) FROM runs WHERE started_at >= ?", (since,)).fetchone()[0]
+
+        def durations(rows) -> List[float]:
+            return sorted(row["duration"] for row in rows if row["outcome"] != "unchanged" and row["duration"] is not None)
+
+        all_rows = [row for rows in current.values() for row in rows]
+        all_durations = durations(all_rows)
+        repositories = []
+        for name, rows in current.items():
+            synced = durations(rows)
+            attempts = [row for row in rows if row["outcome"] != "unchanged"]
+            failures = [row for row in attempts if row["outcome"] == "failed"]
+            errors: Dict[str, int] = {}
+            for row in failures:
+                errors[row["error_class"] or "other"] = errors.get(row["error_class"] or "other", 0) + 1
+            previous_p50 = percentile(durations(previous.get(name, [])), 0.5)
+            p50 = percentile(synced, 0.5)
+            repositories.append({
+                "repository": name,
+                "results": len(rows),
+                "synced": len(attempts),
+                "unchanged": len(rows) - len(attempts),
+                "failed": len(failures),
+                "failure_rate": len(failures) / len(attempts) if attempts else 0.0,
+                "errors": errors,
+                "p50": p50,
+                "p90": percentile(synced, 0.9),
+                "max": synced[-1] if synced else None,
+                "previous_p50": previous_p50,
+                "change": (p50 / previous_p50 - 1) if p50 and previous_p50 else None,
+                "bytes_fetched": sum(row["bytes_fetched"] or 0 for row in rows)
+            })
+
+        attempted = [row for row in all_rows if row["outcome"] != "unchanged"]
+        return {
+            "days": days,
+            "runs": runs,
+            "results": len(all_rows),
+            "failed": sum(1 for row in attempted if row["outcome"] == "failed"),
+            "failure_rate": (sum(1 for row in attempted if row["outcome"] == "failed") / len(attempted)
+                             if attempted else 0.0),
+            "p50": percentile(all_durations, 0.5),
+            "p90": percentile(all_durations, 0.9),
+            "p99": percentile(all_durations, 0.99),
+            "bytes_fetched": sum(row["bytes_fetched"] or 0 for row in all_rows),
+            "slowest": sorted((repo for repo in repositories if repo["p90"] is not None),
+                              key=lambda repo: repo["p90"], reverse=True)[:top],
+            "failing": sorted((repo for repo in repositories if repo["failed"]),
+                              key=lambda repo: (repo["failure_rate"], repo["failed"]), reverse=True)[:top]
+        }
+
+
+def _seconds(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:.1f}s"
+
+
+def format_report(report: Dict) -> str:
+    """把report()的結果格式化為終端輸出"""
+    lines = [
+        f"📊 最近 {report['days']:g} 天: {report['runs']} 次同步，{report['results']} 個倉庫結果，"
+        f"失敗率 {report['failure_rate']:.1%}，拉取 {report['bytes_fetched'] / 1024 / 1024:.1f} MB",
+        f"⏱️ 同步耗時 p50 {_seconds(report['p50'])}  p90 {_seconds(report['p90'])}  p99 {_seconds(report['p99'])}",
+        "",
+        "🐢 最慢的倉庫 (按p90):"
+    ]
+    for repo in report["slowest"]:
+        change = "" if repo["change"] is None else f"  較上期 {repo['change']:+.0%}"
+        lines.append(f"   {repo['repository']:<32} p50 {_seconds(repo['p50']):>7}  p90 {_seconds(repo['p90']):>7}  "
+                     f"max {_seconds(repo['max']):>7}  同步 {repo['synced']} 次{change}")
+    if not report["slowest"]:
+        lines.append("   (無)")
+    lines += ["", "❌ 失敗率最高的倉庫:"]
+    for repo in report["failing"]:
+        errors = ", ".join(f"{name} {count}" for name, count in sorted(repo["errors"].items(), key=lambda item: -item[1]))
+        lines.append(f"   {repo['repository']:<32} {repo['failed']}/{repo['synced']} ({repo['failure_rate']:.0%})  {errors}")
+    if not report["failing"]:
+        lines.append("   (無)")
+    return "\n".join(lines)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Sync Journal (EC2端)
+同步過程的預寫日誌，進程被殺死（Mac端超時、SSH斷開、OOM）後可以恢復和續傳
+
+日誌是NDJSON文件，每條記錄寫入後立即fsync：
+- {"type": "run", "run": ID, "repositories": [...]}：一次同步開始
+- {"type": "state", "name": 倉庫, "state": ...}：倉庫狀態變化
+    cloning / updating (附快照ID和更新前HEAD) → done (附結果) / failed，恢復後追加 recovered
+- {"type": "end"}：同步正常結束
+
+同步期間持有日誌文件的排他鎖；能拿到鎖而最後一次同步沒有 end 記錄，
+說明上次同步被中斷，其中處於 cloning / updating 狀態的倉庫需要恢復。
+日誌只保留最近一次同步，新的同步開始時截斷。
+"""
+
+import os
+import json
+import time
+import fcntl
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOURNAL = "/home/alexchuang/aiengine/trae/ec2/sync_journal.ndjson"
+# 中斷時處於這些狀態的倉庫可能不一致
+UNFINISHED_STATES = ("cloning", "updating")
+
+
+class SyncJournal:
+    def __init__(self, path: str = DEFAULT_JOURNAL):
+        self.path = Path(path).expanduser()
+        self._file = None
+        self._run_id: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def open(self) -> Optional[Dict]:
+        """取得日誌鎖（其他進程同步期間等待），返回被中斷的上一次同步，沒有則返回None"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "a+", encoding="utf-8")
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            logger.info("⏳ 另一個同步正在進行，等待其結束...")
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        self._file.seek(0)
+        return self._parse(self._file.read())
+
+    @staticmethod
+    def _parse(content: str) -> Optional[Dict]:
+        run = None
+        for line in content.splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # 寫到一半被中斷的最後一行
+                continue
+            if record.get("type") == "run":
+                run = {"run": record["run"], "started": record.get("time"),
+                       "repositories": record.get("repositories", []), "states": {}}
+            elif record.get("type") == "state" and run is not None:
+                run["states"][record["name"]] = record
+            elif record.get("type") == "end":
+                run = None
+        return run
+
+    def _write(self, record: Dict):
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def start(self, repositories: List[Dict]) -> str:
+        """截斷日誌並記錄新的同步"""
+        self._run_id = time.strftime("%Y%m%d_%H%M%S")
+        with self._lock:
+            self._file.seek(0)
+            self._file.truncate()
+        self._write({"type": "run", "run": self._run_id, "time": time.time(), "repositories": repositories})
+        return self._run_id
+
+    def record(self, name: str, state: str, **fields):
+        """記錄倉庫狀態變化，沒有進行中的同步時忽略"""
+        if self._run_id is None:
+            return
+        self._write({"type": "state", "name": name, "state": state, "time": time.time(), **fields})
+
+    def record_recovery(self, name: str, outcome: str):
+        """在被中斷的同步之後追加恢復結果，恢復過的倉庫不會被再次恢復"""
+        self._write({"type": "state", "name": name, "state": "recovered", "outcome": outcome, "time": time.time()})
+
+    def finish(self):
+        """記錄正常結束並釋放鎖"""
+        if self._run_id is not None:
+            self._write({"type": "end", "time": time.time()})
+        self.close()
+
+    def close(self):
+        """釋放鎖但不記錄結束，下次同步會把這次當作中斷處理"""
+        self._run_id = None
+        with self._lock:
+            if self._file is not None:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+                self._file.close()
+                self._file = None
+
+    @staticmethod
+    def completed(interrupted: Optional[Dict]) -> Dict[str, Dict]:
+        """被中斷的同步中已經完成的倉庫及其結果"""
+        if not interrupted:
+            return {}
+        return {name: record.get("detail") or {} for name, record in interrupted["states"].items()
+                if record["state"] == "done"}
+
+    @staticmethod
+    def unfinished(interrupted: Optional[Dict]) -> Dict[str, Dict]:
+        """被中斷時正在克隆或更新的倉庫"""
+        if not interrupted:
+            return {}
+        return {name: record for name, record in interrupted["states"].items()
+                if record["state"] in UNFINISHED_STATES}
@@ -12,13 +12,29 @@ Git Repository Sync Tool (EC2端)
 
 import os
 import sys
+import gzip
 import json
+import zlib
+import time
 import subprocess
 import logging
 import argparse
-from datetime import datetime
+import shutil
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Callable, Tuple
+
+from branch_cache import (BranchCache, fetch_default_branch, fetched_head, merge_fetched, parse_ls_remote_symref,
+                          pull_default_branch)
+from repo_snapshot import BACKENDS, SnapshotStore, benchmark
+from backup_retention import BackupIndex, RetentionEngine
+from sync_history import SyncHistory, format_report
+from sync_journal import SyncJournal
+from object_store import SharedObjectStore
+from clone_policy import (PolicyFile, applied_policy, clone_args, describe, finish_clone, is_partial,
+                          needs_reclone, parse_policy, reclone, reconcile, recover_reclone)
 
 # EC2端配置
 CONFIG = {
@@ -27,26 +43,116 @@ CONFIG = {
     "log_file": "/tmp/trae_sync_ec2.log",
     "backup_directory": "/home/alexchuang/aiengine/trae/ec2/backup",
     "max_concurrent_syncs": 3,
+    "max_network_ops": None,  # 同時進行的clone/pull數量上限，None表示只受並發數限制
+    "max_disk_ops": 2,  # 同時進行的備份數量上限，None表示只受並發數限制
+    "skip_unchanged": True,  # 遠程HEAD與本地一致時跳過備份和pull
+    "max_ls_remote": 16,  # 並行查詢遠程HEAD的數量
+    "ls_remote_timeout": 30,
+    "branch_cache_file": "~/.trae_branch_cache.json",  # 每個倉庫的默認分支緩存
+    "backup_backend": "hardlink",  # 更新前的快照方式: hardlink / reflink / copy
+    # 每個倉庫保留最新keep_last個，再按天/周/月各保留一個；總大小超過max_bytes時從最舊的刪除
+    "backup_retention": {
+        "keep_last": 3,
+        "daily": 7,
+        "weekly": 4,
+        "monthly": 3,
+        "max_age_days": None,
+        "max_bytes": 20 * 1024 ** 3
+    },
+    "backup_delete_workers": 4,
+    "history_db": "/home/alexchuang/aiengine/trae/ec2/sync_history.db",  # 同步歷史 (SQLite)
+    "journal_file": "/home/alexchuang/aiengine/trae/ec2/sync_journal.ndjson",  # 中斷恢復用的預寫日誌
+    "shared_objects": False,  # 新克隆的倉庫使用共用對象庫 (fork之間共享歷史)
+    "shared_object_store": "/home/alexchuang/aiengine/trae/ec2/objects.git",
+    "shared_gc_prune": "2.weeks.ago",  # 回收共用庫時保留的無引用對象時限
+    "clone_policy_file": "~/.trae_clone_policies.json",  # 倉庫列表未指定clone_policy時按倉庫名查找
     "timeout": 300
 }
 
-# 設置日誌
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(CONFIG["log_file"]),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
 logger = logging.getLogger(__name__)
 
+
+def setup_logging(stream=sys.stdout):
+    """同步日誌寫入 CONFIG["log_file"] 和 stream；只由命令行和常駐代理調用，
+    導入本模組的其他程序（例如基準測試）不會寫入正式的同步日誌"""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(CONFIG["log_file"]),
+            logging.StreamHandler(stream)
+        ]
+    )
+
+def read_repo_stream(stream) -> Tuple[List[Dict], Dict]:
+    """從標準輸入讀取倉庫列表 (NDJSON，可gzip壓縮)"""
+    # gzip數據以 1f 8b 開頭，否則按明文NDJSON讀取
+    if stream.peek(2)[:2] == b"\x1f\x8b":
+        stream = gzip.GzipFile(fileobj=stream)
+    
+    repositories = []
+    source_info = {}
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        record = json.loads(line)
+        record_type = record.pop("type", "repository")
+        if record_type == "header":
+            source_info = {
+                "sync_time": record.get("sync_time"),
+                "source": record.get("source")
+            }
+        elif record_type == "repository":
+            repositories.append(record)
+    return repositories, source_info
+
+class NDJSONWriter:
+    """逐行輸出NDJSON結果，每行後同步刷新壓縮流，接收端可以立即解碼"""
+    
+    def __init__(self, stream, compress: bool = True):
+        self.stream = stream
+        # wbits=31 輸出gzip格式
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    
+    def write(self, record: Dict):
+        data = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        if self.compressor is not None:
+            data = self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.stream.write(data)
+        self.stream.flush()
+    
+    def close(self):
+        if self.compressor is not None:
+            self.stream.write(self.compressor.flush())
+            self.compressor = None
+        self.stream.flush()
+
 class GitRepositorySync:
     def __init__(self):
         self.git_dir = Path(CONFIG["git_directory"])
         self.backup_dir = Path(CONFIG["backup_directory"])
+        # 網絡操作和本地磁盤操作可以分別限流
+        self.network_slots = self._slots(CONFIG["max_network_ops"])
+        self.disk_slots = self._slots(CONFIG["max_disk_ops"])
+        self.branches = BranchCache(CONFIG["branch_cache_file"])
+        self.backup_index = BackupIndex(self.backup_dir)
+        self.snapshots = SnapshotStore(self.backup_dir, CONFIG["backup_backend"], self.backup_index)
+        self.objects = SharedObjectStore(CONFIG["shared_object_store"], CONFIG["shared_gc_prune"])
+        self.retention = RetentionEngine(self.backup_dir, self.backup_index, CONFIG["backup_retention"],
+                                         CONFIG["backup_delete_workers"], delete_lock=self.shared_objects_lock)
+        # 常駐代理中策略文件和分支緩存修改後無需重啟，查詢時按修改時間重新讀取
+        self.policies = PolicyFile(CONFIG["clone_policy_file"])
+        self.history = SyncHistory(CONFIG["history_db"])
+        self.journal = SyncJournal(CONFIG["journal_file"])
+        # 每個倉庫最近一次失敗的錯誤輸出，寫入同步歷史
+        self.errors: Dict[str, str] = {}
         self.ensure_directories()
         
+    @staticmethod
+    def _slots(limit: Optional[int]):
+        return threading.BoundedSemaphore(max(1, limit)) if limit else contextlib.nullcontext()
+    
     def ensure_directories(self):
         """確保必要的目錄存在"""
         self.git_dir.mkdir(parents=True, exist_ok=True)
@@ -54,30 +160,92 @@ class GitRepositorySync:
         logger.info(f"Git目錄: {self.git_dir}")
         logger.info(f"備份目錄: {self.backup_dir}")
     
-    def backup_repository(self, repo_name: str) -> bool:
-        """備份現有倉庫"""
+    def list_repositories(self) -> List[str]:
+        """列出Git目錄中的倉庫"""
+        if not self.git_dir.exists():
+            return []
+        # 以.開頭的是重新克隆和恢復時的臨時目錄
+        return sorted(d.name for d in self.git_dir.iterdir()
+                      if d.is_dir() and not d.name.startswith(".") and (d / ".git").exists())
+    
+    def get_head(self, repo_name: str) -> Optional[str]:
+        """讀取倉庫當前的HEAD提交"""
+        try:
+            result = subprocess.run([
+                "git", "-C", str(self.git_dir / repo_name), "rev-parse", "HEAD"
+            ], capture_output=True, text=True, timeout=30)
+            return result.stdout.strip() if result.returncode == 0 else None
+        except Exception:
+            return None
+    
+    def remote_head(self, repo: Dict) -> Optional[str]:
+        """查詢遠程倉庫HEAD指向的提交，順便記錄默認分支"""
+        try:
+            result = subprocess.run([
+                "git", "ls-remote", "--symref", repo["github_url"], "HEAD"
+            ], capture_output=True, text=True, timeout=CONFIG["ls_remote_timeout"],
+               env={**os.environ, "GIT_TERMINAL_PROMPT": "0"})
+            if result.returncode == 0:
+                branch, head = parse_ls_remote_symref(result.stdout)
+                if branch and not self.branches.get(self.git_dir / repo["name"]):
+                    self.branches.store(self.git_dir / repo["name"], branch, "ls-remote")
+                return head
+        except Exception as e:
+            logger.debug(f"查詢遠程HEAD失敗 {repo['github_url']}: {e}")
+        return None
+    
+    def resolve_remote_heads(self, repositories: List[Dict]) -> Dict[str, Optional[str]]:
+        """並行查詢所有本地已存在倉庫的遠程HEAD"""
+        existing = [repo for repo in repositories if (self.git_dir / repo["name"] / ".git").exists()]
+        if not existing:
+            return {}
+        
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=max(1, CONFIG["max_ls_remote"]), thread_name_prefix="ls-remote") as pool:
+            heads = pool.map(self.remote_head, existing)
+            remote_heads = {repo["name"]: head for repo, head in zip(existing, heads)}
+        logger.info(f"🔎 已查詢 {len(existing)} 個倉庫的遠程HEAD ({time.monotonic() - started:.1f}s)")
+        return remote_heads
+    
+    def object_store_size(self, repo_name: str) -> int:
+        """倉庫對象庫佔用的字節數，同步前後的差值即為本次拉取的數據量"""
+        total = 0
+        for root, _, files in os.walk(self.git_dir / repo_name / ".git" / "objects"):
+            for file in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, file))
+                except OSError:
+                    continue
+        return total
+    
+    def policy_for(self, repo: Dict) -> Dict:
+        """倉庫的克隆策略，倉庫列表中的clone_policy優先於策略文件"""
+        if "clone_policy" in repo:
+            return parse_policy(repo["clone_policy"])
+        return self.policies.get(repo["name"], {})
+    
+    def policy_applied(self, repo: Dict) -> bool:
+        """倉庫當前生效的策略與配置一致（策略無效時視為一致，由同步過程報錯）"""
+        try:
+            policy = self.policy_for(repo)
+        except ValueError:
+            return True
+        return (applied_policy(self.git_dir / repo["name"]) or {}) == policy
+    
+    def backup_repository(self, repo_name: str) -> Optional[str]:
+        """為現有倉庫創建快照，返回快照ID，倉庫不存在或備份失敗時返回None"""
         try:
             repo_path = self.git_dir / repo_name
             if not repo_path.exists():
-                return True
-            
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            backup_path = self.backup_dir / f"{repo_name}_{timestamp}"
-            
-            result = subprocess.run([
-                "cp", "-r", str(repo_path), str(backup_path)
-            ], capture_output=True, text=True)
+                return None
             
-            if result.returncode == 0:
-                logger.info(f"✅ 倉庫 {repo_name} 已備份到 {backup_path}")
-                return True
-            else:
-                logger.error(f"❌ 備份倉庫 {repo_name} 失敗: {result.stderr}")
-                return False
+            info = self.snapshots.snapshot(repo_path, repo_name)
+            logger.info(f"✅ 倉庫 {repo_name} 已備份到 {info['path']} ({info['backend']}, {info['duration']:.2f}s)")
+            return info["id"]
                 
         except Exception as e:
             logger.error(f"❌ 備份倉庫 {repo_name} 時出錯: {e}")
-            return False
+            return None
     
     def clone_repository(self, repo: Dict) -> bool:
         """克隆新倉庫"""
@@ -86,28 +254,49 @@ class GitRepositorySync:
             repo_url = repo["github_url"]
             repo_path = self.git_dir / repo_name
             
-            logger.info(f"🔄 克隆倉庫: {repo_name}")
+            policy = self.policy_for(repo)
+            logger.info(f"🔄 克隆倉庫: {repo_name} ({describe(policy)})")
             
+            # 淺克隆和部分克隆缺少對象，不能加入共用對象庫
+            reference = self.objects.clone_args() if CONFIG["shared_objects"] and not policy else []
             result = subprocess.run([
-                "git", "clone", repo_url, str(repo_path)
+                "git", "clone", *reference, *clone_args(policy), repo_url, str(repo_path)
             ], capture_output=True, text=True, timeout=CONFIG["timeout"])
             
+            if result.returncode == 0:
+                result = finish_clone(repo_path, policy, timeout=CONFIG["timeout"])
+            
             if result.returncode == 0:
                 logger.info(f"✅ 倉庫 {repo_name} 克隆成功")
                 return True
             else:
                 logger.error(f"❌ 克隆倉庫 {repo_name} 失敗: {result.stderr}")
+                self.errors[repo_name] = result.stderr
                 return False
                 
         except subprocess.TimeoutExpired:
             logger.error(f"❌ 克隆倉庫 {repo_name} 超時")
+            self.errors[repo_name] = "timeout"
             return False
         except Exception as e:
             logger.error(f"❌ 克隆倉庫 {repo_name} 時出錯: {e}")
+            self.errors[repo_name] = str(e)
             return False
     
-    def update_repository(self, repo: Dict) -> bool:
-        """更新現有倉庫"""
+    def fetch_repository(self, repo: Dict) -> Tuple[bool, Optional[str], Optional[str]]:
+        """只獲取默認分支的新對象，不改動HEAD和工作區，返回 (是否成功, 分支, 遠程提交)"""
+        repo_name = repo["name"]
+        repo_path = self.git_dir / repo_name
+        success, branch, error = fetch_default_branch(self.branches, repo_path, repo["github_url"],
+                                                      timeout=CONFIG["timeout"])
+        if not success:
+            logger.error(f"❌ 獲取倉庫 {repo_name} 失敗: {error}")
+            self.errors[repo_name] = error
+            return False, branch, None
+        return True, branch, fetched_head(repo_path)
+    
+    def update_repository(self, repo: Dict, fetched: Optional[Tuple[str, str]] = None) -> bool:
+        """更新現有倉庫，fetched為已經獲取的 (分支, 遠程提交) 時直接合併而不再pull"""
         try:
             repo_name = repo["name"]
             repo_path = self.git_dir / repo_name
@@ -120,116 +309,361 @@ class GitRepositorySync:
                 subprocess.run(["rm", "-rf", str(repo_path)], capture_output=True)
                 return self.clone_repository(repo)
             
-            # 執行git pull
-            result = subprocess.run([
-                "git", "-C", str(repo_path), "pull", "origin", "main"
-            ], capture_output=True, text=True, timeout=CONFIG["timeout"])
+            # 過濾器或深度變化時重新克隆（更新前的快照仍然保留，可以恢復）
+            policy = self.policy_for(repo)
+            if needs_reclone(repo_path, policy):
+                logger.info(f"🔁 倉庫 {repo_name} 的克隆策略變為 {describe(policy)}，重新克隆")
+                reference = self.objects.clone_args() if CONFIG["shared_objects"] and not policy else []
+                result = reclone(repo_path, repo["github_url"], policy, reference, timeout=CONFIG["timeout"])
+                if result.returncode == 0:
+                    logger.info(f"✅ 倉庫 {repo_name} 已按新策略重新克隆")
+                    return True
+                logger.error(f"❌ 重新克隆倉庫 {repo_name} 失敗，保留現有倉庫: {result.stderr}")
+                self.errors[repo_name] = result.stderr
+                return False
             
-            if result.returncode == 0:
-                logger.info(f"✅ 倉庫 {repo_name} 更新成功")
+            # 策略中的稀疏路徑變化時先調整，過濾器和淺克隆邊界由pull保留
+            reconcile(repo_path, policy, timeout=CONFIG["timeout"])
+            
+            if fetched is not None:
+                branch = fetched[0]
+                result = merge_fetched(repo_path, timeout=CONFIG["timeout"])
+                success, error = result.returncode == 0, result.stderr
+            else:
+                # 拉取緩存的默認分支
+                success, branch, error = pull_default_branch(self.branches, repo_path, repo["github_url"],
+                                                             timeout=CONFIG["timeout"])
+            if success:
+                logger.info(f"✅ 倉庫 {repo_name} 更新成功 ({branch}分支)")
                 return True
             else:
-                # 嘗試其他分支
-                result = subprocess.run([
-                    "git", "-C", str(repo_path), "pull", "origin", "master"
-                ], capture_output=True, text=True, timeout=CONFIG["timeout"])
-                
-                if result.returncode == 0:
-                    logger.info(f"✅ 倉庫 {repo_name} 更新成功 (master分支)")
-                    return True
-                else:
-                    logger.error(f"❌ 更新倉庫 {repo_name} 失敗: {result.stderr}")
-                    return False
+                logger.error(f"❌ 更新倉庫 {repo_name} 失敗: {error}")
+                self.errors[repo_name] = error
+                return False
                 
         except subprocess.TimeoutExpired:
             logger.error(f"❌ 更新倉庫 {repo_name} 超時")
+            self.errors[repo_name] = "timeout"
             return False
         except Exception as e:
             logger.error(f"❌ 更新倉庫 {repo_name} 時出錯: {e}")
+            self.errors[repo_name] = str(e)
             return False
     
+    def shared_objects_lock(self, path: Path):
+        """修改使用共用對象庫的倉庫或快照時持有共享鎖，期間不會進行回收"""
+        if CONFIG["shared_objects"] or self.objects.is_attached(path):
+            return self.objects.using()
+        return contextlib.nullcontext()
+    
     def sync_repository(self, repo: Dict) -> bool:
-        """同步單個倉庫"""
+        """同步單個倉庫，使用共用對象庫時同步期間不會進行回收"""
+        repo_path = self.git_dir / repo["name"]
+        with self.shared_objects_lock(repo_path):
+            success = self._sync_repository(repo)
+            # 把新對象登記到共用庫，之後克隆的fork可以復用
+            if success and self.objects.is_attached(repo_path):
+                self.objects.register(repo_path, f"repos/{repo['name']}")
+            return success
+    
+    def _sync_repository(self, repo: Dict) -> bool:
+        """備份並更新現有倉庫，或克隆新倉庫"""
         try:
             repo_name = repo["name"]
             repo_path = self.git_dir / repo_name
             
-            # 備份現有倉庫
             if repo_path.exists():
-                self.backup_repository(repo_name)
-                return self.update_repository(repo)
+                head_before = self.get_head(repo_name)
+                # 先獲取遠程提交，只有HEAD將要變化時才備份；需要重新克隆的倉庫照常先備份
+                fetched = None
+                if (repo_path / ".git").exists() and not needs_reclone(repo_path, self.policy_for(repo)):
+                    with self.network_slots:
+                        success, branch, commit = self.fetch_repository(repo)
+                    if not success:
+                        return False
+                    if commit:
+                        fetched = (branch, commit)
+                
+                snapshot_id = None
+                if fetched is None or fetched[1] != head_before:
+                    with self.disk_slots:
+                        snapshot_id = self.backup_repository(repo_name)
+                else:
+                    logger.info(f"⏭️ 倉庫 {repo_name} 遠程沒有新提交，跳過快照")
+                self.journal.record(repo_name, "updating", snapshot=snapshot_id, head_before=head_before)
+                # 已獲取的提交只需本地合併，不再佔用網絡並發名額
+                with self.network_slots if fetched is None else contextlib.nullcontext():
+                    return self.update_repository(repo, fetched)
             else:
-                return self.clone_repository(repo)
+                self.journal.record(repo_name, "cloning")
+                with self.network_slots:
+                    return self.clone_repository(repo)
                 
         except Exception as e:
             logger.error(f"❌ 同步倉庫 {repo['name']} 時出錯: {e}")
+            self.errors[repo["name"]] = str(e)
             return False
     
-    def sync_repositories(self, repositories: List[Dict]) -> Dict:
-        """同步所有倉庫"""
-        logger.info(f"🚀 開始同步 {len(repositories)} 個倉庫")
+    def _sync_one(self, repo: Dict, emit: Callable[[Dict], None], remote_head: Optional[str] = None) -> Dict:
+        """在工作線程中同步單個倉庫並生成結果記錄"""
+        repo_name = repo["name"]
         
-        results = {
-            "total": len(repositories),
-            "success": 0,
-            "failed": 0,
-            "details": []
+        # 遠程沒有新提交且克隆策略沒有變化時不備份也不pull
+        if remote_head is not None:
+            started = time.monotonic()
+            local_head = self.get_head(repo_name)
+            if local_head == remote_head and self.policy_applied(repo):
+                detail = {
+                    "name": repo_name,
+                    "success": True,
+                    "url": repo["github_url"],
+                    "action": "unchanged",
+                    "duration": round(time.monotonic() - started, 3),
+                    "bytes_fetched": 0,
+                    "old_head": local_head,
+                    "head": local_head,
+                    "finished_at": time.time()
+                }
+                self.journal.record(repo_name, "done", detail=detail)
+                emit({"type": "result", **detail})
+                return detail
+        
+        action = "update" if (self.git_dir / repo_name).exists() else "clone"
+        try:
+            policy = describe(self.policy_for(repo))
+        except ValueError:
+            policy = "invalid"
+        emit({"type": "start", "name": repo_name, "action": action, "clone_policy": policy})
+        
+        size_before = self.object_store_size(repo_name)
+        old_head = self.get_head(repo_name) if action == "update" else None
+        self.errors.pop(repo_name, None)
+        started = time.monotonic()
+        success = self.sync_repository(repo)
+        
+        detail = {
+            "name": repo_name,
+            "success": success,
+            "url": repo["github_url"],
+            "action": action,
+            "duration": round(time.monotonic() - started, 3),
+            "bytes_fetched": max(0, self.object_store_size(repo_name) - size_before),
+            "old_head": old_head,
+            "head": self.get_head(repo_name) if success else None,
+            "clone_policy": policy,
+            "finished_at": time.time()
         }
+        if not success:
+            detail["error"] = (self.errors.pop(repo_name, None) or "").strip()[-500:]
+        self.journal.record(repo_name, "done" if success else "failed", detail=detail)
+        emit({"type": "result", **detail})
+        return detail
+    
+    def recover_repository(self, name: str, record: Dict) -> str:
+        """恢復被中斷時正在克隆或更新的倉庫，返回 rolled_back / finished / failed"""
+        repo_path = self.git_dir / name
+        if record["state"] == "cloning":
+            # 克隆前倉庫不存在，刪除殘留的目錄即可回滾
+            shutil.rmtree(repo_path, ignore_errors=True)
+            return "rolled_back"
+        recover_reclone(repo_path)
+        if not (repo_path / ".git").exists():
+            return "failed"
         
-        for repo in repositories:
-            repo_name = repo["name"]
-            success = self.sync_repository(repo)
+        # 進程已經退出，殘留的鎖文件可以刪除（對象目錄中沒有鎖文件）
+        for root, dirs, files in os.walk(repo_path / ".git"):
+            if root == str(repo_path / ".git"):
+                dirs[:] = [d for d in dirs if d != "objects"]
+            for file in files:
+                if file.endswith(".lock"):
+                    os.remove(os.path.join(root, file))
+        if (repo_path / ".git" / "MERGE_HEAD").exists():
+            subprocess.run(["git", "-C", str(repo_path), "merge", "--abort"], capture_output=True, text=True)
+        
+        status = subprocess.run(["git", "-C", str(repo_path), "status", "--porcelain", "--untracked-files=no"],
+                                capture_output=True, text=True, timeout=CONFIG["timeout"])
+        if status.returncode == 0 and not status.stdout.strip():
+            return "finished"
+        
+        # 檢出只完成了一部分：先嘗試按當前HEAD完成，失敗時用更新前的快照回滾
+        reset = subprocess.run(["git", "-C", str(repo_path), "reset", "--hard", "-q", "HEAD"],
+                               capture_output=True, text=True, timeout=CONFIG["timeout"])
+        if reset.returncode == 0:
+            return "finished"
+        if record.get("snapshot"):
+            try:
+                self.snapshots.restore(name, repo_path, record["snapshot"])
+                return "rolled_back"
+            except Exception as e:
+                logger.error(f"❌ 用快照恢復倉庫 {name} 失敗: {e}")
+        return "failed"
+    
+    def recover_interrupted(self, interrupted: Optional[Dict]):
+        """處理上一次被中斷的同步中未完成的倉庫，調用方需持有日誌鎖"""
+        if not interrupted:
+            return
+        unfinished = self.journal.unfinished(interrupted)
+        logger.warning(f"⚠️ 上一次同步 ({interrupted['run']}) 被中斷，"
+                       f"已完成 {len(self.journal.completed(interrupted))} 個，需要恢復 {len(unfinished)} 個")
+        for name, record in unfinished.items():
+            try:
+                outcome = self.recover_repository(name, record)
+            except Exception as e:
+                logger.error(f"❌ 恢復倉庫 {name} 時出錯: {e}")
+                outcome = "failed"
+            icon = "❌" if outcome == "failed" else "♻️"
+            logger.info(f"{icon} 倉庫 {name} ({record['state']}) 恢復結果: {outcome}")
+            self.journal.record_recovery(name, outcome)
+    
+    def recover(self):
+        """啟動時恢復被中斷的同步，保留日誌供之後 --resume 使用"""
+        interrupted = self.journal.open()
+        try:
+            self.recover_interrupted(interrupted)
+        finally:
+            self.journal.close()
+        return interrupted
+    
+    def sync_repositories(self, repositories: List[Dict],
+                          on_event: Optional[Callable[[Dict], None]] = None,
+                          max_workers: Optional[int] = None, force: bool = False, resume: bool = False) -> Dict:
+        """並發同步所有倉庫，on_event在每個倉庫開始 (start) 和完成 (result) 時被調用
+        
+        除非force為True，先批量查詢遠程HEAD，與本地一致的倉庫直接標記為unchanged。
+        上一次同步被中斷時先恢復未完成的倉庫；resume為True時跳過其中已完成的倉庫，
+        沒有指定倉庫列表則使用被中斷同步的列表。
+        """
+        workers = max(1, max_workers or CONFIG["max_concurrent_syncs"])
+        started_at = time.time()
+        
+        interrupted = self.journal.open()
+        try:
+            self.recover_interrupted(interrupted)
+            completed = self.journal.completed(interrupted) if resume else {}
+            if resume and not repositories and interrupted:
+                repositories = interrupted["repositories"]
             
-            results["details"].append({
-                "name": repo_name,
-                "success": success,
-                "url": repo["github_url"]
-            })
+            # 同名倉庫只同步一次，避免兩個線程操作同一目錄
+            unique = {}
+            for repo in repositories:
+                unique.setdefault(repo["name"], repo)
+            repositories = list(unique.values())
+            self.journal.start(repositories)
             
-            if success:
-                results["success"] += 1
-            else:
-                results["failed"] += 1
+            # 事件回調可能寫同一個輸出流，串行調用；回調失敗不影響其他倉庫的同步
+            event_lock = threading.Lock()
+            event_failed = threading.Event()
+            
+            def emit(event: Dict):
+                if on_event is None or event_failed.is_set():
+                    return
+                with event_lock:
+                    try:
+                        on_event(event)
+                    except Exception as e:
+                        event_failed.set()
+                        logger.warning(f"⚠️ 發送同步事件失敗，後續事件將被丟棄: {e}")
+            
+            # 續傳時已完成的倉庫直接沿用上次的結果，並記入本次日誌以便再次中斷時仍然跳過
+            resumed = {}
+            for repo in repositories:
+                if repo["name"] in completed:
+                    detail = {**completed[repo["name"]], "resumed": True}
+                    resumed[repo["name"]] = detail
+                    self.journal.record(repo["name"], "done", detail=detail)
+                    emit({"type": "result", **detail})
+            pending = [repo for repo in repositories if repo["name"] not in resumed]
+            
+            logger.info(f"🚀 開始同步 {len(pending)} 個倉庫 (並發 {workers})"
+                        + (f"，續傳跳過 {len(resumed)} 個已完成" if resumed else ""))
+            
+            remote_heads = {}
+            if CONFIG["skip_unchanged"] and not force:
+                remote_heads = self.resolve_remote_heads(pending)
+            
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sync") as pool:
+                synced = dict(zip((repo["name"] for repo in pending), pool.map(
+                    lambda repo: self._sync_one(repo, emit, remote_heads.get(repo["name"])), pending
+                )))
+            details = [resumed.get(repo["name"]) or synced[repo["name"]] for repo in repositories]
+            self.journal.finish()
+        finally:
+            # 異常退出時不記錄結束，下一次同步會恢復並可以續傳
+            self.journal.close()
         
-        logger.info(f"🎉 同步完成: {results['success']}/{results['total']} 成功")
+        results = {
+            "total": len(repositories),
+            "success": sum(1 for detail in details if detail["success"]),
+            "failed": sum(1 for detail in details if not detail["success"]),
+            "unchanged": sum(1 for detail in details if detail["action"] == "unchanged"),
+            "resumed": len(resumed),
+            "started_at": started_at,
+            "details": details
+        }
+        
+        logger.info(f"🎉 同步完成: {results['success']}/{results['total']} 成功，{results['unchanged']} 個無變化")
         return results
     
-    def cleanup_old_backups(self, days: int = 7):
-        """清理舊備份"""
+    def shared_object_dependents(self) -> Dict[str, Path]:
+        """所有指向共用對象庫的倉庫和快照"""
+        dependents = {}
+        for name in self.list_repositories():
+            if self.objects.is_attached(self.git_dir / name):
+                dependents[f"repos/{name}"] = self.git_dir / name
+        if self.backup_dir.exists():
+            for path in sorted(self.backup_dir.iterdir()):
+                if path.is_dir() and self.objects.is_attached(path):
+                    dependents[f"backups/{path.name}"] = path
+        return dependents
+    
+    def attach_shared_objects(self) -> int:
+        """讓已有倉庫改用共用對象庫，返回成功的數量"""
+        attached = 0
+        with self.objects.using():
+            for name in self.list_repositories():
+                if is_partial(self.git_dir / name):
+                    logger.info(f"⏭️ 倉庫 {name} 是淺克隆或部分克隆，不加入共用對象庫")
+                    continue
+                if self.objects.attach(self.git_dir / name, f"repos/{name}"):
+                    attached += 1
+                    logger.info(f"🔗 倉庫 {name} 已使用共用對象庫")
+        return attached
+    
+    def gc_shared_objects(self) -> Dict:
+        """刷新所有依賴者的引用後回收共用對象庫，並刪除依賴者中的重複對象"""
+        dependents = self.shared_object_dependents()
+        logger.info(f"🧹 回收共用對象庫 ({len(dependents)} 個依賴者)...")
+        result = self.objects.gc(dependents)
+        shared, local = self.objects.usage(dependents)
+        result.update({"shared_bytes": shared, "local_bytes": local})
+        logger.info(f"✅ 共用對象庫回收完成: {result['bytes_before'] / 1024 / 1024:.1f} MB -> "
+                    f"{result['bytes_after'] / 1024 / 1024:.1f} MB，依賴者本地對象 {local / 1024 / 1024:.1f} MB")
+        return result
+    
+    def cleanup_old_backups(self, days: Optional[int] = None, wait: bool = False, dry_run: bool = False) -> Dict:
+        """按保留策略清理快照，刪除在後台進行；days指定時超過天數的快照只保留每個倉庫最新的幾個"""
         try:
-            logger.info(f"🧹 清理 {days} 天前的備份...")
-            
-            result = subprocess.run([
-                "find", str(self.backup_dir), "-type", "d", 
-                "-mtime", f"+{days}", "-exec", "rm", "-rf", "{}", "+"
-            ], capture_output=True, text=True)
-            
-            if result.returncode == 0:
-                logger.info("✅ 舊備份清理完成")
-            else:
-                logger.warning(f"⚠️ 清理備份時出現警告: {result.stderr}")
+            policy = {"max_age_days": days} if days is not None else None
+            summary = self.retention.apply(policy, dry_run=dry_run)
+            if summary["expired"]:
+                logger.info(f"🧹 {'將' if dry_run else '已'}清理 {summary['expired']} 個快照 "
+                            f"({summary['bytes_freed'] / 1024 / 1024:.1f} MB, {summary['reasons']})，"
+                            f"保留 {summary['kept']} 個 ({summary['bytes_kept'] / 1024 / 1024:.1f} MB)")
+            if wait:
+                self.retention.wait()
+            return summary
                 
         except Exception as e:
             logger.error(f"❌ 清理備份時出錯: {e}")
+            return {}
     
     def generate_report(self, results: Dict, source_info: Dict = None) -> str:
-        """生成同步報告"""
+        """把本次同步寫入同步歷史，返回 <數據庫>#run=<ID>"""
         try:
-            report = {
-                "sync_time": datetime.now().isoformat(),
-                "platform": "ec2",
-                "source": source_info or {},
-                "results": results,
-                "git_directory": str(self.git_dir),
-                "backup_directory": str(self.backup_dir)
-            }
-            
-            report_file = f"/tmp/trae_sync_report_ec2_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-            with open(report_file, "w", encoding="utf-8") as f:
-                json.dump(report, f, indent=2, ensure_ascii=False)
-            
-            logger.info(f"📊 同步報告已保存: {report_file}")
-            return report_file
+            run_id = self.history.record_run(results, results.get("started_at") or time.time(), source_info)
+            report = f"{self.history.db_path}#run={run_id}"
+            logger.info(f"📊 同步記錄已保存: {report}")
+            return report
             
         except Exception as e:
             logger.error(f"生成同步報告時出錯: {e}")
@@ -238,63 +672,155 @@ class GitRepositorySync:
 def main():
     """主函數"""
     parser = argparse.ArgumentParser(description="Git Repository Sync Tool (EC2端)")
-    parser.add_argument("--repo-list", help="倉庫列表JSON文件路徑")
-    parser.add_argument("--cleanup", action="store_true", help="清理舊備份")
+    parser.add_argument("--repo-list", help="倉庫列表JSON文件路徑 (- 表示從標準輸入讀取NDJSON)")
+    parser.add_argument("--no-compress", action="store_true", help="流式模式下輸出不壓縮的NDJSON")
+    parser.add_argument("--force", action="store_true", help="不檢查遠程HEAD，強制備份並更新所有倉庫")
+    parser.add_argument("--resume", action="store_true",
+                        help="續傳被中斷的同步，跳過其中已完成的倉庫 (未指定 --repo-list 時使用上次的倉庫列表)")
+    parser.add_argument("--workers", type=int, help=f"並發同步的倉庫數 (默認: {CONFIG['max_concurrent_syncs']})")
+    parser.add_argument("--cleanup", action="store_true", help="按保留策略清理舊備份")
+    parser.add_argument("--dry-run", action="store_true", help="--cleanup 只列出將刪除的快照")
+    parser.add_argument("--reindex-backups", action="store_true", help="遍歷備份目錄重建備份索引")
     parser.add_argument("--status", action="store_true", help="顯示倉庫狀態")
+    parser.add_argument("--report", action="store_true", help="顯示同步歷史統計 (耗時百分位、最慢倉庫、失敗率)")
+    parser.add_argument("--days", type=float, default=7, help="--report 統計的天數 (默認: 7)")
+    parser.add_argument("--top", type=int, default=10, help="--report 列出的倉庫數 (默認: 10)")
+    parser.add_argument("--json", action="store_true", help="--report 輸出JSON")
+    parser.add_argument("--list-backups", metavar="REPO", help="列出倉庫的快照")
+    parser.add_argument("--restore", metavar="REPO", help="用快照恢復倉庫 (默認最新的快照)")
+    parser.add_argument("--snapshot", help="--restore 使用的快照ID")
+    parser.add_argument("--benchmark-backup", metavar="REPO", help="比較各快照後端的耗時和磁盤佔用")
+    parser.add_argument("--rounds", type=int, default=3, help="--benchmark-backup 每個後端的輪數")
+    parser.add_argument("--attach-shared", action="store_true", help="讓已有倉庫改用共用對象庫")
+    parser.add_argument("--gc-shared", action="store_true", help="回收共用對象庫中無引用的對象")
     
     args = parser.parse_args()
     
-    print("🚀 Git Repository Sync Tool (EC2端)")
-    print("=" * 50)
+    # 流式模式和JSON報告下標準輸出只用於結果，日誌和提示改寫到標準錯誤
+    streaming = args.repo_list == "-"
+    out = sys.stderr if streaming or args.json else sys.stdout
+    setup_logging(out)
+    
+    print("🚀 Git Repository Sync Tool (EC2端)", file=out)
+    print("=" * 50, file=out)
     
     sync_tool = GitRepositorySync()
     
     try:
+        if args.report:
+            report = sync_tool.history.report(days=args.days, top=args.top)
+            print(json.dumps(report, indent=2, ensure_ascii=False) if args.json else format_report(report))
+            return
+        
+        if args.reindex_backups:
+            count = sync_tool.backup_index.rebuild()
+            print(f"📇 備份索引: {count} 個快照，{sync_tool.backup_index.total_bytes() / 1024 / 1024:.1f} MB")
+            return
+        
         if args.cleanup:
-            sync_tool.cleanup_old_backups()
+            summary = sync_tool.cleanup_old_backups(wait=True, dry_run=args.dry_run)
+            for snapshot_id, reason in sorted(summary.get("snapshots", {}).items()):
+                print(f"   🗑️ {snapshot_id} ({reason})")
+            print(f"🧹 {'將' if args.dry_run else '已'}清理 {summary.get('expired', 0)} 個快照，"
+                  f"保留 {summary.get('kept', 0)} 個 ({summary.get('bytes_kept', 0) / 1024 / 1024:.1f} MB)")
             return
         
         if args.status:
             # 顯示倉庫狀態
-            git_dir = Path(CONFIG["git_directory"])
-            if git_dir.exists():
-                repos = [d for d in git_dir.iterdir() if d.is_dir() and (d / ".git").exists()]
-                print(f"📦 發現 {len(repos)} 個Git倉庫:")
-                for repo in repos:
-                    print(f"   📁 {repo.name}")
-            else:
-                print("📦 Git目錄不存在")
+            repos = sync_tool.list_repositories()
+            print(f"📦 發現 {len(repos)} 個Git倉庫:")
+            for repo in repos:
+                print(f"   📁 {repo} ({describe(applied_policy(sync_tool.git_dir / repo) or {})})")
             return
         
-        if args.repo_list:
-            # 從文件讀取倉庫列表
-            with open(args.repo_list, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            
-            repositories = data.get("repositories", [])
-            source_info = {
-                "sync_time": data.get("sync_time"),
-                "source": data.get("source")
-            }
+        if args.attach_shared:
+            attached = sync_tool.attach_shared_objects()
+            print(f"🔗 {attached} 個倉庫已使用共用對象庫 {sync_tool.objects.path}")
+            return
+        
+        if args.gc_shared:
+            result = sync_tool.gc_shared_objects()
+            print(f"🧹 共用對象庫: {result['shared_bytes'] / 1024 / 1024:.1f} MB，"
+                  f"{result['dependents']} 個依賴者本地對象: {result['local_bytes'] / 1024 / 1024:.1f} MB")
+            return
+        
+        if args.list_backups:
+            snapshots = sync_tool.snapshots.list_snapshots(args.list_backups)
+            print(f"📦 倉庫 {args.list_backups} 有 {len(snapshots)} 個快照:")
+            for info in snapshots:
+                print(f"   🗂️ {info['id']}  {info['backend']}  {(info.get('head') or '-')[:12]}  {info['created']}")
+            return
+        
+        if args.restore:
+            info = sync_tool.snapshots.restore(args.restore, sync_tool.git_dir / args.restore, args.snapshot)
+            print(f"♻️ 倉庫 {args.restore} 已恢復到快照 {info['id']} ({(info.get('head') or '-')[:12]})")
+            return
+        
+        if args.benchmark_backup:
+            repo_path = sync_tool.git_dir / args.benchmark_backup
+            if not repo_path.exists():
+                logger.error(f"倉庫不存在: {repo_path}")
+                sys.exit(1)
+            print(f"⏱️ 快照後端對比 ({args.benchmark_backup}, {args.rounds} 輪取中位數):")
+            for result in benchmark(repo_path, BACKENDS, args.rounds):
+                print(f"   {result['backend']:<18} {result['duration']:.3f}s  {result['bytes_written'] / 1024 / 1024:.2f} MB")
+            return
+        
+        if args.repo_list or args.resume:
+            writer = None
+            repositories, source_info = [], {}
+            if streaming:
+                # 從標準輸入讀取倉庫列表，結果逐個寫回標準輸出
+                repositories, source_info = read_repo_stream(sys.stdin.buffer)
+                writer = NDJSONWriter(sys.stdout.buffer, compress=not args.no_compress)
+            elif args.repo_list:
+                # 從文件讀取倉庫列表
+                with open(args.repo_list, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                
+                repositories = data.get("repositories", [])
+                source_info = {
+                    "sync_time": data.get("sync_time"),
+                    "source": data.get("source")
+                }
             
-            if not repositories:
+            if not repositories and not args.resume:
                 logger.error("倉庫列表為空")
                 sys.exit(1)
             
-            # 執行同步
-            results = sync_tool.sync_repositories(repositories)
+            # 執行同步，流式模式下每個倉庫的開始和結果事件立即寫回
+            results = sync_tool.sync_repositories(repositories, on_event=writer.write if writer else None,
+                                                  max_workers=args.workers, force=args.force, resume=args.resume)
+            if not results["total"] and writer is None:
+                print("ℹ️ 沒有需要續傳的同步", file=out)
+                return
             
             # 生成報告
             report_file = sync_tool.generate_report(results, source_info)
             
-            # 清理舊備份
+            # 清理舊備份，刪除在後台進行，退出前等待完成
             sync_tool.cleanup_old_backups()
             
-            print(f"\n📊 同步結果:")
-            print(f"   總計: {results['total']}")
-            print(f"   成功: {results['success']}")
-            print(f"   失敗: {results['failed']}")
-            print(f"   報告: {report_file}")
+            if writer is not None:
+                writer.write({
+                    "type": "summary",
+                    "total": results["total"],
+                    "success": results["success"],
+                    "failed": results["failed"],
+                    "unchanged": results["unchanged"],
+                    "report": report_file
+                })
+                writer.close()
+            
+            print(f"\n📊 同步結果:", file=out)
+            print(f"   總計: {results['total']}", file=out)
+            print(f"   成功: {results['success']}", file=out)
+            print(f"   失敗: {results['failed']}", file=out)
+            print(f"   無變化: {results['unchanged']}", file=out)
+            if results["resumed"]:
+                print(f"   續傳跳過: {results['resumed']}", file=out)
+            print(f"   報告: {report_file}", file=out)
+            sync_tool.retention.wait()
             
         else:
             print("❌ 請指定倉庫列表文件 (--repo-list)")